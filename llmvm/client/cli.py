@@ -37,6 +37,7 @@ from threading import Event
 
 from llmvm.client.printing import StreamPrinter, markdown__rich_console__, print_response, print_thread, stream_response
 from llmvm.client.client import LLMVMClient
+from llmvm.common import stream_wire
 from llmvm.common.container import Container
 from llmvm.common.helpers import Helpers
 from llmvm.common.logging_helpers import setup_logging
@@ -962,7 +963,12 @@ def url(
                 response.raise_for_status()
 
             async with httpx.AsyncClient(timeout=400.0) as client:
-                async with client.stream('POST', f'{endpoint}/download', json=item.model_dump()) as response:
+                async with client.stream(
+                    'POST',
+                    f'{endpoint}/download',
+                    json=item.model_dump(),
+                    headers={'Accept': stream_wire.accept_header()},
+                ) as response:
                     objs = await stream_response(response, StreamPrinter('').write)
             await response.aclose()
 
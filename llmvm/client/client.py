@@ -5,7 +5,9 @@ import nest_asyncio
 
 from pydantic import TypeAdapter
 
-from llmvm.common.objects import Message, User, Content, Assistant, Executor, AstNode, SessionThread, MessageModel
+from llmvm.common import stream_wire
+from llmvm.common.blob_store import RemoteBlobStore, get_default_blob_store, set_default_blob_store
+from llmvm.common.objects import Message, User, Content, Assistant, Executor, AstNode, SessionThread, SessionThreadDelta, MessageModel
 from llmvm.common.container import Container
 from llmvm.common.openai_executor import OpenAIExecutor
 from llmvm.common.anthropic_executor import AnthropicExecutor
@@ -13,7 +15,7 @@ from llmvm.common.gemini_executor import GeminiExecutor
 from llmvm.common.logging_helpers import setup_logging
 from llmvm.client.parsing import parse_message_thread, parse_message_actions
 from llmvm.client.printing import StreamPrinter, stream_response
-from typing import Awaitable, Callable, Optional, List, Dict, Any, Sequence, Union, cast
+from typing import Awaitable, Callable, Optional, List, Dict, Any, Sequence, Tuple, Union, cast
 
 
 logging = setup_logging()
@@ -30,6 +32,11 @@ async def default_stream_handler(node: AstNode):
     await _printer.write(node)  # type: ignore
 
 
+# last known server copy of each thread, keyed by (endpoint, thread id). this lets
+# LLMVMClient.call() send only new messages to /v1/tools/completions_delta
+_thread_cache: Dict[Tuple[str, int], SessionThread] = {}
+
+
 def llm(
     messages: list[Message] | list[str] | str,
     executor: Optional[Executor] = None,
@@ -136,6 +143,14 @@ class LLMVMClient():
         self.role_strings = ['Assistant: ', 'System: ', 'User: ']
         self.action_strings = ['[ImageContent(', '[PdfContent(', '[FileContent(']
 
+        # server threads reference image, pdf and file content by hash, fetch it from this endpoint
+        default_blob_store = get_default_blob_store()
+        if (
+            default_blob_store is None
+            or (isinstance(default_blob_store, RemoteBlobStore) and default_blob_store.api_endpoint != api_endpoint)
+        ):
+            set_default_blob_store(RemoteBlobStore(api_endpoint))
+
     def __set_defaults(self, executor: str, model: str, api_key: str):
         executor_instance = self.get_executor(executor, model, api_key)
         self.default_executor = executor_instance
@@ -253,8 +268,79 @@ class LLMVMClient():
         }
         response: httpx.Response = httpx.get(f'{self.api_endpoint}/v1/chat/get_thread', params=params)
         thread = SessionThread.model_validate(response.json())
+        self.__cache_thread(thread)
         return thread
 
+    def __cache_thread(self, thread: SessionThread) -> None:
+        _thread_cache[(self.api_endpoint, thread.id)] = thread.model_copy(update={'messages': list(thread.messages)})
+
+    def __cached_thread(self, id: int) -> Optional[SessionThread]:
+        cached = _thread_cache.get((self.api_endpoint, id))
+        if cached:
+            return cached.model_copy(update={'messages': list(cached.messages)})
+        return None
+
+    async def __post_thread(
+        self,
+        endpoint: str,
+        payload: Dict[str, Any],
+    ) -> Tuple[int, List[Any]]:
+        async with httpx.AsyncClient(timeout=400.0) as client:
+            async with client.stream(
+                'POST',
+                f'{self.api_endpoint}/v1{endpoint}',
+                json=payload,
+                headers={'Accept': stream_wire.accept_header()},
+            ) as response:
+                if response.status_code == 409:
+                    await response.aread()
+                    return response.status_code, []
+                objs = await stream_response(response, StreamPrinter('').write)
+
+        await response.aclose()
+        return response.status_code, objs
+
+    async def __call_delta(
+        self,
+        endpoint: str,
+        thread: SessionThread,
+        server_messages: List[MessageModel],
+        new_messages: List[MessageModel],
+    ) -> Optional[SessionThread]:
+        # send only the new messages, and get back only the new assistant messages.
+        # returns None if the server's copy of the thread is a different version.
+        delta = SessionThreadDelta(
+            id=thread.id,
+            version=thread.version,
+            executor=thread.executor,
+            model=thread.model,
+            current_mode=thread.current_mode,
+            compression=thread.compression,
+            temperature=thread.temperature,
+            stop_tokens=thread.stop_tokens,
+            output_token_len=thread.output_token_len,
+            cookies=thread.cookies,
+            messages=new_messages,
+        )
+        status_code, objs = await self.__post_thread(f'{endpoint}_delta', delta.model_dump())
+
+        if status_code == 409:
+            return None
+
+        if not objs:
+            return thread
+
+        delta = SessionThreadDelta.model_validate(objs[-1])
+        session_thread = thread.model_copy(update={
+            'id': delta.id,
+            'version': delta.version,
+            'executor': delta.executor,
+            'model': delta.model,
+            'messages': server_messages + new_messages + delta.messages,
+        })
+        self.__cache_thread(session_thread)
+        return session_thread
+
     async def set_thread(
         self,
         thread: SessionThread,
@@ -313,8 +399,23 @@ class LLMVMClient():
         # deal with weird message types and inputs
         thread_messages: List[Message] = []
 
+        # the messages the server already has for this thread. when we know what
+        # the server has, only the new messages get sent in a delta call.
+        server_messages: List[MessageModel] = []
+        send_delta = False
+
         if isinstance(thread, SessionThread):
-            thread_messages = [MessageModel.to_message(session_message) for session_message in thread.messages]
+            cached = self.__cached_thread(thread.id) if thread.id > 0 else None
+            if (
+                cached
+                and cached.version == thread.version
+                and thread.messages[:len(cached.messages)] == cached.messages
+            ):
+                server_messages = cached.messages
+                thread_messages = [MessageModel.to_message(m) for m in thread.messages[len(cached.messages):]]
+                send_delta = True
+            else:
+                thread_messages = [MessageModel.to_message(session_message) for session_message in thread.messages]
         elif isinstance(messages, list):
             thread_messages = messages
 
@@ -325,12 +426,13 @@ class LLMVMClient():
                 response = await client.get(f'{self.api_endpoint}/health')
                 response.raise_for_status()
 
+            resync_from_server = isinstance(thread, int)
             if isinstance(thread, int):
-                thread = await self.get_thread(thread)
+                cached = self.__cached_thread(thread) if thread > 0 else None
+                thread = cached if cached else await self.get_thread(thread)
                 # server thread has messages, so we append thread_messages to it
-                if thread.messages:
-                    server_thread_messages = [MessageModel.to_message(session_message) for session_message in thread.messages]
-                    thread_messages = server_thread_messages + thread_messages
+                server_messages = thread.messages
+                send_delta = True
 
             if not executor_name: executor_name = self.default_executor.name()
             if not model_name: model_name = self.model
@@ -349,24 +451,29 @@ class LLMVMClient():
             if mode:
                 thread.current_mode = mode
 
-            # attach the messages to the thread
-            thread.messages = [MessageModel.from_message(message) for message in thread_messages]
-
             if mode == 'direct' or mode == 'tool' or mode == 'auto':
                 endpoint = '/tools/completions'
 
-            async with httpx.AsyncClient(timeout=400.0) as client:
-                async with client.stream(
-                    'POST',
-                    f'{self.api_endpoint}/v1{endpoint}',
-                    json=thread.model_dump(),
-                ) as response:
-                    objs = await stream_response(response, StreamPrinter('').write)
+            new_messages = [MessageModel.from_message(message) for message in thread_messages]
 
-            await response.aclose()
+            if send_delta:
+                session_thread = await self.__call_delta(endpoint, thread, server_messages, new_messages)
+                if session_thread:
+                    return session_thread
+
+                # the server copy of the thread has changed underneath us, do a full resync
+                logging.debug(f'LLMVMClient.call() thread {thread.id} version {thread.version} is stale, sending full thread.')
+                if resync_from_server:
+                    server_thread = await self.get_thread(thread.id)
+                    server_messages = server_thread.messages
+                    thread.version = server_thread.version
+
+            thread.messages = server_messages + new_messages
+            _, objs = await self.__post_thread(endpoint, thread.model_dump())
 
             if objs:
                 session_thread = SessionThread.model_validate(objs[-1])
+                self.__cache_thread(session_thread)
                 return session_thread
             return thread
 
@@ -383,6 +490,8 @@ class LLMVMClient():
         if executor_name:
             executor = self.get_executor(executor_name, model_name, None)
 
+        thread_messages = [MessageModel.to_message(m) for m in server_messages] + thread_messages
+
         # server is down, go direct. this means that executor and model can't be nothing
         assistant = await self.call_direct(
             messages=thread_messages,
@@ -14,6 +14,7 @@ from rich.markdown import CodeBlock, Markdown
 from rich.syntax import Syntax
 from rich.text import Text
 
+from llmvm.common import stream_wire
 from llmvm.common.helpers import Helpers
 from llmvm.common.logging_helpers import setup_logging
 from llmvm.common.objects import MarkdownContent, Message, Content, ImageContent, PdfContent, FileContent, AstNode, TokenStopNode, StreamNode, SessionThread, MessageModel
@@ -52,6 +53,27 @@ async def stream_response(response, print_lambda: Callable[[Any], Awaitable]) ->
             return False
 
     response_objects = []
+
+    if stream_wire.response_version(response.headers.get('content-type')) >= 2:
+        decoder = stream_wire.StreamDecoder()
+        async with async_timeout.timeout(400):
+            try:
+                async for raw_bytes in response.aiter_raw():
+                    for data in decoder.feed(raw_bytes):
+                        if isinstance(data, (Content, TokenStopNode, StreamNode)):
+                            await print_lambda(data if isinstance(data, StreamNode) else str(data))
+                        elif isinstance(data, (AstNode, dict, list)):
+                            response_objects.append(data)
+                        else:
+                            await print_lambda(strip_string(str(data)))
+            except asyncio.TimeoutError as ex:
+                logging.exception(ex)
+                raise ex
+            except KeyboardInterrupt as ex:
+                await response.aclose()
+                raise ex
+        return response_objects
+
     async with async_timeout.timeout(400):
         try:
             buffer = ''
@@ -6,8 +6,10 @@ from typing import Any, Awaitable, Callable, Dict, List, Optional, cast
 from anthropic import AI_PROMPT, HUMAN_PROMPT, AsyncAnthropic
 from anthropic.types.message import Message as AnthropicMessage
 
+from llmvm.common.client_pool import ClientPool
 from llmvm.common.container import Container
 from llmvm.common.helpers import Helpers
+from llmvm.common.image_cache import get_image_cache
 from llmvm.common.logging_helpers import messages_trace, setup_logging
 from llmvm.common.object_transformers import ObjectTransformers
 from llmvm.common.objects import (Assistant, AstNode, BrowserContent, Content, Executor,
@@ -15,6 +17,9 @@ from llmvm.common.objects import (Assistant, AstNode, BrowserContent, Content, E
                                   Message, PdfContent, System, TokenStopNode,
                                   User, awaitable_none)
 from llmvm.common.perf import TokenPerf, TokenStreamManager
+from llmvm.common.response_cache import ResponseCache, get_response_cache
+from llmvm.common.token_cache import get_token_count_cache
+from llmvm.common.token_estimator import TokenEstimator, get_token_estimator
 
 logging = setup_logging()
 
@@ -40,8 +45,16 @@ class AnthropicExecutor(Executor):
             default_max_token_len=default_max_token_len,
             default_max_output_len=default_max_output_len,
         )
-        self.client = AsyncAnthropic(api_key=api_key, base_url=api_endpoint)
+        self.api_key = api_key
         self.max_images = max_images
+        # 'estimate' budgets with the local TokenEstimator and only asks the api near a limit,
+        # only worth turning on once scripts/benchmark_token_estimator.py --calibrate has run
+        self.token_counting = Container.get_config_variable('anthropic_token_counting', 'LLMVM_ANTHROPIC_TOKEN_COUNTING', default='remote')  # noqa E501
+
+    @property
+    def client(self) -> AsyncAnthropic:
+        # shared across executors and requests, see ClientPool
+        return ClientPool().anthropic(self.api_key, self.api_endpoint)
 
     def user_token(self):
         return 'User'
@@ -200,16 +213,17 @@ class AnthropicExecutor(Executor):
         counter = 1
         for i in range(len(messages)):
             if isinstance(messages[i], User) and isinstance(messages[i].message, ImageContent):
-                # figure out
-                if 'image/unknown' not in Helpers.classify_image(messages[i].message.sequence):
+                # resized and encoded once per image, unknown image types are dropped
+                encoded = get_image_cache().encode('anthropic', messages[i].message.sequence)
+                if encoded:
                     wrapped.append({
                         'role': 'user',
                         'content': [{
                                 'type': 'image',
                                 'source': {
                                     "type": "base64",
-                                    "media_type": Helpers.classify_image(messages[i].message.sequence),
-                                    "data": base64.b64encode(Helpers.anthropic_resize(messages[i].message.sequence)).decode('utf-8')  # type: ignore
+                                    "media_type": encoded.mime_type,
+                                    "data": encoded.data,
                                 }
                         }]
                     })
@@ -252,18 +266,39 @@ class AnthropicExecutor(Executor):
                 })
         return wrapped
 
+    def token_estimator(self) -> Optional[TokenEstimator]:
+        if self.token_counting != 'estimate':
+            return None
+        return get_token_estimator(self.name())
+
     async def count_tokens(
         self,
         messages: List[Message] | List[Dict[str, str]] | str,
         model: Optional[str] = None,
+        exact: bool = False,
     ) -> int:
+        estimator = None if exact else self.token_estimator()
+
         async def tokenizer_len(content: str | List) -> int:
             # image should have already been resized
             if isinstance(content, list) and len(content) > 0 and isinstance(content[0], dict) and 'source' in content[0]:
-                token_count = Helpers.anthropic_image_tok_count(content[0]['source']['data'])
+                token_count = get_image_cache().tokens_for('anthropic', content[0]['source']['data'])
+                if token_count is None:
+                    token_count = Helpers.anthropic_image_tok_count(content[0]['source']['data'])
                 return token_count
 
-            token_count = await self.client.count_tokens(str(content))
+            # calibrated upper bound, no network
+            if estimator:
+                if isinstance(content, list):
+                    return int(estimator.upper_batch([
+                        c['text'] if isinstance(c, dict) and 'text' in c else str(c) for c in content
+                    ]).sum())
+                return estimator.upper(str(content))
+
+            # remote call, so memoize by content
+            token_count = await get_token_count_cache().aget_or_count(
+                self.name(), model or self.default_model, str(content), self.client.count_tokens
+            )
             return token_count
 
         async def num_tokens_from_messages(messages):
@@ -301,6 +336,11 @@ class AnthropicExecutor(Executor):
             raise NotImplementedError('functions are not implemented for ClaudeExecutor')
 
         message_tokens = await self.count_tokens(messages=messages, model=model)
+        estimator = self.token_estimator()
+        if estimator and estimator.within_margin(message_tokens, self.max_input_tokens(max_output_tokens, model=model)):
+            # the estimate can't tell whether this fits, so count it properly
+            message_tokens = await self.count_tokens(messages=messages, model=model, exact=True)
+
         if message_tokens > self.max_input_tokens(max_output_tokens, model=model):
             raise Exception('Prompt too long. input tokens: {}, requested output tokens: {}, total: {}, models {} max context window is: {}'
                             .format(message_tokens,
@@ -417,25 +457,45 @@ class AnthropicExecutor(Executor):
         elif messages_list[0]['role'] == 'assistant':
             logging.error(f'First message must be from the user, not assistant: {messages_list}')
 
-        stream = self.aexecute_direct(
-            messages_list,
-            max_output_tokens=max_output_tokens,
-            model=model,
-            temperature=temperature,
-            stop_tokens=stop_tokens,
-        )
+        response_cache = get_response_cache()
+        cache_key = ResponseCache.key(self.name(), model, messages_list, stop_tokens, max_output_tokens) if response_cache.cacheable(temperature) else ''  # noqa E501
+        cached = response_cache.get(cache_key) if cache_key else None
 
         text_response = ''
         perf = None
 
-        async with await stream as stream_async:  # type: ignore
-            async for text in stream_async:
-                await stream_handler(Content(text))
-                text_response += text
-            await stream_handler(TokenStopNode())
-            perf = stream_async.perf
+        if cached:
+            text_response = cached['response']
+            perf = await response_cache.replay(cached, stream_handler, self.name(), model)
+            # aexecute_direct pulls the system message out of messages_list, keep the conversation the same shape
+            messages_list = [m for m in messages_list if m['role'] != 'system']
+        else:
+            stream = self.aexecute_direct(
+                messages_list,
+                max_output_tokens=max_output_tokens,
+                model=model,
+                temperature=temperature,
+                stop_tokens=stop_tokens,
+            )
 
-        await stream_async.get_final_message()  # this forces an update to the perf object
+            async with await stream as stream_async:  # type: ignore
+                async for text in stream_async:
+                    await stream_handler(Content(text))
+                    text_response += text
+                await stream_handler(TokenStopNode())
+                perf = stream_async.perf
+
+            await stream_async.get_final_message()  # this forces an update to the perf object
+
+            if cache_key:
+                response_cache.put(
+                    cache_key,
+                    text_response,
+                    stop_reason=perf.stop_reason,
+                    stop_token=perf.stop_token,
+                    prompt_tokens=perf._prompt_len,
+                    completion_tokens=perf._completion_len,
+                )
         perf.log()
 
         messages_list.append({'role': 'assistant', 'content': [{'type': 'text', 'text': text_response}]})
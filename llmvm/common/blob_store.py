@@ -0,0 +1,157 @@
+import contextlib
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Iterator, Optional
+
+import httpx
+
+from llmvm.common.logging_helpers import setup_logging
+
+logging = setup_logging()
+
+
+class BlobStore(ABC):
+    """
+    Content addressed store for the bytes behind ImageContent, PdfContent and FileContent.
+    MessageModel carries the sha256 of the bytes instead of inlining them as base64.
+    """
+    @staticmethod
+    def hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def filename(blob_hash: str) -> str:
+        return f'{blob_hash}.blob'
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        pass
+
+    @abstractmethod
+    def get(self, blob_hash: str) -> bytes:
+        pass
+
+    @abstractmethod
+    def has(self, blob_hash: str) -> bool:
+        pass
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Server side store. Blobs are written once as {sha256}.blob into directory (the cdn_directory),
+    so the existing /cdn/{filename} route serves them to clients.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, blob_hash: str) -> str:
+        return os.path.join(self.directory, BlobStore.filename(blob_hash))
+
+    def put(self, data: bytes) -> str:
+        blob_hash = BlobStore.hash(data)
+        if self.has(blob_hash):
+            return blob_hash
+
+        # write to a temp file and rename, so readers never see a partial blob
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, self.path(blob_hash))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return blob_hash
+
+    def get(self, blob_hash: str) -> bytes:
+        with open(self.path(blob_hash), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:]
+
+    @contextlib.contextmanager
+    def view(self, blob_hash: str) -> Iterator[memoryview]:
+        # zero-copy, read only view for callers that can work with a buffer. the view is only
+        # valid inside the with block, the mapping is closed on the way out
+        with open(self.path(blob_hash), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield memoryview(b'')
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    def has(self, blob_hash: str) -> bool:
+        return os.path.exists(self.path(blob_hash))
+
+
+class RemoteBlobStore(BlobStore):
+    """
+    Client side store. Blobs are fetched lazily from the server's /cdn/{filename} route
+    and kept in a byte-bounded LRU.
+    """
+    def __init__(self, api_endpoint: str, max_bytes: int = 256 * 1024 * 1024):
+        self.api_endpoint = api_endpoint
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.cache: OrderedDict[str, bytes] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, data: bytes) -> str:
+        # the client never uploads blobs directly, content goes to the server inline
+        # in MessageModel and the server stores it.
+        blob_hash = BlobStore.hash(data)
+        self.__cache(blob_hash, data)
+        return blob_hash
+
+    def get(self, blob_hash: str) -> bytes:
+        with self.lock:
+            if blob_hash in self.cache:
+                self.cache.move_to_end(blob_hash)
+                return self.cache[blob_hash]
+
+        response = httpx.get(f'{self.api_endpoint}/cdn/{BlobStore.filename(blob_hash)}', timeout=400.0)
+        response.raise_for_status()
+        data = response.content
+
+        if BlobStore.hash(data) != blob_hash:
+            raise ValueError(f'Blob {blob_hash} fetched from {self.api_endpoint} failed hash verification')
+
+        self.__cache(blob_hash, data)
+        return data
+
+    def has(self, blob_hash: str) -> bool:
+        return blob_hash in self.cache
+
+    def __cache(self, blob_hash: str, data: bytes) -> None:
+        with self.lock:
+            if blob_hash in self.cache:
+                return
+            self.cache[blob_hash] = data
+            self.current_bytes += len(data)
+            while self.current_bytes > self.max_bytes and len(self.cache) > 1:
+                _, evicted = self.cache.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+
+_default_blob_store: Optional[BlobStore] = None
+
+
+def set_default_blob_store(store: Optional[BlobStore]) -> None:
+    global _default_blob_store
+    _default_blob_store = store
+
+
+def get_default_blob_store() -> Optional[BlobStore]:
+    return _default_blob_store
@@ -0,0 +1,141 @@
+import asyncio
+import importlib.util
+import threading
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import httpx
+
+from llmvm.common.container import Container
+from llmvm.common.logging_helpers import setup_logging
+from llmvm.common.singleton import Singleton
+
+logging = setup_logging()
+
+
+class ClientPool(metaclass=Singleton):
+    """
+    Long lived SDK clients keyed by (provider, endpoint, api_key), all sitting on one shared
+    keep-alive httpx connection pool, so requests reuse warm TLS connections instead of building
+    a new client (and pool) per request. Async clients are additionally keyed by event loop, as an
+    httpx AsyncClient's connections belong to the loop that opened them.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> (owning loop or None, client)
+        self.clients: Dict[Hashable, Tuple[Optional[asyncio.AbstractEventLoop], Any]] = {}
+        self.max_connections = int(Container.get_config_variable('http_pool_max_connections', 'LLMVM_HTTP_POOL_MAX_CONNECTIONS', default=100))  # noqa E501
+        self.max_keepalive_connections = int(Container.get_config_variable('http_pool_max_keepalive', 'LLMVM_HTTP_POOL_MAX_KEEPALIVE', default=20))  # noqa E501
+        self.keepalive_expiry = float(Container.get_config_variable('http_pool_keepalive_expiry', 'LLMVM_HTTP_POOL_KEEPALIVE_EXPIRY', default=300))  # noqa E501
+        # http2 needs the optional h2 package, fall back to keep-alive http/1.1 without it
+        self.http2 = bool(Container.get_config_variable('http2', 'LLMVM_HTTP2', default=True)) and importlib.util.find_spec('h2') is not None  # noqa E501
+
+    def __limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def __running_loop(self) -> Optional[asyncio.AbstractEventLoop]:
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+
+    def __get_or_create(self, key: Tuple, factory, per_loop: bool) -> Any:
+        loop = self.__running_loop() if per_loop else None
+        if per_loop:
+            key = key + (id(loop),)
+
+        with self.lock:
+            entry = self.clients.get(key)
+            if entry and not (entry[0] and entry[0].is_closed()):
+                return entry[1]
+
+            # loops that have gone away take their connections with them
+            for stale in [k for k, (client_loop, _) in self.clients.items() if client_loop and client_loop.is_closed()]:
+                del self.clients[stale]
+
+        client = factory()
+        with self.lock:
+            self.clients.setdefault(key, (loop, client))
+            return self.clients[key][1]
+
+    def async_http_client(self) -> httpx.AsyncClient:
+        return self.__get_or_create(
+            ('httpx_async',),
+            lambda: httpx.AsyncClient(http2=self.http2, limits=self.__limits(), timeout=600.0),
+            per_loop=True,
+        )
+
+    def http_client(self) -> httpx.Client:
+        return self.__get_or_create(
+            ('httpx',),
+            lambda: httpx.Client(http2=self.http2, limits=self.__limits(), timeout=600.0),
+            per_loop=False,
+        )
+
+    def anthropic(self, api_key: str, api_endpoint: str):
+        from anthropic import AsyncAnthropic
+        return self.__get_or_create(
+            ('anthropic', api_endpoint, api_key),
+            lambda: AsyncAnthropic(api_key=api_key, base_url=api_endpoint, http_client=self.async_http_client()),
+            per_loop=True,
+        )
+
+    def openai(self, api_key: str, api_endpoint: Optional[str] = None):
+        from openai import AsyncOpenAI
+        return self.__get_or_create(
+            ('openai', api_endpoint, api_key),
+            lambda: AsyncOpenAI(api_key=api_key, base_url=api_endpoint, http_client=self.async_http_client()),
+            per_loop=True,
+        )
+
+    def openai_sync(self, api_key: str, api_endpoint: Optional[str] = None):
+        from openai import OpenAI
+        return self.__get_or_create(
+            ('openai_sync', api_endpoint, api_key),
+            lambda: OpenAI(api_key=api_key, base_url=api_endpoint, http_client=self.http_client()),
+            per_loop=False,
+        )
+
+    def gemini(self, api_key: str, model: str):
+        import google.generativeai as genai
+
+        def factory():
+            # genai keeps its credentials process wide
+            genai.configure(api_key=api_key)
+            return genai.GenerativeModel(model)
+
+        return self.__get_or_create(('gemini', model, api_key), factory, per_loop=False)
+
+    async def warm(self, endpoints: List[str], timeout: float = 5.0) -> None:
+        """
+        Opens a connection to each endpoint through the running loop's shared pool, so the first
+        real request doesn't pay for DNS and the TLS handshake. Failures are ignored.
+        """
+        http_client = self.async_http_client()
+
+        async def touch(endpoint: str):
+            try:
+                await http_client.head(endpoint, timeout=timeout)
+            except Exception as ex:
+                logging.debug(f'ClientPool.warm() {endpoint} failed with: {ex}')
+
+        await asyncio.gather(*[touch(endpoint) for endpoint in endpoints if endpoint])
+
+    async def aclose(self) -> None:
+        # the SDK clients don't own their transports, so closing the httpx pools is enough
+        loop = self.__running_loop()
+        with self.lock:
+            entries = list(self.clients.items())
+            self.clients.clear()
+
+        for key, (client_loop, client) in entries:
+            try:
+                if isinstance(client, httpx.Client):
+                    client.close()
+                elif isinstance(client, httpx.AsyncClient) and client_loop is loop:
+                    await client.aclose()
+            except Exception as ex:
+                logging.debug(f'ClientPool.aclose() {key[0]} failed with: {ex}')
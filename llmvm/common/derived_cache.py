@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from llmvm.common.container import Container
+from llmvm.common.logging_helpers import setup_logging
+from llmvm.common.objects import Content, ImageContent
+
+logging = setup_logging()
+
+
+class DerivedCache():
+    """
+    On disk cache of content derived from source bytes (pdf text, pdf page images, ocr output,
+    markdown with its images fetched), keyed by (source bytes hash, transformer, transformer
+    version, options). Results are stored as an ordered list of text and image items, with
+    image bytes stored once by hash however many results reference them. The least recently
+    used results are evicted once the cache grows past max_bytes.
+    """
+    def __init__(
+        self,
+        cache_directory: str,
+        enabled: bool = True,
+        max_bytes: int = 1024 * 1024 * 1024,
+        database_name: str = 'derived.db',
+    ):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if not self.enabled:
+            return
+
+        os.makedirs(cache_directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(cache_directory, database_name), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS derived ('
+            'key TEXT PRIMARY KEY, transformer TEXT NOT NULL, items TEXT NOT NULL, size INTEGER, created REAL, last_access REAL)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS derived_last_access ON derived (last_access)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS images (hash TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS derived_images (key TEXT NOT NULL, hash TEXT NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS derived_images_key ON derived_images (key)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS derived_images_hash ON derived_images (hash)')
+        self.connection.commit()
+
+    @staticmethod
+    def key(source: bytes, transformer: str, version: int, options: Dict[str, Any] = {}) -> str:
+        source_hash = hashlib.blake2b(source, digest_size=32).hexdigest()
+        payload = json.dumps([source_hash, transformer, version, options], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Content]]:
+        if not self.enabled:
+            return None
+
+        with self.lock:
+            row = self.connection.execute('SELECT items FROM derived WHERE key = ?', (key,)).fetchone()
+            if not row:
+                self.misses += 1
+                return None
+
+            result: List[Content] = []
+            for item in json.loads(row[0]):
+                if item['type'] == 'image':
+                    image = self.connection.execute('SELECT data FROM images WHERE hash = ?', (item['hash'],)).fetchone()
+                    if not image:
+                        # shouldn't happen, treat the whole entry as gone
+                        self.connection.execute('DELETE FROM derived WHERE key = ?', (key,))
+                        self.connection.commit()
+                        self.misses += 1
+                        return None
+                    result.append(ImageContent(bytes(image[0]), url=item.get('url', '')))
+                else:
+                    result.append(Content(item['text']))
+
+            self.connection.execute('UPDATE derived SET last_access = ? WHERE key = ?', (time.time(), key))
+            self.connection.commit()
+            self.hits += 1
+            return result
+
+    def put(self, key: str, transformer: str, contents: List[Content]) -> None:
+        if not self.enabled:
+            return
+
+        items: List[Dict[str, Any]] = []
+        images: Dict[str, bytes] = {}
+        for content in contents:
+            if isinstance(content, ImageContent) and isinstance(content.sequence, bytes):
+                image_hash = hashlib.blake2b(content.sequence, digest_size=32).hexdigest()
+                images[image_hash] = content.sequence
+                items.append({'type': 'image', 'hash': image_hash, 'url': content.url})
+            elif type(content) is Content:
+                items.append({'type': 'text', 'text': content.get_str()})
+            else:
+                # only plain text and images round trip, leave anything else uncached
+                return
+
+        items_json = json.dumps(items)
+        size = len(items_json) + sum(len(data) for data in images.values())
+        now = time.time()
+
+        with self.lock:
+            self.connection.execute('DELETE FROM derived_images WHERE key = ?', (key,))
+            self.connection.execute(
+                'INSERT OR REPLACE INTO derived VALUES (?, ?, ?, ?, ?, ?)',
+                (key, transformer, items_json, size, now, now)
+            )
+            for image_hash, data in images.items():
+                self.connection.execute('INSERT OR IGNORE INTO images VALUES (?, ?, ?)', (image_hash, data, len(data)))
+                self.connection.execute('INSERT INTO derived_images VALUES (?, ?)', (key, image_hash))
+
+            total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM derived').fetchone()[0]
+            if total > self.max_bytes:
+                # drop the least recently used results, then any images nothing refers to
+                for row_key, row_size in self.connection.execute('SELECT key, size FROM derived ORDER BY last_access').fetchall():
+                    if total <= self.max_bytes or row_key == key:
+                        break
+                    self.connection.execute('DELETE FROM derived WHERE key = ?', (row_key,))
+                    self.connection.execute('DELETE FROM derived_images WHERE key = ?', (row_key,))
+                    total -= row_size
+                self.connection.execute('DELETE FROM images WHERE hash NOT IN (SELECT hash FROM derived_images)')
+            self.connection.commit()
+
+    def get_or_compute(
+        self,
+        source: bytes,
+        transformer: str,
+        version: int,
+        options: Dict[str, Any],
+        compute: Callable[[], List[Content]],
+    ) -> List[Content]:
+        """
+        Returns the cached result of transformer over source, or computes and stores it.
+        Bump version whenever a transformer's output changes.
+        """
+        if not self.enabled or not source:
+            return compute()
+
+        key = DerivedCache.key(source, transformer, version, options)
+        cached = self.get(key)
+        if cached is not None:
+            logging.debug(f'DerivedCache: {transformer} hit for {len(source)} bytes')
+            return cached
+
+        start = time.perf_counter()
+        result = compute()
+        logging.debug(f'DerivedCache: {transformer} miss for {len(source)} bytes, took {time.perf_counter() - start:.2f}s')
+        try:
+            self.put(key, transformer, result)
+        except sqlite3.Error as ex:
+            logging.debug(f'DerivedCache: put for {transformer} failed with: {ex}')
+        return result
+
+
+_derived_cache: Optional[DerivedCache] = None
+_derived_cache_lock = threading.Lock()
+
+
+def get_derived_cache() -> DerivedCache:
+    global _derived_cache
+    with _derived_cache_lock:
+        if _derived_cache is None:
+            _derived_cache = DerivedCache(
+                cache_directory=os.path.expanduser(
+                    Container.get_config_variable('cache_directory', 'LLMVM_CACHE_DIRECTORY', default='~/.local/share/llmvm/cache')
+                ),
+                enabled=Container.get_config_variable('derived_cache', 'LLMVM_DERIVED_CACHE', default=True),
+                max_bytes=int(Container.get_config_variable('derived_cache_max_bytes', 'LLMVM_DERIVED_CACHE_MAX_BYTES', default=1024 * 1024 * 1024)),  # noqa E501
+            )
+        return _derived_cache
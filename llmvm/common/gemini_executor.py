@@ -4,10 +4,13 @@ from typing import Any, Awaitable, Callable, Dict, List, Optional, cast
 
 import google.generativeai as genai
 
+from llmvm.common.client_pool import ClientPool
 from llmvm.common.logging_helpers import messages_trace, setup_logging
 from llmvm.common.objects import (Assistant, AstNode, Content, Executor,
                                   Message, TokenStopNode, User, awaitable_none)
 from llmvm.common.perf import TokenPerf, TokenStreamManager
+from llmvm.common.response_cache import ResponseCache, get_response_cache
+from llmvm.common.token_cache import get_token_count_cache
 
 logging = setup_logging()
 
@@ -28,8 +31,12 @@ class GeminiExecutor(Executor):
             default_max_token_len=default_max_token_len,
             default_max_output_len=default_max_output_len,
         )
-        genai.configure(api_key=api_key)
-        self.aclient = genai.GenerativeModel(self.default_model)
+        self.api_key = api_key
+
+    @property
+    def aclient(self) -> genai.GenerativeModel:
+        # shared across executors and requests, see ClientPool
+        return ClientPool().gemini(self.api_key, self.default_model)
 
     def user_token(self) -> str:
         return 'User'
@@ -60,7 +67,9 @@ class GeminiExecutor(Executor):
             for message in messages:
                 num_tokens += tokens_per_message
                 for _, value in message.items():
-                    num_tokens += self.aclient.count_tokens(value).total_tokens
+                    num_tokens += get_token_count_cache().get_or_count(
+                        self.name(), model_str, value, lambda content: self.aclient.count_tokens(content).total_tokens
+                    )
             num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
             return num_tokens
 
@@ -153,20 +162,39 @@ class GeminiExecutor(Executor):
         for message in [m for m in messages if m.role() != 'system']:
             messages_list.append(Message.to_dict(message))
 
-        stream = self.__aexecute_direct(
-            messages_list,
-            max_output_tokens=max_output_tokens,
-            model=model if model else self.default_model,
-            temperature=temperature,
-        )
+        response_cache = get_response_cache()
+        cache_key = ResponseCache.key(self.name(), model, messages_list, stop_tokens, max_output_tokens) if response_cache.cacheable(temperature) else ''  # noqa E501
+        cached = response_cache.get(cache_key) if cache_key else None
 
         text_response = ''
 
-        async with await stream as stream_async:  # type: ignore
-            async for text in stream_async:  # type: ignore
-                await stream_handler(Content(text))
-                text_response += text
-            await stream_handler(TokenStopNode())
+        if cached:
+            text_response = cached['response']
+            perf = await response_cache.replay(cached, stream_handler, self.name(), model)
+            perf.log()
+        else:
+            stream = self.__aexecute_direct(
+                messages_list,
+                max_output_tokens=max_output_tokens,
+                model=model if model else self.default_model,
+                temperature=temperature,
+            )
+
+            async with await stream as stream_async:  # type: ignore
+                async for text in stream_async:  # type: ignore
+                    await stream_handler(Content(text))
+                    text_response += text
+                await stream_handler(TokenStopNode())
+                perf = stream_async.perf
+
+            if cache_key:
+                # counted before the request and reported in the stream, counting again is a remote call each
+                response_cache.put(
+                    cache_key,
+                    text_response,
+                    prompt_tokens=perf._prompt_len,
+                    completion_tokens=perf._completion_len or len(perf.ticks()),
+                )
 
         messages_list.append({'role': 'assistant', 'content': text_response})
         conversation: List[Message] = [Message.from_dict(m) for m in messages_list]
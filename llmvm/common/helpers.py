@@ -12,6 +12,7 @@ import math
 import os
 import re
 import signal
+import struct
 import subprocess
 import sys
 import threading
@@ -38,6 +39,8 @@ from PIL import Image
 
 from llmvm.common.objects import (Content, FunctionCall, ImageContent, MarkdownContent,
                                   Message, StreamNode, System, User)
+from llmvm.common.prompt_registry import PromptRegistry
+from llmvm.common.runtime_bridge import run_coroutine
 
 
 def write_client_stream(obj):
@@ -48,12 +51,12 @@ def write_client_stream(obj):
     while frame:
         # Check if 'self' exists in the frame's local namespace
         if 'stream_handler' in frame.f_locals:
-            asyncio.run(frame.f_locals['stream_handler'](obj))
+            run_coroutine(frame.f_locals['stream_handler'](obj))
             return
 
         instance = frame.f_locals.get('self', None)
         if hasattr(instance, 'stream_handler'):
-            asyncio.run(instance.stream_handler(obj))
+            run_coroutine(instance.stream_handler(obj))
             return
         frame = frame.f_back
 
@@ -324,22 +327,17 @@ class Helpers():
     def anthropic_image_tok_count(base64_encoded: str):
         # go from base64 encoded to bytes
         image = base64.b64decode(base64_encoded)
+        dimensions = Helpers.image_dimensions(image)
+        if dimensions:
+            return (dimensions[0] * dimensions[1]) // 750
         # open the image
         img = Image.open(io.BytesIO(image))
         return (img.width * img.height) // 750
 
     @staticmethod
-    def anthropic_resize(image_bytes: bytes) -> bytes:
-        image_type = Helpers.classify_image(image_bytes)
-        pil_extension = 'JPEG'
-        if image_type == 'image/png': pil_extension = 'PNG'
-        if image_type == 'image/webp': pil_extension = 'WEBP'
-
-        image = Image.open(io.BytesIO(image_bytes))
-        original_width, original_height = image.size
-
+    def anthropic_max_dimensions(width: int, height: int) -> Tuple[int, int]:
         # Determine the aspect ratio and corresponding max dimensions
-        aspect_ratio = original_width / original_height
+        aspect_ratio = width / height
         max_dimensions = {
             (1, 1): (1092, 1092),
             (3, 4): (951, 1268),
@@ -350,7 +348,18 @@ class Helpers():
 
         # Find the closest aspect ratio and its max dimensions
         closest_ratio = min(max_dimensions.keys(), key=lambda x: abs((x[0]/x[1]) - aspect_ratio))
-        max_width, max_height = max_dimensions[closest_ratio]
+        return max_dimensions[closest_ratio]
+
+    @staticmethod
+    def anthropic_resize(image_bytes: bytes) -> bytes:
+        image_type = Helpers.classify_image(image_bytes)
+        pil_extension = 'JPEG'
+        if image_type == 'image/png': pil_extension = 'PNG'
+        if image_type == 'image/webp': pil_extension = 'WEBP'
+
+        image = Image.open(io.BytesIO(image_bytes))
+        original_width, original_height = image.size
+        max_width, max_height = Helpers.anthropic_max_dimensions(original_width, original_height)
 
         # Check if the image exceeds the maximum dimensions
         if original_width > max_width or original_height > max_height:
@@ -665,9 +674,51 @@ class Helpers():
         if raw_data:
             if raw_data[:8] == b'\x89PNG\r\n\x1a\n': return 'image/png'
             elif raw_data[:2] == b'\xff\xd8': return 'image/jpeg'
-            elif raw_data[:4] == b'RIFF' and raw_data[-4:] == b'WEBP': return 'image/webp'
+            elif raw_data[:4] == b'RIFF' and raw_data[8:12] == b'WEBP': return 'image/webp'
         return 'image/unknown'
 
+    @staticmethod
+    def image_dimensions(raw_data: bytes) -> Optional[Tuple[int, int]]:
+        """
+        Reads (width, height) from a png, jpeg or webp header without decoding the image.
+        Returns None for anything else, or a header it can't make sense of.
+        """
+        try:
+            image_type = Helpers.classify_image(raw_data)
+            if image_type == 'image/png' and raw_data[12:16] == b'IHDR':
+                return struct.unpack('>II', raw_data[16:24])
+
+            elif image_type == 'image/jpeg':
+                # walk the segments to the first start of frame marker
+                i = 2
+                while i + 9 < len(raw_data):
+                    if raw_data[i] != 0xFF:
+                        i += 1
+                        continue
+                    marker = raw_data[i + 1]
+                    if marker == 0xFF or marker == 0x01 or 0xD0 <= marker <= 0xD9:
+                        i += 1 if marker == 0xFF else 2
+                        continue
+                    length = struct.unpack('>H', raw_data[i + 2:i + 4])[0]
+                    if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+                        height, width = struct.unpack('>HH', raw_data[i + 5:i + 9])
+                        return width, height
+                    i += 2 + length
+
+            elif image_type == 'image/webp':
+                chunk = raw_data[12:16]
+                if chunk == b'VP8 ':
+                    width, height = struct.unpack('<HH', raw_data[26:30])
+                    return width & 0x3FFF, height & 0x3FFF
+                elif chunk == b'VP8L':
+                    bits = int.from_bytes(raw_data[21:25], 'little')
+                    return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+                elif chunk == b'VP8X':
+                    return int.from_bytes(raw_data[24:27], 'little') + 1, int.from_bytes(raw_data[27:30], 'little') + 1
+        except (struct.error, IndexError):
+            pass
+        return None
+
     @staticmethod
     def log_exception(logger, e, message=None):
         exc_traceback = e.__traceback__
@@ -1511,61 +1562,19 @@ class Helpers():
 
     @staticmethod
     def load_resources_prompt(prompt_name: str, module: str = 'llmvm.server.prompts.python') -> Dict[str, Any]:
-        prompt_file = resources.files(module) / prompt_name
-
-        with open(prompt_file, 'r') as f:  # type: ignore
-            prompt = f.read()
-
-            if '[system_message]' not in prompt:
-                raise ValueError('Prompt file must contain [system_message]')
-
-            if '[user_message]' not in prompt:
-                raise ValueError('Prompt file must contain [user_message]')
-
-            system_message = Helpers.in_between(prompt, '[system_message]', '[user_message]').strip()
-            user_message = prompt[prompt.find('[user_message]') + len('[user_message]'):].strip()
-            templates = []
-
-            temp_prompt = prompt
-            while '{{' and '}}' in temp_prompt:
-                templates.append(Helpers.in_between(temp_prompt, '{{', '}}'))
-                temp_prompt = temp_prompt.split('}}', 1)[-1]
-
-            return {
-                'system_message': system_message,
-                'user_message': user_message,
-                'templates': templates
-            }
+        prompt = PromptRegistry().get(prompt_name, module)
+        return {
+            'system_message': prompt.system_message,
+            'user_message': prompt.user_message,
+            'templates': list(prompt.templates)
+        }
 
     @staticmethod
-    def get_prompts(
-        prompt_text: str,
+    def __default_template_tokens(
         template: Dict[str, str],
-        user_token: str = 'User',
-        assistant_token: str = 'Assistant',
-        append_token: str = '',
-    ) -> Tuple[System, User]:
-        if '[system_message]' not in prompt_text:
-            raise ValueError('Prompt file must contain [system_message]')
-
-        if '[user_message]' not in prompt_text:
-            raise ValueError('Prompt file must contain [user_message]')
-
-        system_message = Helpers.in_between(prompt_text, '[system_message]', '[user_message]').strip()
-        user_message = prompt_text[prompt_text.find('[user_message]') + len('[user_message]'):].strip()
-        templates = []
-
-        temp_prompt = prompt_text
-        while '{{' and '}}' in temp_prompt:
-            templates.append(Helpers.in_between(temp_prompt, '{{', '}}'))
-            temp_prompt = temp_prompt.split('}}', 1)[-1]
-
-        prompt = {
-            'system_message': system_message,
-            'user_message': user_message,
-            'templates': templates
-        }
-
+        user_token: str,
+        assistant_token: str,
+    ) -> None:
         if not template.get('user_token'):
             template['user_token'] = user_token
             template['user_colon_token'] = user_token + ':'
@@ -1573,35 +1582,18 @@ class Helpers():
             template['assistant_token'] = assistant_token
             template['assistant_colon_token'] = assistant_token + ':'
 
-        for key, value in template.items():
-            prompt['system_message'] = prompt['system_message'].replace('{{' + key + '}}', value)
-            prompt['user_message'] = prompt['user_message'].replace('{{' + key + '}}', value)
-
-        # deal with exec() statements to inject things like datetime
-        import datetime
-        for message_key in ['system_message', 'user_message']:
-            message = prompt[message_key]
-            while '{{' in message and '}}' in message:
-                start = message.find('{{')
-                end = message.find('}}', start)
-                if end == -1:  # No closing '}}' found
-                    break
-
-                key = message[start+2:end]
-                replacement = ''
-
-                if key.startswith('exec('):
-                    try:
-                        replacement = str(eval(key[5:-1]))
-                    except Exception as e:
-                        pass
-                else:
-                    replacement = key
-
-                message = message[:start] + replacement + message[end+2:]
-
-            prompt[message_key] = message
-        return (System(Content(prompt['system_message'])), User(Content(prompt['user_message'] + append_token)))
+    @staticmethod
+    def get_prompts(
+        prompt_text: str,
+        template: Dict[str, str],
+        user_token: str = 'User',
+        assistant_token: str = 'Assistant',
+        append_token: str = '',
+    ) -> Tuple[System, User]:
+        prompt = PromptRegistry().parse(prompt_text)
+        Helpers.__default_template_tokens(template, user_token, assistant_token)
+        system_message, user_message = prompt.render(template, append_token)
+        return (System(Content(system_message)), User(Content(user_message)))
 
     @staticmethod
     def load_and_populate_prompt(
@@ -1612,49 +1604,17 @@ class Helpers():
         append_token: str = '',
         module: str = 'llmvm.server.prompts.python'
     ) -> Dict[str, Any]:
-        prompt: Dict[str, Any] = Helpers.load_resources_prompt(prompt_name, module)
+        prompt = PromptRegistry().get(prompt_name, module)
 
         try:
-
-            if not template.get('user_token'):
-                template['user_token'] = user_token
-                template['user_colon_token'] = user_token + ':'
-            if not template.get('assistant_token'):
-                template['assistant_token'] = assistant_token
-                template['assistant_colon_token'] = assistant_token + ':'
-
-            for key, value in template.items():
-                prompt['system_message'] = prompt['system_message'].replace('{{' + key + '}}', value)
-                prompt['user_message'] = prompt['user_message'].replace('{{' + key + '}}', value)
-
-            # deal with exec() statements to inject things like datetime
-            import datetime
-            for message_key in ['system_message', 'user_message']:
-                message = prompt[message_key]
-                while '{{' in message and '}}' in message:
-                    start = message.find('{{')
-                    end = message.find('}}', start)
-                    if end == -1:  # No closing '}}' found
-                        break
-
-                    key = message[start+2:end]
-                    replacement = ''
-
-                    if key.startswith('exec('):
-                        try:
-                            replacement = str(eval(key[5:-1]))
-                        except Exception as e:
-                            pass
-                    else:
-                        replacement = key
-
-                    message = message[:start] + replacement + message[end+2:]
-
-                prompt[message_key] = message
-
-            prompt['user_message'] += f'{append_token}'
-            prompt['prompt_name'] = prompt_name
-            return prompt
+            Helpers.__default_template_tokens(template, user_token, assistant_token)
+            system_message, user_message = prompt.render(template, append_token)
+            return {
+                'system_message': system_message,
+                'user_message': user_message,
+                'templates': list(prompt.templates),
+                'prompt_name': prompt_name,
+            }
         except Exception as e:
             result = {
                 'system_message': f'Error loading prompt: {str(e)}',
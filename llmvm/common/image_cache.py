@@ -0,0 +1,131 @@
+import base64
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+from llmvm.common.container import Container
+from llmvm.common.helpers import Helpers
+
+
+class EncodedImage(NamedTuple):
+    mime_type: str
+    # base64 of the bytes sent to the provider, after any resizing
+    data: str
+    width: int
+    height: int
+    tokens: int
+
+
+def anthropic_encoder(image_bytes: bytes) -> Optional[EncodedImage]:
+    mime_type = Helpers.classify_image(image_bytes)
+    dimensions = Helpers.image_dimensions(image_bytes)
+    if mime_type == 'image/unknown' or not dimensions:
+        return None
+
+    width, height = dimensions
+    max_width, max_height = Helpers.anthropic_max_dimensions(width, height)
+    # only decode and re-encode images that are actually over the limit
+    if width > max_width or height > max_height:
+        image_bytes = Helpers.anthropic_resize(image_bytes)
+        width, height = Helpers.image_dimensions(image_bytes) or (width, height)
+
+    return EncodedImage(mime_type, base64.b64encode(image_bytes).decode('utf-8'), width, height, (width * height) // 750)
+
+
+def openai_encoder(image_bytes: bytes) -> Optional[EncodedImage]:
+    mime_type = Helpers.classify_image(image_bytes)
+    if mime_type == 'image/unknown':
+        mime_type = 'image/jpeg'
+
+    # high detail images cost 85 tokens plus 170 per 512px tile
+    width, height = Helpers.image_dimensions(image_bytes) or (0, 0)
+    tokens = 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512) if width and height else 85
+    return EncodedImage(mime_type, base64.b64encode(image_bytes).decode('utf-8'), width, height, tokens)
+
+
+ENCODERS: Dict[str, Callable[[bytes], Optional[EncodedImage]]] = {
+    'anthropic': anthropic_encoder,
+    'openai': openai_encoder,
+}
+
+
+class ImageEncodingCache():
+    """
+    Process wide LRU of provider encoded images keyed by (provider, image hash), so an image
+    is classified, resized, base64 encoded and token counted once per provider rather than on
+    every wrap_messages and count_tokens call. Bounded by the total size of the base64 strings.
+    """
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.cache: OrderedDict[Tuple[str, bytes], Optional[EncodedImage]] = OrderedDict()
+        # (provider, hash of the base64 string) -> token count, for counting already wrapped
+        # messages. small images go to every provider unresized, with different counts
+        self.tokens: Dict[Tuple[str, bytes], int] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def hash(data: bytes | str) -> bytes:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def encode(self, provider: str, image_bytes: bytes) -> Optional[EncodedImage]:
+        """
+        Returns the image as provider wants it, or None if it isn't an image the provider
+        accepts.
+        """
+        key = (provider, ImageEncodingCache.hash(image_bytes))
+        with self.lock:
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            self.misses += 1
+
+        encoded = ENCODERS[provider](image_bytes)
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = encoded
+                if encoded:
+                    self.size += len(encoded.data)
+                    self.tokens[(provider, ImageEncodingCache.hash(encoded.data))] = encoded.tokens
+
+                while self.size > self.max_bytes and len(self.cache) > 1:
+                    (evicted_provider, _), evicted = self.cache.popitem(last=False)
+                    if evicted:
+                        self.size -= len(evicted.data)
+                        self.tokens.pop((evicted_provider, ImageEncodingCache.hash(evicted.data)), None)
+        return encoded
+
+    def tokens_for(self, provider: str, data: str) -> Optional[int]:
+        """
+        Token count for a base64 image this cache produced for provider, None if it has been
+        evicted (or didn't come from here).
+        """
+        with self.lock:
+            return self.tokens.get((provider, ImageEncodingCache.hash(data)))
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cache.clear()
+            self.tokens.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+
+_image_cache: Optional[ImageEncodingCache] = None
+
+
+def get_image_cache() -> ImageEncodingCache:
+    global _image_cache
+    if _image_cache is None:
+        _image_cache = ImageEncodingCache(
+            max_bytes=int(Container.get_config_variable('image_cache_max_bytes', 'LLMVM_IMAGE_CACHE_MAX_BYTES', default=256 * 1024 * 1024))  # noqa E501
+        )
+    return _image_cache
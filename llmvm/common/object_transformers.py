@@ -3,6 +3,7 @@ from collections import OrderedDict
 from typing import List, cast
 
 from llmvm.common.container import Container
+from llmvm.common.derived_cache import get_derived_cache
 from llmvm.common.helpers import Helpers
 from llmvm.common.logging_helpers import setup_logging
 from llmvm.common.objects import (BrowserContent, Content, Executor, ImageContent, LLMCall,
@@ -12,6 +13,10 @@ from llmvm.common.pdf import Pdf, PdfHelpers
 
 logging = setup_logging()
 
+# bump when the output of a transform changes, so cached results are recomputed
+PDF_FULL_VERSION = 1
+MARKDOWN_FULL_VERSION = 1
+
 
 class ObjectCache:
     _instance = None
@@ -59,7 +64,14 @@ class ObjectTransformers():
         if content.original_sequence is None and Container.get_config_variable('LLMVM_FULL_PROCESSING', default=False):
             # avoid circular import
             pdf = Pdf(executor=executor)
-            result = pdf.get_pdf_content(content)
+            result = get_derived_cache().get_or_compute(
+                content.sequence if isinstance(content.sequence, bytes) else b'',
+                'pdf_full',
+                PDF_FULL_VERSION,
+                # the url ends up in the extracted images' metadata
+                {'executor': executor.name(), 'url': content.url},
+                lambda: pdf.get_pdf_content(content),
+            )
             content.original_sequence = content.sequence
             content.sequence = result
             cache.set(content.url, content)
@@ -78,7 +90,14 @@ class ObjectTransformers():
             return ObjectTransformers.transform_markdown_content(cast(MarkdownContent, cache.get(content.url)), executor)
 
         if Container.get_config_variable('LLMVM_FULL_PROCESSING', default=False):
-            result: List[Content] = asyncio.run(Helpers.markdown_content_to_messages(logging, content, 150, 150))
+            result: List[Content] = get_derived_cache().get_or_compute(
+                content.get_str().encode('utf-8'),
+                'markdown_full',
+                MARKDOWN_FULL_VERSION,
+                # relative image links are resolved against the url
+                {'min_width': 150, 'min_height': 150, 'url': content.url},
+                lambda: asyncio.run(Helpers.markdown_content_to_messages(logging, content, 150, 150)),
+            )
             content.original_sequence = content.sequence
             content.sequence = result
             return [User(content) for content in result]
@@ -98,8 +117,8 @@ class ObjectTransformers():
     def transform_str(content: Content, executor: Executor) -> str:
         if isinstance(content, PdfContent):
             result = ObjectTransformers.transform_pdf_content(cast(PdfContent, content), executor)
-            '\n'.join([c.message.get_str() for c in result])
+            return '\n'.join([c.message.get_str() for c in result])
         if isinstance(content, MarkdownContent):
             result = ObjectTransformers.transform_markdown_content(cast(MarkdownContent, content), executor)
-            '\n'.join([c.message.get_str() for c in result])
+            return '\n'.join([c.message.get_str() for c in result])
         return content.get_str()
@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import copy
 import datetime as dt
@@ -7,12 +8,14 @@ import os
 from abc import ABC, abstractmethod
 from enum import Enum
 from importlib import resources
-from typing import Any, Awaitable, Callable, Dict, List, Optional, Type, TypeVar, TypedDict
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Type, TypeVar, TypedDict
 from llmvm.common.logging_helpers import setup_logging
 
 import numpy as np
 from pydantic import BaseModel, Field
 
+if TYPE_CHECKING:
+    from llmvm.common.blob_store import BlobStore
 
 logging = setup_logging()
 
@@ -218,6 +221,15 @@ class Executor(ABC):
     ) -> int:
         pass
 
+    async def count_tokens_batch(
+        self,
+        contents: List[str],
+        model: Optional[str] = None,
+    ) -> List[int]:
+        # count_tokens() memoizes per content string, so executors only override this
+        # when their tokenizer can encode a batch faster than one call per string
+        return list(await asyncio.gather(*[self.count_tokens(content, model=model) for content in contents]))
+
     @abstractmethod
     def user_token(
         self
@@ -422,6 +434,39 @@ class LLMCall():
         )
 
 
+class RequestContext():
+    """
+    The per-request settings (executor, model, temperature, token budgets, stream handler and
+    friends) for a single completion. It's handed to LLMCall, PythonRuntime and the helpers it
+    instantiates, so shared executors and controllers are never rebuilt or mutated to serve a
+    request with different settings.
+    """
+    def __init__(
+        self,
+        executor: str,
+        model: str,
+        temperature: float = 0.0,
+        compression: TokenCompressionMethod = TokenCompressionMethod.AUTO,
+        cookies: List[Dict[str, Any]] = [],
+        stop_tokens: List[str] = [],
+        output_token_len: int = 0,
+        max_prompt_len: int = 0,
+        stream_handler: Callable[['AstNode'], Awaitable[None]] = awaitable_none,
+    ):
+        self.executor = executor
+        self.model = model
+        self.temperature = temperature
+        self.compression = compression
+        self.cookies = cookies
+        self.stop_tokens = stop_tokens
+        self.output_token_len = output_token_len
+        self.max_prompt_len = max_prompt_len
+        self.stream_handler = stream_handler
+
+    def __str__(self):
+        return f'RequestContext(executor={self.executor}, model={self.model}, temperature={self.temperature}, compression={self.compression})'  # noqa E501
+
+
 class Controller():
     def __init__(
         self,
@@ -781,12 +826,14 @@ class Message(AstNode):
 
         # primarily to pass to Anthropic or OpenAI api
         if isinstance(message, User) and isinstance(message.message, ImageContent):
+            from llmvm.common.image_cache import get_image_cache
+            encoded = get_image_cache().encode('openai', message.message.sequence)
             return {
                 'role': message.role(),
                 'content': [{
                     'type': 'image_url',
                     'image_url': {
-                        'url': f"data:image/jpeg;base64,{base64.b64encode(message.message.sequence).decode('utf-8')}",
+                        'url': f"data:{encoded.mime_type};base64,{encoded.data}",  # type: ignore
                         'detail': 'high'
                     }
                 }],
@@ -1191,17 +1238,66 @@ class MessageModel(BaseModel):
     content_type: Optional[str] = None
     content: str | List[Dict[str, Any]]
     url: Optional[str] = None
+    # sha256 of the image, pdf or file bytes held in a BlobStore. content is empty when set.
+    blob: Optional[str] = None
+
+    def to_message(self, blob_store: Optional['BlobStore'] = None) -> Message:
+        if not self.blob:
+            return Message.from_dict(self.model_dump())
+
+        from llmvm.common.blob_store import get_default_blob_store
+        blob_store = blob_store or get_default_blob_store()
+        if not blob_store:
+            raise ValueError(f'MessageModel references blob {self.blob} but there is no BlobStore to fetch it from')
+
+        data = blob_store.get(self.blob)
+        url = self.url or ''
+        if self.content_type == 'image':
+            content = ImageContent(data, url)
+        elif self.content_type == 'pdf':
+            content = PdfContent(data, url)
+        elif self.content_type == 'file':
+            content = FileContent(data, url)
+        else:
+            raise ValueError(f'content_type {self.content_type} is not supported for blobs')
+
+        if self.role == 'user':
+            return User(content)
+        elif self.role == 'system':
+            return System(content)
+        elif self.role == 'assistant':
+            return Assistant(content)
+        raise ValueError(f'role not found or not supported: {self.role}')
 
-    def to_message(self) -> Message:
-        return Message.from_dict(self.model_dump())
+    def to_blob(self, blob_store: 'BlobStore') -> 'MessageModel':
+        # moves inlined base64 image, pdf or file content into the blob_store
+        if self.blob or self.content_type not in ('image', 'pdf', 'file') or not self.content:
+            return self
+        return MessageModel.from_message(self.to_message(), blob_store)
 
     @staticmethod
-    def from_message(message: Message) -> 'MessageModel':
+    def from_message(message: Message, blob_store: Optional['BlobStore'] = None) -> 'MessageModel':
+        if (
+            blob_store
+            and isinstance(message.message, (ImageContent, PdfContent, FileContent))
+            and isinstance(message.message.sequence, bytes)
+        ):
+            content_type = {ImageContent: 'image', PdfContent: 'pdf', FileContent: 'file'}[type(message.message)]
+            url = message.message.url
+            return MessageModel(
+                role=message.role(),
+                content_type=content_type,
+                content='',
+                # images decoded from a data: uri carry the whole uri as their url
+                url='' if url.startswith('data:') else url,
+                blob=blob_store.put(message.message.sequence),
+            )
         return MessageModel(**Message.to_dict(message, server_serialization=True))
 
 
 class SessionThread(BaseModel):
     id: int = -1
+    version: int = 0
     executor: str = ''
     model: str = ''
     current_mode: str = ''
@@ -1212,3 +1308,19 @@ class SessionThread(BaseModel):
     cookies: List[Dict[str, Any]] = []
     messages: List[MessageModel] = []
     locals_dict: Dict[str, Any] = Field(default_factory=dict, exclude=True)
+
+
+class SessionThreadDelta(BaseModel):
+    # messages appended to a SessionThread, relative to the thread at 'version'.
+    # clients send the new messages in, the server sends the appended assistant messages back.
+    id: int = -1
+    version: int = 0
+    executor: str = ''
+    model: str = ''
+    current_mode: str = ''
+    compression: str = ''
+    temperature: float = 0.0
+    stop_tokens: list[str] = []
+    output_token_len: int = 0
+    cookies: List[Dict[str, Any]] = []
+    messages: List[MessageModel] = []
@@ -1,5 +1,6 @@
 import asyncio
 import base64
+import functools
 import os
 from io import BytesIO
 from typing import Any, Awaitable, Callable, Dict, List, Optional, cast
@@ -10,17 +11,27 @@ from openai.types.chat import ChatCompletionMessageParam
 from openai.types.chat.completion_create_params import Function
 from PIL import Image
 
+from llmvm.common.client_pool import ClientPool
 from llmvm.common.logging_helpers import messages_trace, setup_logging
 from llmvm.common.object_transformers import ObjectTransformers
 from llmvm.common.objects import (Assistant, AstNode, BrowserContent, Content, Executor, FileContent, ImageContent, MarkdownContent,
                                   Message, PdfContent, System, TokenStopNode, User,
                                   awaitable_none)
 from llmvm.common.perf import TokenPerf, TokenStreamManager, O1AsyncIterator
+from llmvm.common.response_cache import ResponseCache, get_response_cache
+from llmvm.common.image_cache import get_image_cache
+from llmvm.common.token_cache import get_token_count_cache
 
 
 logging = setup_logging()
 
 
+@functools.lru_cache(maxsize=None)
+def tiktoken_encoding(encoding_name: str) -> tiktoken.Encoding:
+    # building an encoding parses the bpe ranks, do it once per process
+    return tiktoken.get_encoding(encoding_name)
+
+
 class OpenAIExecutor(Executor):
     def __init__(
         self,
@@ -38,9 +49,13 @@ class OpenAIExecutor(Executor):
             default_max_output_len=default_max_output_len,
         )
         self.openai_key = api_key
-        self.aclient = AsyncOpenAI(api_key=self.openai_key, base_url=self.api_endpoint)
         self.max_images = max_images
 
+    @property
+    def aclient(self) -> AsyncOpenAI:
+        # shared across executors and requests, see ClientPool
+        return ClientPool().openai(self.openai_key, self.api_endpoint)
+
     def __calculate_image_tokens(self, width: int, height: int):
         from math import ceil
 
@@ -167,7 +182,7 @@ class OpenAIExecutor(Executor):
         # obtained from: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
         def num_tokens_from_messages(messages, model: str):
             """Return the number of tokens used by a list of messages."""
-            encoding = tiktoken.get_encoding('cl100k_base')
+            encoding = tiktoken_encoding('cl100k_base')
             if model in {
                 "gpt-3.5-turbo-0613",
                 "gpt-3.5-turbo-16k-0613",
@@ -216,6 +231,10 @@ class OpenAIExecutor(Executor):
                         for list_item in value:
                             if 'type' in list_item and list_item['type'] == 'image_url' and 'image_url' in list_item:
                                 if 'detail' in list_item['image_url'] and list_item['image_url']['detail'] == 'high':
+                                    image_tokens = get_image_cache().tokens_for('openai', list_item['image_url']['url'].split(',')[-1])  # NOQA: E501
+                                    if image_tokens is not None:
+                                        num_tokens += image_tokens
+                                        continue
                                     try:
                                         with Image.open(BytesIO(base64.b64decode(list_item['image_url']['url'].split(',')[1]))) as img:  # NOQA: E501
                                             width, height = img.size
@@ -225,7 +244,9 @@ class OpenAIExecutor(Executor):
                                 else:
                                     num_tokens += 85
                     else:
-                        num_tokens += len(encoding.encode(value))
+                        num_tokens += get_token_count_cache().get_or_count(
+                            self.name(), model_str, value, lambda content: len(encoding.encode(content))
+                        )
                         if key == "name":
                             num_tokens += tokens_per_name
             num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
@@ -241,6 +262,23 @@ class OpenAIExecutor(Executor):
         else:
             raise ValueError('cannot calculate tokens for messages: {}'.format(messages))
 
+    async def count_tokens_batch(
+        self,
+        contents: List[str],
+        model: Optional[str] = None,
+    ) -> List[int]:
+        model_str = model if model else self.default_model
+        cache = get_token_count_cache()
+
+        # encode the uncached strings in one tiktoken batch, then count_tokens() is all cache hits
+        misses = list({content for content in contents if cache.get(self.name(), model_str, content) is None})
+        if misses:
+            encoded = tiktoken_encoding('cl100k_base').encode_batch(misses)
+            for content, tokens in zip(misses, encoded):
+                cache.set(self.name(), model_str, content, len(tokens))
+
+        return [await self.count_tokens(content, model=model_str) for content in contents]
+
     async def aexecute_direct(
         self,
         messages: List[Dict[str, str]],
@@ -334,35 +372,53 @@ class OpenAIExecutor(Executor):
         # fresh message list, includes system message
         messages_list: List[Dict[str, str]] = self.wrap_messages(model, messages)
 
-        stream = self.aexecute_direct(
-            messages_list,
-            max_output_tokens=max_output_tokens,
-            model=model if model else self.default_model,
-            temperature=temperature,
-            stop_tokens=stop_tokens,
-        )
+        response_cache = get_response_cache()
+        cache_key = ResponseCache.key(self.name(), model, messages_list, stop_tokens, max_output_tokens) if response_cache.cacheable(temperature) else ''  # noqa E501
+        cached = response_cache.get(cache_key) if cache_key else None
 
         text_response = ''
         perf = None
 
-        async with await stream as stream_async:  # type: ignore
-            async for text in stream_async:  # type: ignore
-                await stream_handler(Content(text))
-                text_response += text
-            await stream_handler(TokenStopNode())
-            perf = stream_async.perf
+        if cached:
+            text_response = cached['response']
+            perf = await response_cache.replay(cached, stream_handler, self.name(), model)
+        else:
+            stream = self.aexecute_direct(
+                messages_list,
+                max_output_tokens=max_output_tokens,
+                model=model if model else self.default_model,
+                temperature=temperature,
+                stop_tokens=stop_tokens,
+            )
+
+            async with await stream as stream_async:  # type: ignore
+                async for text in stream_async:  # type: ignore
+                    await stream_handler(Content(text))
+                    text_response += text
+                await stream_handler(TokenStopNode())
+                perf = stream_async.perf
+
+            await stream_async.get_final_message()
+
+            if cache_key:
+                response_cache.put(
+                    cache_key,
+                    text_response,
+                    stop_reason=perf.stop_reason,
+                    stop_token=perf.stop_token,
+                    prompt_tokens=perf._prompt_len,
+                    completion_tokens=perf._completion_len or await self.count_tokens(text_response, model=model),
+                )
 
         messages_list.append({'role': 'assistant', 'content': text_response})
         conversation: List[Message] = [Message.from_dict(m) for m in messages_list]
 
-        await stream_async.get_final_message()
-
         # todo, stashing this in 'perf' isn't great, should probably fix that.
         assistant = Assistant(
             message=conversation[-1].message,
             messages_context=conversation,
-            stop_reason=stream_async.perf.stop_reason,
-            stop_token=stream_async.perf.stop_token,
+            stop_reason=perf.stop_reason,
+            stop_token=perf.stop_token,
         )
 
         perf.log()
@@ -1,8 +1,14 @@
 import asyncio
 import io
+import multiprocessing
+import os
 import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
-from typing import List, cast
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple, cast
 from urllib.parse import urlparse
 
 import pdf2image
@@ -13,6 +19,8 @@ from pdfminer.image import ImageWriter
 from PIL import Image
 from pytesseract import Output
 
+from llmvm.common.container import Container
+from llmvm.common.derived_cache import get_derived_cache
 from llmvm.common.helpers import Helpers, write_client_stream
 from llmvm.common.logging_helpers import setup_logging
 from llmvm.common.objects import (Content, Executor, ImageContent, LLMCall,
@@ -20,6 +28,123 @@ from llmvm.common.objects import (Content, Executor, ImageContent, LLMCall,
 
 logging = setup_logging()
 
+# bump when the output of a transform changes, so cached results are recomputed
+PDF_TEXT_VERSION = 1
+PDF_OCR_VERSION = 1
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+class PdfPage(NamedTuple):
+    page_number: int
+    text: str
+    # (png bytes, temp file holding the png)
+    images: List[Tuple[bytes, str]]
+    seconds: float
+
+
+def pdf_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # each worker is a separate interpreter importing the pdf stack, so keep the pool small
+            workers = int(Container.get_config_variable('pdf_workers', 'LLMVM_PDF_WORKERS', default=2)) or os.cpu_count() or 1
+            # spawn rather than fork, the server process is full of threads
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def __reset_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def ocr_pages(path: str, first_page: int, last_page: int, dpi: int) -> List[PdfPage]:
+    # rasterizes only this shard's pages, so memory is bounded by the shard size, not the document
+    pages: List[PdfPage] = []
+    images = pdf2image.convert_from_path(path, dpi=dpi, first_page=first_page, last_page=last_page, grayscale=True)
+    for i, pil_im in enumerate(images):
+        start = time.perf_counter()
+        ocr_dict = pytesseract.image_to_data(pil_im, output_type=Output.DICT)
+        pages.append(PdfPage(first_page + i, ' '.join(ocr_dict['text']), [], time.perf_counter() - start))
+        pil_im.close()
+    return pages
+
+
+def extract_pages(path: str, first_page: int, last_page: int, x_tolerance: int) -> List[PdfPage]:
+    pages: List[PdfPage] = []
+    with pdfplumber.open(path) as pdf:
+        for i in range(first_page - 1, last_page):
+            start = time.perf_counter()
+            page = pdf.pages[i]
+            text = page.extract_text(x_tolerance=x_tolerance)
+            images: List[Tuple[bytes, str]] = []
+
+            for img in page.images:
+                raw_data = img['stream'].get_rawdata()
+                _, raw_data = Helpers.decompress_if_compressed(raw_data)
+                if Helpers.is_image(raw_data):
+                    img_stream = BytesIO(img['stream'].get_rawdata())
+                    im = Image.open(img_stream)
+                    buf = io.BytesIO()
+                    im.save(buf, format='PNG')
+                    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
+                        im.save(temp_file.name, format='PNG', optimize=False, compression_level=0)
+                        images.append((buf.getvalue(), temp_file.name))
+                else:
+                    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
+                        image_bbox = (img['x0'], page.height - img['y1'], img['x1'], page.height - img['y0'])
+                        page.crop(image_bbox).to_image(resolution=150, antialias=True).save(temp_file.name, format='PNG', optimize=False, compression_level=0)  # noqa E501
+                        im = Image.open(temp_file.name)
+                        buf = io.BytesIO()
+                        im.save(buf, format='PNG')
+                        images.append((buf.getvalue(), temp_file.name))
+
+            # pdfplumber caches parsed objects per page, drop them as we go
+            page.flush_cache()
+            pages.append(PdfPage(i + 1, text or '', images, time.perf_counter() - start))
+    return pages
+
+
+def run_sharded(
+    shard: Callable[..., List[PdfPage]],
+    path: str,
+    pages_count: int,
+    *args: Any,
+) -> List[PdfPage]:
+    """
+    Splits pages 1..pages_count into page ranges of pdf_pages_per_shard and runs shard(path,
+    first_page, last_page, *args) for each across the pdf process pool. Pages come back in
+    document order.
+    """
+    per_shard = max(1, int(Container.get_config_variable('pdf_pages_per_shard', 'LLMVM_PDF_PAGES_PER_SHARD', default=8)))
+    ranges = [(first, min(first + per_shard - 1, pages_count)) for first in range(1, pages_count + 1, per_shard)]
+
+    start = time.perf_counter()
+    if len(ranges) <= 1:
+        results = [shard(path, first, last, *args) for first, last in ranges]
+    else:
+        try:
+            futures = [pdf_executor().submit(shard, path, first, last, *args) for first, last in ranges]
+            results = [future.result() for future in futures]
+        except BrokenProcessPool as ex:
+            logging.debug(f'run_sharded: process pool failed ({ex}), running {shard.__name__} in process')
+            __reset_executor()
+            results = [shard(path, first, last, *args) for first, last in ranges]
+
+    pages = [page for result in results for page in result]
+    if pages:
+        slowest = max(pages, key=lambda page: page.seconds)
+        logging.debug(
+            f'run_sharded: {shard.__name__} {len(pages)} pages in {len(ranges)} shards took {time.perf_counter() - start:.2f}s, '
+            f'{sum(page.seconds for page in pages):.2f}s of page time, slowest page {slowest.page_number} {slowest.seconds:.2f}s'
+        )
+    return pages
+
 
 class PdfHelpers():
     @staticmethod
@@ -41,14 +166,16 @@ class PdfHelpers():
     @staticmethod
     def parse_pdf_image(url_or_file: str) -> str:
         result = urlparse(url_or_file)
+        dpi = int(Container.get_config_variable('pdf_ocr_dpi', 'LLMVM_PDF_OCR_DPI', default=200))
 
-        text_chunks: List[str] = []
-        images = pdf2image.convert_from_path(result.path)  # type: ignore
-        for pil_im in images:
-            ocr_dict = pytesseract.image_to_data(pil_im, output_type=Output.DICT)
-            text_chunks.append(' '.join(ocr_dict['text']))
+        def ocr() -> List[Content]:
+            pages_count = int(pdf2image.pdfinfo_from_path(result.path)['Pages'])
+            pages = run_sharded(ocr_pages, result.path, pages_count, dpi)
+            return [Content('\n'.join([page.text for page in pages]))]
 
-        return '\n'.join(text_chunks)
+        with open(result.path, 'rb') as f:
+            source = f.read()
+        return get_derived_cache().get_or_compute(source, 'pdf_ocr', PDF_OCR_VERSION, {'dpi': dpi}, ocr)[0].get_str()
 
     @staticmethod
     def parse_pdf(url_or_file: str) -> str:
@@ -67,20 +194,24 @@ class PdfHelpers():
         if not stream:
             return ''
 
-        escape_chars = ['\x0c', '\x0b', '\x0a']
-        text_stream = BytesIO()
+        def extract() -> List[Content]:
+            escape_chars = ['\x0c', '\x0b', '\x0a']
+            text_stream = BytesIO()
+
+            # text_result = extract_text(stream)
 
-        # text_result = extract_text(stream)
+            extract_text_to_fp(stream, text_stream, output_type='text')
+            text_stream.seek(0)
+            text_result = text_stream.read().decode('utf-8')
 
-        extract_text_to_fp(stream, text_stream, output_type='text')
-        text_stream.seek(0)
-        text_result = text_stream.read().decode('utf-8')
+            for char in escape_chars:
+                text_result = text_result.replace(char, ' ').strip()
 
-        for char in escape_chars:
-            text_result = text_result.replace(char, ' ').strip()
+            if text_result == '':
+                text_result = PdfHelpers.parse_pdf_image(url_or_file)
+            return [Content(text_result)]
 
-        if text_result == '':
-            text_result = PdfHelpers.parse_pdf_image(url_or_file)
+        text_result = get_derived_cache().get_or_compute(stream.getvalue(), 'pdf_text', PDF_TEXT_VERSION, {}, extract)[0].get_str()
 
         if stream:
             write_client_stream(
@@ -132,62 +263,47 @@ class Pdf():
         if not stream:
             return []
 
-        pdf = pdfplumber.open(stream)
-        pages_count = len(pdf.pages)
-        content: List[Content] = []
-
-        if pages_count <= 0:
-            # try the old way
-            return [Content(PdfHelpers.parse_pdf_image(url_or_file))]
-
-        # determine the the space tolerance
-        first_page = pdf.pages[0]
-        x_tolerance = 3
-
-        while x_tolerance >= 1:
-            text = first_page.extract_text(x_tolerance=x_tolerance)
-            if asyncio.run(self.__check_rendering(text)):
-                break
-            else:
-                x_tolerance -= 1
-
-        if x_tolerance == 0:
-            return [Content(PdfHelpers.parse_pdf_image(url_or_file))]
-
-        original = first_page.to_image(resolution=150, antialias=True).original
-        return_image = BytesIO()
-        original.save(return_image, format='PNG')
-
-        # parse each page
-        for i in range(0, pages_count):
-            page_content: List[Content] = []
-            page = pdf.pages[i]
-            text = page.extract_text(x_tolerance=x_tolerance)
-            if text:
-                page_content.append(Content(text))
-
-            images = page.images
-            for img in images:
-                raw_data = img['stream'].get_rawdata()
-                _, raw_data = Helpers.decompress_if_compressed(raw_data)
-                if Helpers.is_image(raw_data):
-                    img_stream = BytesIO(img['stream'].get_rawdata())
-                    im = Image.open(img_stream)
-                    buf = io.BytesIO()
-                    im.save(buf, format='PNG')
-                    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
-                        im.save(temp_file.name, format='PNG', optimize=False, compression_level=0)
-                        page_content.append(ImageContent(buf.getvalue(), url=temp_file.name))
-                else:
-                    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
-                        image_bbox = (img['x0'], page.height - img['y1'], img['x1'], page.height - img['y0'])
-                        page.crop(image_bbox).to_image(resolution=150, antialias=True).save(temp_file.name, format='PNG', optimize=False, compression_level=0)
-                        im = Image.open(temp_file.name)
-                        buf = io.BytesIO()
-                        im.save(buf, format='PNG')
-                        page_content.append(ImageContent(buf.getvalue(), url=temp_file.name))
-
-            content.extend(page_content)
+        # the shard workers and the ocr fallback read the pdf from disk
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp:
+            temp.write(byte_stream)
+
+        try:
+            with pdfplumber.open(stream) as pdf:
+                pages_count = len(pdf.pages)
+                content: List[Content] = []
+
+                if pages_count <= 0:
+                    # try the old way
+                    return [Content(PdfHelpers.parse_pdf_image(temp.name))]
+
+                # determine the the space tolerance
+                first_page = pdf.pages[0]
+                x_tolerance = 3
+
+                while x_tolerance >= 1:
+                    text = first_page.extract_text(x_tolerance=x_tolerance)
+                    if asyncio.run(self.__check_rendering(text)):
+                        break
+                    else:
+                        x_tolerance -= 1
+
+                if x_tolerance == 0:
+                    return [Content(PdfHelpers.parse_pdf_image(temp.name))]
+
+                original = first_page.to_image(resolution=150, antialias=True).original
+                return_image = BytesIO()
+                original.save(return_image, format='PNG')
+
+            # parse the pages in shards across the process pool
+            pages = run_sharded(extract_pages, temp.name, pages_count, x_tolerance)
+        finally:
+            os.remove(temp.name)
+
+        for page in pages:
+            if page.text:
+                content.append(Content(page.text))
+            for image_bytes, image_file in page.images:
+                content.append(ImageContent(image_bytes, url=image_file))
 
         write_client_stream(
             StreamNode(
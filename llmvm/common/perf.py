@@ -71,6 +71,11 @@ class TokenPerf:
         self.stop_reason = ''
         self.stop_token = ''
         self.object = None
+        # set when the response was served from the ResponseCache
+        self.cache_hit = False
+        self.saved_tokens = 0
+        self.cache_hit_rate = 0.0
+        self.cache_saved_tokens = 0
 
     def start(self):
         if self.enabled:
@@ -117,7 +122,9 @@ class TokenPerf:
                 'request_id': self.request_id,
                 'stop_reason': self.stop_reason,
                 'stop_token': self.stop_token,
-                'ticks': self.ticks()
+                'ticks': self.ticks(),
+                'cache_hit': self.cache_hit,
+                'saved_tokens': self.saved_tokens,
             }
         else:
             return {}
@@ -150,6 +157,8 @@ class TokenPerf:
             logging.debug(f"prompt_len: {res['prompt_len']} completion_len: {res['completion_len']} model: {res['model']}")
             logging.debug(f"p_tok_sec: {res['p_tok_sec']:.2f} s_tok_sec: {res['s_tok_sec']:.2f} stop_reason: {res['stop_reason']}")
             logging.debug(f"p_cost: ${res['p_cost']:.5f} s_cost: ${res['s_cost']:.5f} request_id: {res['request_id']}")
+            if self.cache_hit:
+                logging.debug(f"response cache hit, saved_tokens: {self.saved_tokens} hit_rate: {self.cache_hit_rate:.2%} total_saved_tokens: {self.cache_saved_tokens}")  # noqa E501
 
     def log(self):
         if self.enabled:
@@ -177,7 +186,9 @@ class TokenPerf:
                 'request_id': '',
                 'stop_reason': '',
                 'stop_token': '',
-                'ticks': []
+                'ticks': [],
+                'cache_hit': self.cache_hit,
+                'saved_tokens': self.saved_tokens,
             }
 
 
@@ -204,6 +215,10 @@ class LoggingAsyncIterator:
                     self.perf.stop_reason = result.choices[0].finish_reason
                 return cast(str, result.choices[0].message.content or '')  # type: ignore
             elif isinstance(result, GeminiCompletion):
+                # the last chunk carries the usage for the whole response
+                usage = getattr(result, 'usage_metadata', None)
+                if usage and usage.candidates_token_count:
+                    self.perf._completion_len = usage.candidates_token_count
                 return cast(str, result.text or '')
             elif isinstance(result, str):
                 return result
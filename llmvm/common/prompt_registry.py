@@ -0,0 +1,121 @@
+import datetime
+import threading
+import zoneinfo
+from importlib import resources
+from typing import Dict, List, Set, Tuple
+
+from llmvm.common.logging_helpers import setup_logging
+from llmvm.common.singleton import Singleton
+
+logging = setup_logging()
+
+
+class PromptTemplate():
+    """
+    A prompt message split once into literal and {{placeholder}} segments, so rendering is a
+    single join over the segments instead of a str.replace per template key.
+    """
+    def __init__(self, text: str):
+        # (is_placeholder, literal text or placeholder key)
+        self.segments: List[Tuple[bool, str]] = []
+        self.keys: List[str] = []
+
+        position = 0
+        while True:
+            start = text.find('{{', position)
+            end = text.find('}}', start) if start != -1 else -1
+            if start == -1 or end == -1:
+                break
+            if start > position:
+                self.segments.append((False, text[position:start]))
+            key = text[start + 2:end]
+            self.segments.append((True, key))
+            self.keys.append(key)
+            position = end + 2
+
+        if position < len(text):
+            self.segments.append((False, text[position:]))
+
+    # exec() placeholders that have failed once render empty without being re-evaluated or re-logged
+    failed_execs: Set[str] = set()
+
+    def render(self, template: Dict[str, str], exec_results: Dict[str, str]) -> str:
+        parts: List[str] = []
+        for is_placeholder, text in self.segments:
+            if not is_placeholder:
+                parts.append(text)
+            elif text in template:
+                parts.append(template[text])
+            elif text.startswith('exec('):
+                # things like {{exec(datetime.datetime.now().strftime("%Y-%m-%d"))}}, evaluated once per render
+                if text not in exec_results:
+                    exec_results[text] = ''
+                    if text not in PromptTemplate.failed_execs:
+                        try:
+                            exec_results[text] = str(eval(text[5:-1], {'datetime': datetime, 'zoneinfo': zoneinfo}))
+                        except Exception as ex:
+                            logging.debug(f'PromptTemplate.render() {text} failed with: {ex}')
+                            PromptTemplate.failed_execs.add(text)
+                parts.append(exec_results[text])
+            else:
+                # unknown placeholders render as their bare key
+                parts.append(text)
+        return ''.join(parts)
+
+
+class Prompt():
+    def __init__(self, prompt_text: str):
+        if '[system_message]' not in prompt_text:
+            raise ValueError('Prompt file must contain [system_message]')
+
+        if '[user_message]' not in prompt_text:
+            raise ValueError('Prompt file must contain [user_message]')
+
+        start = prompt_text.find('[system_message]') + len('[system_message]')
+        self.system_message = prompt_text[start:prompt_text.find('[user_message]', start)].strip()
+        self.user_message = prompt_text[prompt_text.find('[user_message]') + len('[user_message]'):].strip()
+        self.system = PromptTemplate(self.system_message)
+        self.user = PromptTemplate(self.user_message)
+        self.templates = self.system.keys + self.user.keys
+
+    def render(self, template: Dict[str, str], append_token: str = '') -> Tuple[str, str]:
+        exec_results: Dict[str, str] = {}
+        return (
+            self.system.render(template, exec_results),
+            self.user.render(template, exec_results) + append_token,
+        )
+
+
+class PromptRegistry(metaclass=Singleton):
+    """
+    Parsed .prompt files, keyed by (module, prompt_name). Files are read and tokenized the
+    first time they're asked for, or up front with preload().
+    """
+    def __init__(self):
+        self.prompts: Dict[Tuple[str, str], Prompt] = {}
+        self.lock = threading.Lock()
+
+    def get(self, prompt_name: str, module: str = 'llmvm.server.prompts.python') -> Prompt:
+        key = (module, prompt_name)
+        prompt = self.prompts.get(key)
+        if prompt is None:
+            with open(resources.files(module) / prompt_name, 'r') as f:  # type: ignore
+                prompt = Prompt(f.read())
+            with self.lock:
+                self.prompts[key] = prompt
+        return prompt
+
+    def preload(self, module: str = 'llmvm.server.prompts.python') -> int:
+        count = 0
+        for entry in resources.files(module).iterdir():
+            if entry.name.endswith('.prompt'):
+                try:
+                    self.get(entry.name, module)
+                    count += 1
+                except ValueError as ex:
+                    logging.debug(f'PromptRegistry.preload() skipping {entry.name}: {ex}')
+        return count
+
+    def parse(self, prompt_text: str) -> Prompt:
+        # prompts that arrive as message content rather than from a file aren't cached
+        return Prompt(prompt_text)
@@ -0,0 +1,326 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from llmvm.common.logging_helpers import setup_logging
+from llmvm.common.objects import (Assistant, AstNode, Content, Executor, Message, TokenStopNode,
+                                  awaitable_none)
+from llmvm.common.perf import TokenPerf
+from llmvm.common.response_cache import ResponseCache
+from llmvm.common.token_estimator import get_token_estimator
+
+logging = setup_logging()
+
+
+class ReplayExecutor(Executor):
+    """
+    Wraps a real executor to record its aexecute() exchanges to a jsonl file (the wrapped
+    messages, the streamed tokens and when each arrived), or to replay them offline so the
+    controller, runtime, searcher and compression paths can be profiled without the network.
+
+    Replays are matched on the same key as the ResponseCache (executor, model, wrapped messages,
+    stop tokens, max output tokens). A request with no recorded match gets the next unplayed
+    exchange in recording order unless strict is set, so prompts that embed the date still
+    replay. time_scale stretches the recorded timing: 1.0 is the original speed, 0.5 twice as
+    fast, 0 as fast as possible. Everything other than aexecute() goes to the wrapped executor,
+    which is never asked to execute anything while replaying.
+
+    Token counts are recorded too, since budgeting, map/reduce and compression count before they
+    execute and some executors count remotely. A replayed count that wasn't recorded is estimated
+    locally with the executor's TokenEstimator (Anthropic's where it has none), never by the api.
+
+    Record with the response cache off, or cache hits get recorded as instant responses.
+    """
+    def __init__(
+        self,
+        executor: Executor,
+        recording_file: str,
+        mode: str = 'replay',
+        time_scale: float = 1.0,
+        strict: bool = False,
+    ):
+        super().__init__(
+            default_model=executor.default_model,
+            api_endpoint=executor.api_endpoint,
+            default_max_token_len=executor.default_max_token_len,
+            default_max_output_len=executor.default_max_output_len,
+        )
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'ReplayExecutor mode must be record or replay, not {mode}')
+
+        self.executor = executor
+        self.recording_file = os.path.expanduser(recording_file)
+        self.mode = mode
+        self.time_scale = time_scale
+        self.strict = strict
+        self.lock = threading.Lock()
+        self.exchanges: List[Dict[str, Any]] = []
+        self.by_key: Dict[str, Deque[int]] = {}
+        self.played: set[int] = set()
+        self.next_unplayed = 0
+        # count key -> recorded token count
+        self.counts: Dict[str, int] = {}
+
+        if self.mode == 'replay':
+            self.load()
+
+    def __getattr__(self, name: str) -> Any:
+        # user_token(), count_tokens(), wrap_messages() and the rest come from the real executor
+        if name.startswith('__') or name == 'executor':
+            raise AttributeError(name)
+        return getattr(self.executor, name)
+
+    def name(self) -> str:
+        return self.executor.name()
+
+    def count_key(self, model: str, messages: List[Message] | str) -> str:
+        content = messages if isinstance(messages, str) else self.wrap(model, messages)
+        return ResponseCache.key(self.name(), model, content, [], 0)  # type: ignore
+
+    def __record_count(self, key: str, tokens: int) -> None:
+        with self.lock:
+            if self.counts.get(key) == tokens:
+                return
+            self.counts[key] = tokens
+            os.makedirs(os.path.dirname(self.recording_file) or '.', exist_ok=True)
+            with open(self.recording_file, 'a') as f:
+                f.write(json.dumps({'count_key': key, 'tokens': tokens}) + '\n')
+
+    def __replay_count(self, key: str, messages: List[Message] | str) -> int:
+        if key in self.counts:
+            return self.counts[key]
+
+        estimator = get_token_estimator(self.name()) or get_token_estimator('anthropic')
+        assert estimator
+        if isinstance(messages, str):
+            return estimator.upper(messages)
+        # the same per message overhead the executors add
+        return int(estimator.upper_batch([message.message.get_str() for message in messages]).sum()) + 4 * len(messages)
+
+    async def count_tokens(
+        self,
+        messages: List[Message] | str,
+        model: Optional[str] = None,
+    ) -> int:
+        model = model if model else self.default_model
+        key = self.count_key(model, messages)
+        if self.mode == 'replay':
+            return self.__replay_count(key, messages)
+
+        tokens = await self.executor.count_tokens(messages, model=model)
+        self.__record_count(key, tokens)
+        return tokens
+
+    async def count_tokens_batch(
+        self,
+        contents: List[str],
+        model: Optional[str] = None,
+    ) -> List[int]:
+        model = model if model else self.default_model
+        keys = [self.count_key(model, content) for content in contents]
+        if self.mode == 'replay':
+            return [self.__replay_count(key, content) for key, content in zip(keys, contents)]
+
+        counts = await self.executor.count_tokens_batch(contents, model=model)
+        for key, tokens in zip(keys, counts):
+            self.__record_count(key, tokens)
+        return counts
+
+    def user_token(self) -> str:
+        return self.executor.user_token()
+
+    def assistant_token(self) -> str:
+        return self.executor.assistant_token()
+
+    def append_token(self) -> str:
+        return self.executor.append_token()
+
+    def set_default_model(self, default_model: str) -> None:
+        super().set_default_model(default_model)
+        self.executor.set_default_model(default_model)
+
+    def set_default_max_tokens(self, default_max_token_len: int) -> None:
+        super().set_default_max_tokens(default_max_token_len)
+        self.executor.set_default_max_tokens(default_max_token_len)
+
+    def load(self) -> None:
+        if not os.path.exists(self.recording_file):
+            raise ValueError(f'ReplayExecutor recording {self.recording_file} does not exist')
+
+        with open(self.recording_file, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if 'count_key' in entry:
+                    self.counts[entry['count_key']] = entry['tokens']
+                else:
+                    self.exchanges.append(entry)
+        for index, exchange in enumerate(self.exchanges):
+            self.by_key.setdefault(exchange['key'], deque()).append(index)
+        logging.debug(f'ReplayExecutor: loaded {len(self.exchanges)} exchanges and {len(self.counts)} token counts from {self.recording_file}')  # noqa E501
+
+    def wrap(self, model: str, messages: List[Message]) -> List[Dict[str, Any]]:
+        # what the provider would have been sent, the gemini executor doesn't expose it
+        if hasattr(self.executor, 'wrap_messages'):
+            return self.executor.wrap_messages(model, messages)  # type: ignore
+        return [Message.to_dict(message) for message in messages]
+
+    def __take(self, key: str) -> Dict[str, Any]:
+        with self.lock:
+            indexes = self.by_key.get(key)
+            while indexes and indexes[0] in self.played:
+                indexes.popleft()
+
+            if indexes:
+                index = indexes.popleft()
+            elif self.strict:
+                raise ValueError(f'ReplayExecutor: no recorded exchange for {key} in {self.recording_file}')
+            else:
+                while self.next_unplayed in self.played:
+                    self.next_unplayed += 1
+                if self.next_unplayed >= len(self.exchanges):
+                    raise ValueError(f'ReplayExecutor: all {len(self.exchanges)} exchanges in {self.recording_file} have been played')  # noqa E501
+                index = self.next_unplayed
+                logging.debug(f'ReplayExecutor: no recorded exchange for {key}, replaying exchange {index} in order')
+
+            self.played.add(index)
+            return self.exchanges[index]
+
+    async def __replay(
+        self,
+        key: str,
+        model: str,
+        stream_handler: Callable[[AstNode], Awaitable[None]],
+    ) -> Tuple[Dict[str, Any], TokenPerf]:
+        exchange = self.__take(key)
+        perf = TokenPerf('aexecute_replay', self.name(), model, prompt_len=exchange['prompt_tokens'])
+        perf.start()
+
+        start = time.perf_counter()
+        for offset, text in exchange['tokens']:
+            if self.time_scale > 0:
+                # sleep against the recorded schedule rather than per token, so timing doesn't drift
+                delay = start + offset * self.time_scale - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            perf.tick()
+            await stream_handler(Content(text))
+        await stream_handler(TokenStopNode())
+        perf.stop()
+
+        perf._completion_len = exchange['completion_tokens']
+        perf.stop_reason = exchange['stop_reason']
+        perf.stop_token = exchange['stop_token']
+        return exchange, perf
+
+    async def __record(
+        self,
+        key: str,
+        wrapped: List[Dict[str, Any]],
+        messages: List[Message],
+        max_output_tokens: int,
+        temperature: float,
+        stop_tokens: List[str],
+        model: str,
+        stream_handler: Callable[[AstNode], Awaitable[None]],
+        template_args: Optional[Dict[str, Any]],
+    ) -> Assistant:
+        tokens: List[List[Any]] = []
+        start = time.perf_counter()
+
+        async def recording_handler(node: AstNode):
+            if isinstance(node, Content):
+                tokens.append([time.perf_counter() - start, node.get_str()])
+            await stream_handler(node)
+
+        assistant = await self.executor.aexecute(
+            messages,
+            max_output_tokens=max_output_tokens,
+            temperature=temperature,
+            stop_tokens=stop_tokens,
+            model=model,
+            stream_handler=recording_handler,
+            template_args=template_args,
+        )
+
+        perf = assistant.perf_trace
+        if perf and perf.cache_hit:
+            logging.warning('ReplayExecutor: recording a response cache hit, turn response_cache off to record real timing')
+
+        exchange = {
+            'key': key,
+            'executor': self.name(),
+            'model': model,
+            'temperature': temperature,
+            'stop_tokens': stop_tokens,
+            'max_output_tokens': max_output_tokens,
+            'messages': wrapped,
+            'response': assistant.message.get_str(),
+            'tokens': tokens,
+            'seconds': time.perf_counter() - start,
+            'stop_reason': assistant.stop_reason,
+            'stop_token': assistant.stop_token,
+            'prompt_tokens': perf._prompt_len if perf else 0,
+            'completion_tokens': perf._completion_len if perf else len(tokens),
+            'recorded': time.time(),
+        }
+        with self.lock:
+            os.makedirs(os.path.dirname(self.recording_file) or '.', exist_ok=True)
+            with open(self.recording_file, 'a') as f:
+                f.write(json.dumps(exchange, default=str) + '\n')
+            self.exchanges.append(exchange)
+        return assistant
+
+    async def aexecute(
+        self,
+        messages: List[Message],
+        max_output_tokens: int = 4096,
+        temperature: float = 0.0,
+        stop_tokens: List[str] = [],
+        model: Optional[str] = None,
+        stream_handler: Optional[Callable[[AstNode], Awaitable[None]]] = awaitable_none,
+        template_args: Optional[Dict[str, Any]] = None,
+    ) -> Assistant:
+        model = model if model else self.default_model
+        stream_handler = stream_handler or awaitable_none
+        wrapped = self.wrap(model, messages)
+        key = ResponseCache.key(self.name(), model, wrapped, stop_tokens, max_output_tokens)
+
+        if self.mode == 'record':
+            return await self.__record(
+                key, wrapped, messages, max_output_tokens, temperature, stop_tokens, model, stream_handler, template_args
+            )
+
+        exchange, perf = await self.__replay(key, model, stream_handler)
+        perf.log()
+
+        response = Assistant(Content(exchange['response']))
+        assistant = Assistant(
+            message=response.message,
+            messages_context=list(messages) + [response],
+            stop_reason=perf.stop_reason,
+            stop_token=perf.stop_token,
+        )
+        assistant.perf_trace = perf
+        return assistant
+
+    def execute(
+        self,
+        messages: List[Message],
+        max_output_tokens: int = 4096,
+        temperature: float = 0.0,
+        stop_tokens: List[str] = [],
+        model: Optional[str] = None,
+        stream_handler: Optional[Callable[[AstNode], None]] = None,
+        template_args: Optional[Dict[str, Any]] = None,
+    ) -> Assistant:
+        async def stream_pipe(node: AstNode):
+            if stream_handler:
+                stream_handler(node)
+
+        return asyncio.run(self.aexecute(messages, max_output_tokens, temperature, stop_tokens, model, stream_pipe, template_args))
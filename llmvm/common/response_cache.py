@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from llmvm.common.container import Container
+from llmvm.common.logging_helpers import setup_logging
+from llmvm.common.objects import AstNode, Content, TokenStopNode
+from llmvm.common.perf import TokenPerf
+
+logging = setup_logging()
+
+
+class ResponseCache():
+    """
+    On disk cache of temperature 0 completions, keyed by (executor, model, wrapped messages,
+    stop tokens, max output tokens). Entries expire after ttl_seconds, and the least recently
+    used entries are evicted once the cache grows past max_bytes. Any other temperature
+    bypasses the cache.
+    """
+    def __init__(
+        self,
+        cache_directory: str,
+        enabled: bool = True,
+        ttl_seconds: float = 7 * 24 * 60 * 60,
+        max_bytes: int = 256 * 1024 * 1024,
+        database_name: str = 'responses.db',
+    ):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+
+        if not self.enabled:
+            return
+
+        os.makedirs(cache_directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(cache_directory, database_name), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, response TEXT NOT NULL, stop_reason TEXT, stop_token TEXT, '
+            'prompt_tokens INTEGER, completion_tokens INTEGER, size INTEGER, created REAL, last_access REAL)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self.connection.commit()
+
+    def cacheable(self, temperature: float) -> bool:
+        return self.enabled and temperature == 0.0
+
+    @staticmethod
+    def key(
+        executor: str,
+        model: str,
+        messages: List[Dict[str, Any]],
+        stop_tokens: List[str],
+        max_output_tokens: int,
+    ) -> str:
+        payload = json.dumps([executor, model, messages, stop_tokens, max_output_tokens], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8', errors='replace')).hexdigest()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT response, stop_reason, stop_token, prompt_tokens, completion_tokens, created FROM responses WHERE key = ?',
+                (key,)
+            ).fetchone()
+
+            if not row or time.time() - row[5] > self.ttl_seconds:
+                if row:
+                    self.connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                    self.connection.commit()
+                self.misses += 1
+                return None
+
+            self.connection.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+            self.connection.commit()
+            self.hits += 1
+            self.saved_tokens += (row[3] or 0) + (row[4] or 0)
+            return {
+                'response': row[0],
+                'stop_reason': row[1] or '',
+                'stop_token': row[2] or '',
+                'prompt_tokens': row[3] or 0,
+                'completion_tokens': row[4] or 0,
+            }
+
+    def put(
+        self,
+        key: str,
+        response: str,
+        stop_reason: str = '',
+        stop_token: str = '',
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+    ) -> None:
+        # don't cache failed or empty completions
+        if not response:
+            return
+
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, response, stop_reason, stop_token, prompt_tokens, completion_tokens, len(response.encode('utf-8')), now, now)  # noqa E501
+            )
+            self.connection.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl_seconds,))
+
+            total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if total > self.max_bytes:
+                # drop the least recently used entries until we're back under budget
+                for row_key, size in self.connection.execute('SELECT key, size FROM responses ORDER BY last_access').fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self.connection.execute('DELETE FROM responses WHERE key = ?', (row_key,))
+                    total -= size
+            self.connection.commit()
+
+    async def replay(
+        self,
+        entry: Dict[str, Any],
+        stream_handler: Callable[[AstNode], Awaitable[None]],
+        executor: str,
+        model: str,
+    ) -> TokenPerf:
+        """
+        Streams a cached response to stream_handler as if it came from the model, and returns
+        a TokenPerf recording the hit.
+        """
+        perf = TokenPerf('aexecute_cached', executor, model, prompt_len=entry['prompt_tokens'])
+        perf.start()
+        await stream_handler(Content(entry['response']))
+        await stream_handler(TokenStopNode())
+        perf.stop()
+
+        perf._completion_len = entry['completion_tokens']
+        perf.stop_reason = entry['stop_reason']
+        perf.stop_token = entry['stop_token']
+        perf.cache_hit = True
+        perf.saved_tokens = entry['prompt_tokens'] + entry['completion_tokens']
+        perf.cache_hit_rate = self.hit_rate()
+        perf.cache_saved_tokens = self.saved_tokens
+        return perf
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            cache_directory=os.path.expanduser(
+                Container.get_config_variable('cache_directory', 'LLMVM_CACHE_DIRECTORY', default='~/.local/share/llmvm/cache')
+            ),
+            enabled=Container.get_config_variable('response_cache', 'LLMVM_RESPONSE_CACHE', default=True),
+            ttl_seconds=float(Container.get_config_variable('response_cache_ttl_seconds', 'LLMVM_RESPONSE_CACHE_TTL_SECONDS', default=7 * 24 * 60 * 60)),  # noqa E501
+            max_bytes=int(Container.get_config_variable('response_cache_max_bytes', 'LLMVM_RESPONSE_CACHE_MAX_BYTES', default=256 * 1024 * 1024)),  # noqa E501
+        )
+    return _response_cache
@@ -0,0 +1,65 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Coroutine, Optional, TypeVar
+
+from llmvm.common.container import Container
+from llmvm.common.logging_helpers import setup_logging
+from llmvm.common.objects import AstNode, awaitable_none
+
+logging = setup_logging()
+
+T = TypeVar('T')
+
+_local = threading.local()
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def runtime_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(Container.get_config_variable('runtime_workers', 'LLMVM_RUNTIME_WORKERS', default=8)),
+                thread_name_prefix='llmvm-runtime',
+            )
+        return _executor
+
+
+def run_coroutine(coroutine: Coroutine[Any, Any, T]) -> T:
+    """
+    Runs a coroutine to completion from synchronous code. On a worker thread started by
+    run_in_worker() the coroutine is scheduled on the event loop that is serving the request
+    (so it shares that loop's clients and can touch its queues) and the worker blocks on the
+    result. Anywhere else it falls back to asyncio.run().
+    """
+    loop: Optional[asyncio.AbstractEventLoop] = getattr(_local, 'loop', None)
+    if loop is not None and not loop.is_closed():
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+    return asyncio.run(coroutine)
+
+
+async def run_in_worker(
+    func: Callable[..., T],
+    *args,
+    stream_handler: Callable[[AstNode], Awaitable[None]] = awaitable_none,
+    **kwargs,
+) -> T:
+    """
+    Runs a blocking function (typically PythonRuntime.run) on the runtime thread pool so the
+    event loop keeps serving other sessions while it executes. LLM calls and client stream
+    writes made by func are bridged back to the calling loop through run_coroutine().
+    """
+    loop = asyncio.get_running_loop()
+
+    # write_client_stream() finds stream_handler by walking the stack, so it has to be a local
+    # of this frame, the bottom of the worker thread's stack
+    def worker(stream_handler: Callable[[AstNode], Awaitable[None]] = stream_handler) -> T:
+        _local.loop = loop
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.loop = None
+
+    return await loop.run_in_executor(runtime_executor(), worker)
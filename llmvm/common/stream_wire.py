@@ -0,0 +1,155 @@
+import json
+from typing import Any, Iterator, List, Optional, Tuple
+
+import jsonpickle
+
+from llmvm.common.objects import Content, StreamNode, TokenStopNode
+
+# Framing for /v1/tools/completions, /v1/tools/completions_delta and /download streams.
+#
+# v1 (legacy) is server sent events with a jsonpickle payload per node: 'data: <jsonpickle>\n\n'.
+#
+# v2 is one compact JSON event per line, with an optional raw payload following the line:
+#   {"t":"c","v":"token text"}                     text token
+#   {"t":"s"}                                      token stop (newline)
+#   {"t":"b","n":<bytes>,"k":"bytes","m":{...}}    StreamNode, followed by n raw bytes
+#   {"t":"o","v":{...}}                            JSON object (thread frames)
+#   {"t":"p","v":"<jsonpickle>"}                   anything else
+#   {"t":"d"}                                      end of stream
+#
+# Clients ask for v2 with 'Accept: application/x-llmvm-stream; v=2'. The response content-type
+# says which framing was used, so old clients and old servers keep talking v1.
+
+WIRE_MEDIA_TYPE = 'application/x-llmvm-stream'
+WIRE_VERSION = 2
+LEGACY_MEDIA_TYPE = 'text/event-stream'
+
+
+def accept_header(version: int = WIRE_VERSION) -> str:
+    return f'{WIRE_MEDIA_TYPE}; v={version}, {LEGACY_MEDIA_TYPE}'
+
+
+def negotiate(accept: Optional[str]) -> int:
+    """
+    Returns the highest wire version both sides speak, given the request's Accept header.
+    """
+    if not accept or WIRE_MEDIA_TYPE not in accept:
+        return 1
+
+    for media_range in accept.split(','):
+        media_type, *params = [part.strip() for part in media_range.split(';')]
+        if media_type != WIRE_MEDIA_TYPE:
+            continue
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'v' and value.strip().isdigit():
+                return min(int(value), WIRE_VERSION)
+    return 1
+
+
+def media_type(version: int) -> str:
+    return f'{WIRE_MEDIA_TYPE}; v={version}' if version >= 2 else LEGACY_MEDIA_TYPE
+
+
+def response_version(content_type: Optional[str]) -> int:
+    if content_type and content_type.startswith(WIRE_MEDIA_TYPE):
+        return negotiate(content_type)
+    return 1
+
+
+def __line(event: dict) -> bytes:
+    return json.dumps(event, separators=(',', ':'), ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def encode(obj: Any) -> bytes:
+    """
+    Encodes one streamed object as a v2 frame.
+    """
+    # plain text tokens are the vast majority of frames
+    if type(obj) is Content and isinstance(obj.sequence, list) and all(isinstance(s, str) for s in obj.sequence):
+        return __line({'t': 'c', 'v': ''.join(obj.sequence)})
+    elif isinstance(obj, str):
+        return __line({'t': 'c', 'v': obj})
+    elif isinstance(obj, TokenStopNode):
+        return __line({'t': 's'})
+    elif isinstance(obj, StreamNode) and isinstance(obj.obj, (bytes, bytearray)):
+        header = {'t': 'b', 'n': len(obj.obj), 'k': obj.type}
+        if obj.metadata is not None:
+            header['m'] = obj.metadata
+        try:
+            return __line(header) + bytes(obj.obj)
+        except TypeError:
+            pass
+    elif isinstance(obj, (dict, list)):
+        try:
+            return __line({'t': 'o', 'v': obj})
+        except (TypeError, ValueError):
+            # bytes or other non-JSON values, let jsonpickle deal with them
+            pass
+
+    return __line({'t': 'p', 'v': jsonpickle.encode(obj)})
+
+
+def encode_done() -> bytes:
+    return __line({'t': 'd'})
+
+
+class StreamDecoder():
+    """
+    Incremental v2 parser: feed() it chunks as they arrive off the socket and it returns the
+    objects that are complete. Bytes are only scanned once, however the frames are split across
+    chunks, so a large final thread frame costs the same as parsing it in one piece.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        # where to resume looking for the end of the current header line
+        self.scanned = 0
+        # bytes still to read for a binary frame whose header has been parsed
+        self.pending: Optional[Tuple[dict, int]] = None
+        self.done = False
+
+    def feed(self, data: bytes) -> List[Any]:
+        self.buffer += data
+        return list(self.__frames())
+
+    def __frames(self) -> Iterator[Any]:
+        while True:
+            if self.pending:
+                header, length = self.pending
+                if len(self.buffer) < length:
+                    return
+                payload = bytes(self.buffer[:length])
+                del self.buffer[:length]
+                self.pending = None
+                yield StreamNode(payload, type=header.get('k', 'bytes'), metadata=header.get('m'))
+                continue
+
+            newline = self.buffer.find(b'\n', self.scanned)
+            if newline < 0:
+                self.scanned = len(self.buffer)
+                return
+
+            line = bytes(self.buffer[:newline])
+            del self.buffer[:newline + 1]
+            self.scanned = 0
+            if not line.strip():
+                continue
+
+            event = json.loads(line)
+            kind = event.get('t')
+            if kind == 'c':
+                yield Content(event['v'])
+            elif kind == 's':
+                yield TokenStopNode()
+            elif kind == 'b':
+                self.pending = (event, int(event['n']))
+            elif kind == 'o':
+                yield event['v']
+            elif kind == 'p':
+                yield jsonpickle.decode(event['v'])
+            elif kind == 'd':
+                self.done = True
+            else:
+                # newer minor additions are skipped rather than breaking older clients
+                continue
+
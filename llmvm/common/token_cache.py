@@ -0,0 +1,80 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+
+from llmvm.common.container import Container
+
+
+class TokenCountCache():
+    """
+    Process wide LRU of token counts keyed by (executor, model, content hash). Executors
+    consult it before calling their tokenizer (or the remote count_tokens endpoint), so the
+    compression strategies can re-count the same message strings for free.
+    """
+    def __init__(self, max_size: int = 65536):
+        self.max_size = max_size
+        self.cache: OrderedDict[Tuple[str, str, bytes], int] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(executor: str, model: str, content: str) -> Tuple[str, str, bytes]:
+        return (executor, model, hashlib.blake2b(content.encode('utf-8', errors='replace'), digest_size=16).digest())
+
+    def get(self, executor: str, model: str, content: str) -> Optional[int]:
+        key = TokenCountCache.key(executor, model, content)
+        with self.lock:
+            if key not in self.cache:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+    def set(self, executor: str, model: str, content: str, token_count: int) -> None:
+        key = TokenCountCache.key(executor, model, content)
+        with self.lock:
+            self.cache[key] = token_count
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def get_or_count(self, executor: str, model: str, content: str, counter: Callable[[str], int]) -> int:
+        token_count = self.get(executor, model, content)
+        if token_count is None:
+            token_count = counter(content)
+            self.set(executor, model, content, token_count)
+        return token_count
+
+    async def aget_or_count(
+        self,
+        executor: str,
+        model: str,
+        content: str,
+        counter: Callable[[str], Awaitable[int]]
+    ) -> int:
+        token_count = self.get(executor, model, content)
+        if token_count is None:
+            token_count = await counter(content)
+            self.set(executor, model, content, token_count)
+        return token_count
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_token_count_cache: Optional[TokenCountCache] = None
+
+
+def get_token_count_cache() -> TokenCountCache:
+    global _token_count_cache
+    if _token_count_cache is None:
+        _token_count_cache = TokenCountCache(
+            max_size=int(Container.get_config_variable('token_count_cache_size', 'LLMVM_TOKEN_COUNT_CACHE_SIZE', default=65536))
+        )
+    return _token_count_cache
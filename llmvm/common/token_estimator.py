@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from llmvm.common.container import Container
+from llmvm.common.logging_helpers import setup_logging
+
+logging = setup_logging()
+
+FEATURES = [
+    'alpha_runs', 'alpha_chars', 'case_changes', 'digits', 'punctuation', 'newlines',
+    'whitespace_runs', 'whitespace_repeats', 'non_ascii_chars', 'continuation_bytes', 'bias',
+]
+
+# hand set starting point for Anthropic's tokenizer, not measured. anthropic_token_counting
+# defaults to remote until scripts/benchmark_token_estimator.py --calibrate (with
+# ANTHROPIC_API_KEY set) has fitted real coefficients and a measured margin
+DEFAULT_CALIBRATION: Dict[str, Dict] = {
+    'anthropic': {
+        'coefficients': [0.55, 0.09, 1.0, 0.4, 0.8, 0.5, 0.0, 0.25, 0.5, 0.5, 1.0],
+        'margin': 0.25,
+    },
+}
+
+
+class TokenEstimator():
+    """
+    Local token count estimate: a linear model over byte level features (word starts, letters,
+    lower to upper case changes, digits, punctuation, newlines, whitespace runs and the spaces
+    after the first in a run, non-ascii characters and their continuation bytes) computed with
+    numpy over a whole batch of strings at once. upper() adds the calibrated margin, so it's
+    safe to budget against; callers that land within the margin of a limit should ask for an
+    exact count.
+    """
+    def __init__(self, coefficients: List[float], margin: float):
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        self.margin = margin
+
+    @staticmethod
+    def features(texts: List[str]) -> np.ndarray:
+        """
+        Returns a (len(texts), len(FEATURES)) matrix.
+        """
+        encoded = [text.encode('utf-8', errors='replace') for text in texts]
+        lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=len(encoded))
+        result = np.zeros((len(texts), len(FEATURES)), dtype=np.float64)
+        result[:, -1] = 1.0
+        if lengths.sum() == 0:
+            return result
+
+        b = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        lower = b | 0x20
+        alpha = (lower >= ord('a')) & (lower <= ord('z'))
+        digit = (b >= ord('0')) & (b <= ord('9'))
+        upper = (b >= ord('A')) & (b <= ord('Z'))
+        newline = b == ord('\n')
+        whitespace = (b == ord(' ')) | (b == ord('\t')) | (b == ord('\r'))
+        punctuation = (b >= 33) & (b < 127) & ~alpha & ~digit
+        # lead bytes of multi-byte utf-8 characters, and the bytes that follow them: emoji and
+        # most cjk cost more tokens per character than accented latin
+        non_ascii = b >= 0xC0
+        continuation = (b >= 0x80) & (b < 0xC0)
+
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        boundaries = starts[starts < len(b)]
+
+        def previous(mask: np.ndarray) -> np.ndarray:
+            # mask shifted one byte right, without carrying over from the previous string
+            shifted = np.concatenate(([False], mask[:-1]))
+            shifted[boundaries] = False
+            return shifted
+
+        alpha_runs = alpha & ~previous(alpha)
+        # camelCase and base64 split into far more tokens than their letter count suggests
+        case_changes = upper & previous(alpha & ~upper)
+        previous_whitespace = previous(whitespace)
+        whitespace_runs = whitespace & ~previous_whitespace
+        whitespace_repeats = whitespace & previous_whitespace
+
+        columns = np.stack([
+            alpha_runs, alpha, case_changes, digit, punctuation, newline,
+            whitespace_runs, whitespace_repeats, non_ascii, continuation,
+        ], axis=1).astype(np.float64)
+        # reduceat needs non-empty segments, so sum everything then mask the empty strings
+        nonempty = lengths > 0
+        result[nonempty, :-1] = np.add.reduceat(columns, starts[nonempty], axis=0)
+        return result
+
+    def estimate_batch(self, texts: List[str]) -> np.ndarray:
+        return np.maximum(TokenEstimator.features(texts) @ self.coefficients, 0.0)
+
+    def estimate(self, text: str) -> int:
+        return int(round(self.estimate_batch([text])[0]))
+
+    def upper_batch(self, texts: List[str]) -> np.ndarray:
+        return np.ceil(self.estimate_batch(texts) * (1.0 + self.margin))
+
+    def upper(self, text: str) -> int:
+        return int(self.upper_batch([text])[0])
+
+    def within_margin(self, upper: int, limit: int) -> bool:
+        """
+        True when an upper bound estimate is over limit but the real count might not be, which
+        is when an exact count is worth paying for.
+        """
+        lower = upper / (1.0 + self.margin) * (1.0 - self.margin)
+        return upper > limit and lower <= limit
+
+
+_estimators: Dict[str, TokenEstimator] = {}
+_estimators_lock = threading.Lock()
+
+
+def calibration_file() -> str:
+    return os.path.join(
+        os.path.expanduser(Container.get_config_variable('cache_directory', 'LLMVM_CACHE_DIRECTORY', default='~/.local/share/llmvm/cache')),
+        'token_estimator.json',
+    )
+
+
+def save_calibration(executor: str, coefficients: List[float], margin: float) -> None:
+    path = calibration_file()
+    calibration: Dict[str, Dict] = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            calibration = json.load(f)
+    calibration[executor] = {'features': FEATURES, 'coefficients': list(coefficients), 'margin': margin}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(calibration, f, indent=2)
+
+    with _estimators_lock:
+        _estimators.pop(executor, None)
+
+
+def get_token_estimator(executor: str) -> Optional[TokenEstimator]:
+    """
+    The estimator for executor's tokenizer, from a saved calibration if there is one, or None
+    if there's nothing to estimate with.
+    """
+    with _estimators_lock:
+        if executor not in _estimators:
+            calibration = DEFAULT_CALIBRATION.get(executor)
+            path = calibration_file()
+            if os.path.exists(path):
+                try:
+                    with open(path, 'r') as f:
+                        saved = json.load(f).get(executor)
+                    if saved and saved.get('features') == FEATURES:
+                        calibration = saved
+                    elif saved:
+                        logging.debug(f'get_token_estimator: {path} was calibrated with different features, recalibrate {executor}')  # noqa E501
+                except (ValueError, OSError) as ex:
+                    logging.debug(f'get_token_estimator: could not read {path}: {ex}')
+            if not calibration:
+                return None
+            _estimators[executor] = TokenEstimator(calibration['coefficients'], float(calibration['margin']))
+        return _estimators[executor]
+
+
+def fit(features: np.ndarray, counts: np.ndarray, coverage: float = 0.99) -> Tuple[List[float], float]:
+    """
+    Least squares coefficients for features -> counts, and the relative margin that puts
+    coverage of the counts at or under the upper bound.
+    """
+    coefficients, *_ = np.linalg.lstsq(features, counts, rcond=None)
+    predicted = np.maximum(features @ coefficients, 1e-9)
+    margin = float(np.quantile(np.maximum(counts / predicted - 1.0, 0.0), coverage))
+    return [float(c) for c in coefficients], margin
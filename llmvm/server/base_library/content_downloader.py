@@ -1,7 +1,7 @@
 import asyncio
 import os
 import tempfile
-from typing import Dict, List, Optional, Tuple
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 import httpx
 import aiofiles
@@ -12,7 +12,7 @@ import playwright.async_api
 
 from llmvm.common.helpers import Helpers
 from llmvm.common.logging_helpers import setup_logging
-from llmvm.common.objects import Content, DownloadParams, FileContent, LLMCall, MarkdownContent, PdfContent, User
+from llmvm.common.objects import Content, DownloadParams, FileContent, LLMCall, MarkdownContent, PdfContent, RequestContext, User
 from llmvm.server.python_execution_controller import ExecutionController
 from llmvm.server.tools.webhelpers import ChromeHelpers, WebHelpers
 from llmvm.common.helpers import write_client_stream
@@ -34,6 +34,37 @@ class WebAndContentDriver():
                 async for chunk in response.aiter_bytes(chunk_size=8192):
                     await file.write(chunk)
 
+    def __loop(self) -> asyncio.AbstractEventLoop:
+        # download() runs on runtime worker threads, which have no event loop until one is set
+        try:
+            loop = asyncio.get_event_loop()
+            if not loop.is_closed():
+                return loop
+        except RuntimeError:
+            pass
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        return loop
+
+    def __chrome(self, call: Callable[[ChromeHelpers], Awaitable[str]]) -> str:
+        # the page always goes back to the browser pool, a failed download would otherwise hold its slot
+        chrome_helper = ChromeHelpers(cookies=self.cookies)
+        loop = self.__loop()
+        try:
+            return loop.run_until_complete(loop.create_task(call(chrome_helper)))
+        finally:
+            loop.run_until_complete(loop.create_task(chrome_helper.close()))
+
+    def __downloaded_content(self, result: str, url: str) -> Content:
+        # sometimes results can be a downloaded file (embedded pdf in the chrome browser)
+        # so we have to deal with that.
+        if os.path.exists(result) and Helpers.is_pdf(open(result, 'rb')):
+            return PdfContent(sequence=b'', url=result)
+        elif os.path.exists(result):
+            return FileContent(sequence=b'', url=result)
+        else:
+            return WebHelpers.convert_html_to_markdown(result, url=url)
+
     def download(self, download: DownloadParams) -> Content:
         logging.debug('WebAndContentDriver.download: {}'.format(download['url']))
 
@@ -51,22 +82,13 @@ class WebAndContentDriver():
 
         # deal with pdfs
         elif (result.scheme == 'http' or result.scheme == 'https') and '.pdf' in result.path:
-            chrome_helper = ChromeHelpers(cookies=self.cookies)
-            loop = asyncio.get_event_loop()
             # downloads the pdf and gets a local file url
-            task = loop.create_task(chrome_helper.pdf_url(download['url']))
-
-            pdf_filename = loop.run_until_complete(task)
-            _ = loop.run_until_complete(loop.create_task(chrome_helper.close()))
+            pdf_filename = self.__chrome(lambda chrome_helper: chrome_helper.pdf_url(download['url']))
             return PdfContent(sequence=b'', url=pdf_filename)
 
         # deal with csv files
         elif (result.scheme == 'http' or result.scheme == 'https') and '.csv' in result.path:
-            chrome_helper = ChromeHelpers(cookies=self.cookies)
-            loop = asyncio.get_event_loop()
-            task = loop.create_task(chrome_helper.download(download['url']))
-            csv_filename = loop.run_until_complete(task)
-            _ = loop.run_until_complete(loop.create_task(chrome_helper.close()))
+            csv_filename = self.__chrome(lambda chrome_helper: chrome_helper.download(download['url']))
             return FileContent(sequence=b'', url=csv_filename)
 
         # deal with websites
@@ -78,34 +100,14 @@ class WebAndContentDriver():
                     asyncio.run(self.__requests_download(download_url, temp_file.name))
                     return PdfContent(sequence=b'', url=temp_file.name)
 
-            chrome_helper = ChromeHelpers(cookies=self.cookies)
-            loop = asyncio.get_event_loop()
             try:
-                task = loop.create_task(chrome_helper.get_url(download['url']))
-                result = loop.run_until_complete(task)
-                _ = loop.run_until_complete(loop.create_task(chrome_helper.close()))
-                # sometimes results can be a downloaded file (embedded pdf in the chrome browser)
-                # so we have to deal with that.
-                if os.path.exists(result) and Helpers.is_pdf(open(result, 'rb')):
-                    return PdfContent(sequence=b'', url=result)
-                elif os.path.exists(result):
-                    return FileContent(sequence=b'', url=result)
-                else:
-                    return WebHelpers.convert_html_to_markdown(result, url=download['url'])
+                result = self.__chrome(lambda chrome_helper: chrome_helper.get_url(download['url']))
+                return self.__downloaded_content(result, download['url'])
             except Exception as e:
                 logging.debug(f'WebAndContentDriver.download() exception: {e}')
                 # see if the browser is trying to download a file
-                chrome_helper = ChromeHelpers(cookies=self.cookies)
-                loop = asyncio.get_event_loop()
-                task = loop.create_task(chrome_helper.download(download['url']))
-                result = loop.run_until_complete(task)
-                _ = loop.run_until_complete(loop.create_task(chrome_helper.close()))
-                if os.path.exists(result) and Helpers.is_pdf(open(result, 'rb')):
-                    return PdfContent(sequence=b'', url=result)
-                elif os.path.exists(result):
-                    return FileContent(sequence=b'', url=result)
-                else:
-                    return WebHelpers.convert_html_to_markdown(result, url=download['url'])
+                result = self.__chrome(lambda chrome_helper: chrome_helper.download(download['url']))
+                return self.__downloaded_content(result, download['url'])
 
         # else, nothing
         return Content(f'WebAndContentDriver.download: nothing found for {download["url"]}')
@@ -114,11 +116,14 @@ class WebAndContentDriver():
             self,
             download: DownloadParams,
             controller: ExecutionController,
+            context: Optional[RequestContext] = None,
         ) -> Content:
         logging.debug(
             'WebAndContentDriver.download_with_goal: url={} goal={} search_term={}'
             .format(download['url'], download['goal'], download['search_term'])
         )
+        context = context or controller.request_context()
+
         # here we're going to go to the url and see if it's the correct content or not, based on the goal
         result = urlparse(download['url'])
 
@@ -135,10 +140,8 @@ class WebAndContentDriver():
                 asyncio.run(self.__requests_download(download_url, temp_file.name))
                 return PdfContent(sequence=b'', url=temp_file.name)
 
-        chrome_helper = ChromeHelpers(cookies=self.cookies)
-        loop = asyncio.get_event_loop()
-        task = loop.create_task(chrome_helper.get_url(download['url']))
-        result = loop.run_until_complete(task)
+        # the page goes back to the browser pool before the llm call
+        result = self.__chrome(lambda chrome_helper: chrome_helper.get_url(download['url']))
 
         if os.path.exists(result) and Helpers.is_pdf(open(result, 'rb')):
             return PdfContent(sequence=b'', url=result)
@@ -164,10 +167,10 @@ class WebAndContentDriver():
                 ),
                 context_messages=[User(markdown_content)],
                 executor=controller.get_executor(),
-                model=controller.get_executor().get_default_model(),
+                model=context.model,
                 temperature=0.0,
-                max_prompt_len=controller.get_executor().max_input_tokens(),
-                completion_tokens_len=controller.get_executor().max_output_tokens(),
+                max_prompt_len=context.max_prompt_len,
+                completion_tokens_len=context.output_token_len,
                 prompt_name='download_and_validate.prompt',
             ),
             query=download['search_term'] or '',
@@ -175,7 +178,6 @@ class WebAndContentDriver():
         )
 
         next_action_str = next_action.message.get_str()
-        loop.run_until_complete(chrome_helper.close())
         logging.debug(f'WebAndContentDriver.download_with_goal decision: {next_action_str}')
 
 
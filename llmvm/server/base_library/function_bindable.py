@@ -8,7 +8,7 @@ import astunparse
 from llmvm.common.helpers import Helpers
 from llmvm.common.logging_helpers import setup_logging
 from llmvm.common.objects import (Assistant, Content, FunctionCall, LLMCall,
-                                  Message, System, User)
+                                  Message, RequestContext, System, User)
 from llmvm.server.python_execution_controller import ExecutionController
 from llmvm.server.python_runtime import PythonRuntime
 
@@ -29,6 +29,7 @@ class FunctionBindable():
         original_query: str,
         controller: ExecutionController,
         python_runtime: PythonRuntime,
+        context: Optional[RequestContext] = None,
     ):
         self.expr = expr
         self.expr_instantiation = expr_instantiation
@@ -42,6 +43,7 @@ class FunctionBindable():
         self.controller = controller
         self.bound_function: Optional[Callable] = None
         self.python_runtime = python_runtime
+        self.context: RequestContext = context or python_runtime.context
         self._result = None
 
     def __call__(self, *args, **kwargs):
@@ -170,10 +172,10 @@ class FunctionBindable():
                         user_message=User(Content()),  # we can pass an empty message here and the context_messages contain everything  # noqa:E501
                         context_messages=messages[:counter + assistant_counter][::-1],  # reversing the list using list slicing
                         executor=self.controller.get_executor(),
-                        model=self.controller.get_executor().get_default_model(),
+                        model=self.context.model,
                         temperature=0.0,
-                        max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                        completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                        max_prompt_len=self.context.max_prompt_len,
+                        completion_tokens_len=self.context.output_token_len,
                         prompt_name=''
                     ),
                     query=self.original_query,
@@ -262,6 +264,7 @@ class FunctionBindable():
                     controller=self.controller,
                     agents=self.agents,
                     vector_search=self.python_runtime.vector_search,
+                    context=self.context,
                 ).run(python_code, '')
 
                 self._result = locals_result[identifier]
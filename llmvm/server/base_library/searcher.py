@@ -1,5 +1,8 @@
+import asyncio
 import re
-from typing import Any, Callable, Dict, List, TypedDict
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypedDict, cast
 
 from googlesearch import search as google_search
 
@@ -7,7 +10,7 @@ from llmvm.common.container import Container
 from llmvm.common.helpers import Helpers, write_client_stream
 from llmvm.common.logging_helpers import setup_logging
 from llmvm.common.objects import (Content, DownloadParams, LLMCall, Message,
-                                  TokenCompressionMethod, User, bcl)
+                                  RequestContext, TokenCompressionMethod, User, bcl)
 from llmvm.server.base_library.content_downloader import WebAndContentDriver
 from llmvm.server.python_execution_controller import ExecutionController
 from llmvm.server.tools.search import SerpAPISearcher
@@ -27,11 +30,13 @@ class Searcher():
         original_query: str,
         vector_search: VectorSearch,
         total_links_to_return: int = 3,
+        context: Optional[RequestContext] = None,
     ):
         self.query = expr
         self.original_code = original_code
         self.original_query = original_query
         self.controller = controller
+        self.context: RequestContext = context or controller.request_context()
         self.query_expansion = 2
 
             # url: str,
@@ -101,10 +106,10 @@ class Searcher():
                 ),
                 context_messages=[],
                 executor=self.controller.get_executor(),
-                model=self.controller.get_executor().get_default_model(),
+                model=self.context.model,
                 temperature=0.0,
-                max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                max_prompt_len=self.context.max_prompt_len,
+                completion_tokens_len=self.context.output_token_len,
                 prompt_name='search_expander.prompt',
             ),
             query=self.query,
@@ -144,7 +149,8 @@ class Searcher():
                         'goal': self.original_query,
                         'search_term': self.query
                         },
-                        controller=self.controller
+                        controller=self.controller,
+                        context=self.context,
                     )
                 else:
                     return WebHelpers.get_url(result['link']['link'])
@@ -155,7 +161,8 @@ class Searcher():
                         'goal': self.original_query,
                         'search_term': self.query
                         },
-                        controller=self.controller
+                        controller=self.controller,
+                        context=self.context,
                     )
                 else:
                     return WebHelpers.get_url(str(result['link']))
@@ -210,10 +217,10 @@ class Searcher():
                 ),
                 context_messages=[],
                 executor=self.controller.get_executor(),
-                model=self.controller.get_executor().get_default_model(),
+                model=self.context.model,
                 temperature=0.0,
-                max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                max_prompt_len=self.context.max_prompt_len,
+                completion_tokens_len=self.context.output_token_len,
                 prompt_name='search_classifier.prompt',
             ),
             query=self.query,
@@ -249,10 +256,10 @@ class Searcher():
                     ),
                     context_messages=[],
                     executor=self.controller.get_executor(),
-                    model=self.controller.get_executor().get_default_model(),
+                    model=self.context.model,
                     temperature=0.0,
-                    max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                    completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                    max_prompt_len=self.context.max_prompt_len,
+                    completion_tokens_len=self.context.output_token_len,
                     prompt_name='search_location.prompt',
                 ),
                 query=self.query,
@@ -299,10 +306,10 @@ class Searcher():
                 ),
                 context_messages=[],
                 executor=self.controller.get_executor(),
-                model=self.controller.get_executor().get_default_model(),
+                model=self.context.model,
                 temperature=0.0,
-                max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                max_prompt_len=self.context.max_prompt_len,
+                completion_tokens_len=self.context.output_token_len,
                 prompt_name='search_ranker.prompt',
             ),
             query=self.query,
@@ -337,25 +344,111 @@ class Searcher():
 
         return self.results()
 
+    def __fetch(self, result: Dict[str, Any], rank: int, started: Dict[int, float]) -> Tuple[Content, List[Any]]:
+        # runs on a worker thread: the download helpers expect a thread event loop, and
+        # anything they write to the client stream is buffered and replayed on the caller's thread.
+        # the fetch's deadline runs from here, not from when it was submitted
+        started[rank] = time.time()
+        streamed: List[Any] = []
+
+        async def stream_handler(obj: Any):
+            streamed.append(obj)
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return self.parser(result), streamed
+        finally:
+            loop.close()
+
     def results(self) -> List[Content]:
-        return_results = []
+        """
+        Fetches the ranked snippets concurrently. Up to total_links_to_return + search_fetch_hedge
+        candidates are in flight at once, each on its own thread with a search_fetch_timeout second
+        deadline from when it starts; a failed or timed out candidate is replaced by the next
+        ranked one. Returns the first
+        total_links_to_return successful results in rank order and abandons the rest.
+        """
+        timeout = float(Container.get_config_variable('search_fetch_timeout', 'LLMVM_SEARCH_FETCH_TIMEOUT', default=30))
+        hedge = int(Container.get_config_variable('search_fetch_hedge', 'LLMVM_SEARCH_FETCH_HEDGE', default=2))
+
+        start_index = self.index
+        next_index = self.index
+        # rank -> Content, or None if it failed
+        resolved: Dict[int, Optional[Content]] = {}
+        in_flight: Dict[Future, int] = {}
+        # rank -> when its fetch started running
+        started: Dict[int, float] = {}
+        # a timed out fetch can't be stopped and keeps its thread, so every candidate gets a
+        # thread of its own and replacements start right away rather than queueing behind stragglers
+        pool = ThreadPoolExecutor(
+            max_workers=max(1, len(self.ordered_snippets) - start_index),
+            thread_name_prefix='llmvm-search',
+        )
 
-        while len(return_results) < self.total_links_to_return and self.index < len(self.ordered_snippets):
-            for result in self.ordered_snippets[self.index:]:
-                self.index += 1
-                try:
-                    parser_content: Content = self.parser(result)
-                    # if parser_content:
-                    #   return_results.append(f"The following content is from: {result['link']} and has the title: {result['title']} \n\n{parser_content}")  # noqa:E501
-                    if parser_content:
-                        return_results.append(parser_content)
-
-                    if len(return_results) >= self.total_links_to_return:
-                        break
-                except Exception as e:
-                    logging.error(e)
-                    pass
-        return return_results
+        def deadline(rank: int) -> float:
+            # a candidate that hasn't started yet hasn't used any of its timeout
+            return started.get(rank, time.time()) + timeout
+
+        def ranked_successes() -> Tuple[List[int], bool]:
+            # successes in rank order, and whether they are final (nothing ahead of them is pending)
+            successes = []
+            for i in range(start_index, next_index):
+                if i not in resolved:
+                    return successes, False
+                if resolved[i] is not None:
+                    successes.append(i)
+                    if len(successes) >= self.total_links_to_return:
+                        return successes, True
+            return successes, len(in_flight) == 0 and next_index >= len(self.ordered_snippets)
+
+        try:
+            while True:
+                successes, done = ranked_successes()
+                if done:
+                    break
+
+                # keep enough candidates in flight to cover what's still needed plus the hedge
+                needed = self.total_links_to_return - len([v for v in resolved.values() if v is not None]) + hedge
+                while len(in_flight) < needed and next_index < len(self.ordered_snippets):
+                    future = pool.submit(self.__fetch, self.ordered_snippets[next_index], next_index, started)
+                    in_flight[future] = next_index
+                    next_index += 1
+
+                if not in_flight:
+                    continue
+
+                completed, _ = wait(
+                    list(in_flight.keys()),
+                    timeout=max(0.0, min(deadline(rank) for rank in in_flight.values()) - time.time()),
+                    return_when=FIRST_COMPLETED,
+                )
+
+                for future in completed:
+                    rank = in_flight.pop(future)
+                    try:
+                        parser_content, streamed = future.result()
+                        for obj in streamed:
+                            write_client_stream(obj)
+                        resolved[rank] = parser_content if parser_content else None
+                    except Exception as e:
+                        logging.error(f'Searcher.results() fetching {self.ordered_snippets[rank].get("link")} failed: {e}')
+                        resolved[rank] = None
+
+                for future, rank in list(in_flight.items()):
+                    if time.time() >= deadline(rank):
+                        logging.debug(f'Searcher.results() fetching {self.ordered_snippets[rank].get("link")} timed out after {timeout}s')  # noqa E501
+                        future.cancel()
+                        in_flight.pop(future)
+                        resolved[rank] = None
+        finally:
+            # stragglers keep their worker thread until they finish, but nothing waits on them
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        successes, _ = ranked_successes()
+        # the next call to results() carries on after the last result returned
+        self.index = successes[-1] + 1 if len(successes) >= self.total_links_to_return else next_index
+        return [cast(Content, resolved[i]) for i in successes]
 
     def result(self) -> Content:
         return Content('\n\n\n'.join([str(result) for result in self.results()]))
@@ -0,0 +1,203 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from llmvm.common.logging_helpers import setup_logging
+
+logging = setup_logging()
+
+
+class EmbeddingCache():
+    """
+    On disk cache of embeddings keyed by (embedding_model, text hash).
+
+    Each embedding model gets its own directory holding an append-only float32 matrix
+    (vectors.f32, memory mapped for reads) and a parallel id index (keys.bin, one 16 byte
+    blake2b digest per row). Rows are written vectors first, keys second, so a torn write
+    leaves an unindexed tail in vectors.f32 that is ignored on load.
+
+    The directory is shared by every server worker process. Appends and resets hold an
+    exclusive flock on the directory's lock file and start from the row count on disk, and
+    meta.json carries a generation that a reset bumps, so each process picks up the rows the
+    others appended (or drops its rows after another process reset) before it reads.
+    """
+    KEY_SIZE = 16
+
+    def __init__(
+        self,
+        cache_directory: str,
+        embedding_model: str,
+        max_rows: int = 200000,
+    ):
+        self.directory = os.path.join(cache_directory, re.sub(r'[^A-Za-z0-9_.-]', '_', embedding_model))
+        self.max_rows = max_rows
+        self.vectors_file = os.path.join(self.directory, 'vectors.f32')
+        self.keys_file = os.path.join(self.directory, 'keys.bin')
+        self.meta_file = os.path.join(self.directory, 'meta.json')
+        self.lock = threading.Lock()
+
+        self.dimension: int = 0
+        self.generation: int = 0
+        # rows of keys.bin read so far, index can be smaller if two processes appended the same key
+        self.rows: int = 0
+        self.index: Dict[bytes, int] = {}
+        self.matrix: Optional[np.ndarray] = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock_file = open(os.path.join(self.directory, 'lock'), 'a+')
+        with self.__file_lock(fcntl.LOCK_SH):
+            self.__refresh()
+
+    @staticmethod
+    def key(text: str, namespace: str) -> bytes:
+        return hashlib.blake2b(f'{namespace}\0{text}'.encode('utf-8', errors='replace'), digest_size=EmbeddingCache.KEY_SIZE).digest()  # noqa E501
+
+    @contextlib.contextmanager
+    def __file_lock(self, operation: int) -> Iterator[None]:
+        # callers hold self.lock too: flock doesn't exclude threads sharing this file description
+        fcntl.flock(self.lock_file.fileno(), operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+
+    def __clear(self):
+        self.index = {}
+        self.rows = 0
+        self.matrix = None
+
+    def __refresh(self):
+        # brings this process up to date with the files, under the file lock
+        if not os.path.exists(self.meta_file):
+            self.dimension, self.generation = 0, 0
+            self.__clear()
+            return
+
+        with open(self.meta_file, 'r') as f:
+            meta = json.load(f)
+        dimension, generation = int(meta['dimension']), int(meta.get('generation', 0))
+        if (dimension, generation) != (self.dimension, self.generation):
+            self.dimension, self.generation = dimension, generation
+            self.__clear()
+
+        rows = os.path.getsize(self.keys_file) // EmbeddingCache.KEY_SIZE if os.path.exists(self.keys_file) else 0
+        if os.path.exists(self.vectors_file):
+            rows = min(rows, os.path.getsize(self.vectors_file) // (4 * self.dimension))
+        else:
+            rows = 0
+
+        if rows < self.rows:
+            self.__clear()
+        if rows > self.rows:
+            with open(self.keys_file, 'rb') as f:
+                f.seek(self.rows * EmbeddingCache.KEY_SIZE)
+                keys = f.read((rows - self.rows) * EmbeddingCache.KEY_SIZE)
+            for i in range(rows - self.rows):
+                self.index.setdefault(keys[i * EmbeddingCache.KEY_SIZE:(i + 1) * EmbeddingCache.KEY_SIZE], self.rows + i)
+            self.rows = rows
+            self.__map(rows)
+
+    def __map(self, rows: int):
+        if rows == 0:
+            self.matrix = None
+            return
+        self.matrix = np.memmap(self.vectors_file, dtype=np.float32, mode='r', shape=(rows, self.dimension))
+
+    def __reset(self, dimension: int):
+        # under the exclusive file lock. processes still mapping the old files keep reading them
+        # until their next refresh sees the new generation
+        for file in [self.vectors_file, self.keys_file]:
+            if os.path.exists(file):
+                os.remove(file)
+
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'dimension': dimension, 'generation': self.generation + 1}, f)
+        os.replace(temp_path, self.meta_file)
+
+        self.dimension, self.generation = dimension, self.generation + 1
+        self.__clear()
+
+    def __missing(self, keys: List[bytes], texts: List[str]) -> Dict[bytes, str]:
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in self.index and key not in missing:
+                missing[key] = text
+        return missing
+
+    def __append(self, keys: List[bytes], vectors: np.ndarray):
+        # under the exclusive file lock, just after a refresh, so self.rows is the row count on
+        # disk. anything in vectors.f32 past it is the torn tail of a writer that died before
+        # writing its keys, and is overwritten
+        with open(self.vectors_file, 'r+b' if os.path.exists(self.vectors_file) else 'wb') as f:
+            f.seek(self.rows * 4 * self.dimension)
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            f.truncate()
+        with open(self.keys_file, 'ab') as f:
+            f.write(b''.join(keys))
+
+        for i, key in enumerate(keys):
+            self.index.setdefault(key, self.rows + i)
+        self.rows += len(keys)
+        self.__map(self.rows)
+
+    def embed(
+        self,
+        texts: List[str],
+        embed_fn: Callable[[List[str]], List[List[float]]],
+        namespace: str = 'document',
+    ) -> np.ndarray:
+        """
+        Returns a (len(texts), dimension) float32 matrix, calling embed_fn only for texts
+        that have not been embedded before.
+        """
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        keys = [EmbeddingCache.key(text, namespace) for text in texts]
+
+        with self.lock:
+            with self.__file_lock(fcntl.LOCK_SH):
+                self.__refresh()
+                missing = self.__missing(keys, texts)
+                if not missing:
+                    logging.debug(f'EmbeddingCache.embed() {len(set(keys))} hits, 0 misses')
+                    return np.asarray(self.matrix[[self.index[key] for key in keys]])  # type: ignore
+
+            # embed without the file lock, so other workers aren't held up
+            embedded = dict(zip(missing.keys(), np.asarray(embed_fn(list(missing.values())), dtype=np.float32)))
+            dimension = len(next(iter(embedded.values())))
+
+            with self.__file_lock(fcntl.LOCK_EX):
+                # other workers may have appended or reset while we embedded
+                self.__refresh()
+                if self.dimension != dimension:
+                    if self.dimension:
+                        logging.debug(f'EmbeddingCache: dimension changed from {self.dimension} to {dimension}, resetting {self.directory}')  # noqa E501
+                    self.__reset(dimension)
+
+                missing = self.__missing(keys, texts)
+                # a reset drops this call's hits too, so do it before working out what to append
+                if self.rows + len(missing) > self.max_rows:
+                    logging.debug(f'EmbeddingCache: {self.directory} reached {self.max_rows} rows, resetting')
+                    self.__reset(self.dimension)
+                    missing = self.__missing(keys, texts)
+
+                # hits a reset dropped, or embedded by an older model, are embedded again
+                stale = {key: text for key, text in missing.items() if key not in embedded}
+                if stale:
+                    embedded.update(zip(stale.keys(), np.asarray(embed_fn(list(stale.values())), dtype=np.float32)))
+
+                if missing:
+                    self.__append(list(missing.keys()), np.stack([embedded[key] for key in missing]))
+
+                logging.debug(f'EmbeddingCache.embed() {len(set(keys)) - len(missing)} hits, {len(missing)} misses')
+                return np.asarray(self.matrix[[self.index[key] for key in keys]])  # type: ignore
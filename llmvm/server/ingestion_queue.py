@@ -0,0 +1,150 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from langchain.docstore.document import Document
+
+from llmvm.common.logging_helpers import setup_logging
+from llmvm.server.vector_store import VectorStore
+
+logging = setup_logging()
+
+
+class IngestionQueue():
+    """
+    Moves ingestion off the server event loop. Jobs (parsing a pdf, converting html, ...) run
+    on a worker pool and produce split Documents; a single writer thread drains those in
+    batches of up to batch_size, embeds each batch in one call and appends it to the index.
+    The index is only saved to disk once checkpoint_documents have been added or
+    checkpoint_seconds have passed since the last save, and when the queue goes idle.
+    """
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        workers: int = 4,
+        batch_size: int = 256,
+        checkpoint_documents: int = 2000,
+        checkpoint_seconds: float = 30.0,
+    ):
+        self.vector_store = vector_store
+        self.batch_size = batch_size
+        self.checkpoint_documents = checkpoint_documents
+        self.checkpoint_seconds = checkpoint_seconds
+
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='llmvm-ingest')
+        self.documents: queue.Queue[Document] = queue.Queue()
+        self.lock = threading.Lock()
+
+        self.jobs_pending = 0
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self.documents_ingested = 0
+        self.documents_unsaved = 0
+        self.started = time.time()
+        self.last_checkpoint = time.time()
+        self.last_error = ''
+
+        self.stopped = threading.Event()
+        self.writer = threading.Thread(target=self.__write_loop, name='llmvm-ingest-writer', daemon=True)
+        self.writer.start()
+
+    def submit(self, name: str, job: Callable[[], None]) -> None:
+        """
+        Run job on the worker pool. The job is expected to call put_documents().
+        """
+        with self.lock:
+            self.jobs_pending += 1
+
+        def run():
+            try:
+                job()
+                with self.lock:
+                    self.jobs_completed += 1
+            except Exception as ex:
+                logging.error(f'IngestionQueue: job {name} failed: {ex}')
+                with self.lock:
+                    self.jobs_failed += 1
+                    self.last_error = f'{name}: {ex}'
+            finally:
+                with self.lock:
+                    self.jobs_pending -= 1
+
+        self.pool.submit(run)
+
+    def put_documents(self, documents: List[Document]) -> None:
+        for document in documents:
+            self.documents.put(document)
+
+    def __write_loop(self):
+        while not self.stopped.is_set():
+            batch: List[Document] = []
+            try:
+                batch.append(self.documents.get(timeout=1.0))
+                while len(batch) < self.batch_size:
+                    batch.append(self.documents.get_nowait())
+            except queue.Empty:
+                pass
+
+            if batch:
+                try:
+                    self.vector_store.add_documents(batch, save=False)
+                    with self.lock:
+                        self.documents_ingested += len(batch)
+                        self.documents_unsaved += len(batch)
+                except Exception as ex:
+                    logging.error(f'IngestionQueue: failed to add {len(batch)} documents: {ex}')
+                    with self.lock:
+                        self.last_error = str(ex)
+
+            idle = self.documents.empty() and self.jobs_pending == 0
+            if self.documents_unsaved > 0 and (
+                idle
+                or self.documents_unsaved >= self.checkpoint_documents
+                or time.time() - self.last_checkpoint >= self.checkpoint_seconds
+            ):
+                self.checkpoint()
+
+    def checkpoint(self) -> None:
+        try:
+            self.vector_store.save()
+            logging.debug(f'IngestionQueue: checkpointed index with {self.documents_unsaved} new documents')
+            with self.lock:
+                self.documents_unsaved = 0
+                self.last_checkpoint = time.time()
+        except Exception as ex:
+            logging.error(f'IngestionQueue: checkpoint failed: {ex}')
+            with self.lock:
+                self.last_error = str(ex)
+
+    def status(self) -> Dict[str, Any]:
+        with self.lock:
+            elapsed = time.time() - self.started
+            return {
+                'jobs_pending': self.jobs_pending,
+                'jobs_completed': self.jobs_completed,
+                'jobs_failed': self.jobs_failed,
+                'documents_queued': self.documents.qsize(),
+                'documents_ingested': self.documents_ingested,
+                'documents_unsaved': self.documents_unsaved,
+                'documents_per_second': self.documents_ingested / elapsed if elapsed > 0 else 0.0,
+                'seconds_since_checkpoint': time.time() - self.last_checkpoint,
+                'last_error': self.last_error,
+            }
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True)
+        self.stopped.set()
+        self.writer.join()
+
+        # drain whatever the writer didn't get to
+        remaining: List[Document] = []
+        while not self.documents.empty():
+            remaining.append(self.documents.get_nowait())
+        for i in range(0, len(remaining), self.batch_size):
+            self.vector_store.add_documents(remaining[i:i + self.batch_size], save=False)
+            self.documents_unsaved += len(remaining[i:i + self.batch_size])
+
+        if self.documents_unsaved > 0:
+            self.checkpoint()
@@ -0,0 +1,259 @@
+import base64
+import functools
+import json
+import marshal
+import types
+from typing import Any, Dict, FrozenSet, Set, Tuple
+
+from llmvm.common.logging_helpers import setup_logging
+from llmvm.common.objects import AstNode, Content, Message, Statement
+
+logging = setup_logging()
+
+# CallWrapper and friends, which only make sense inside the runtime that created them
+RUNTIME_MODULE = 'llmvm.server.python_runtime'
+
+# values of these types can't change in place, so reading them never makes a name dirty
+IMMUTABLE_TYPES = {
+    str, int, float, bool, bytes, complex, type(None), frozenset, range,
+    types.MethodType, types.ModuleType, types.BuiltinFunctionType, types.BuiltinMethodType, type,
+}
+
+# sentinel for values that are dropped from the serialized locals
+_DROP = object()
+
+# type -> (kind, is the type from builtins or the runtime)
+_kinds: Dict[type, Tuple[str, bool]] = {}
+
+
+class TrackedLocals(dict):
+    """
+    The exec() scope for generated code. It remembers the locals as they were at the start of
+    the turn, the setup globals it was seeded with, and which mutable values the code read (and
+    so might have changed in place), so changes() can tell what needs serializing again.
+    Rebinding is found by identity against the start of the turn, which also catches 'global'
+    stores that bypass __setitem__.
+    """
+    __slots__ = ('baseline', 'inherited', 'touched')
+
+    def __init__(self, globals_dict: Dict[str, Any] = {}, locals_dict: Dict[str, Any] = {}):
+        super().__init__(globals_dict)
+        self.update(locals_dict)
+        if isinstance(locals_dict, TrackedLocals):
+            # a later code block in the same turn, keep measuring from the start of the turn
+            self.baseline = locals_dict.baseline
+            self.inherited = {**locals_dict.inherited, **globals_dict}
+            self.touched = set(locals_dict.touched)
+        else:
+            self.baseline = dict(locals_dict)
+            self.inherited = dict(globals_dict)
+            self.touched = set()
+
+    def __getitem__(self, key: Any) -> Any:
+        value = super().__getitem__(key)
+        if key not in self.touched:
+            if type(value) is types.FunctionType:
+                # functions from earlier turns close over their own globals dict, not this one,
+                # so anything they might mutate has to be assumed dirty
+                self.touched |= code_names(value.__code__)
+            elif type(value) not in IMMUTABLE_TYPES:
+                self.touched.add(key)
+        return value
+
+    def inherit(self, key: str, value: Any) -> None:
+        dict.__setitem__(self, key, value)
+        self.inherited[key] = value
+
+    def changes(self) -> Tuple[Set[str], Set[str]]:
+        """
+        Returns (changed, dropped): names whose serialized form may differ from the start of the
+        turn, and names that should no longer be stored.
+        """
+        changed = set()
+        for key, value in dict.items(self):
+            if not isinstance(key, str) or key.startswith('__'):
+                continue
+            if key in self.inherited and self.inherited[key] is value:
+                continue
+            if key in self.touched or key not in self.baseline or self.baseline[key] is not value:
+                changed.add(key)
+
+        dropped = {
+            key for key in self.baseline
+            if key not in self or (key in self.inherited and self.inherited[key] is dict.get(self, key))
+        }
+        return changed, dropped
+
+
+@functools.lru_cache(maxsize=1024)
+def code_names(code: types.CodeType) -> FrozenSet[str]:
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= code_names(const)
+    return frozenset(names)
+
+
+def __kind(value: Any) -> Tuple[str, bool]:
+    value_type = type(value)
+    if value_type in _kinds:
+        return _kinds[value_type]
+
+    if issubclass(value_type, types.FunctionType):
+        kind = 'function'
+    elif issubclass(value_type, dict):
+        kind = 'dict'
+    elif issubclass(value_type, list):
+        kind = 'list'
+    elif issubclass(value_type, (str, int, float, bool)):
+        kind = 'primitive'
+    elif issubclass(value_type, (Content, AstNode, Message, Statement)):
+        kind = 'node'
+    elif issubclass(value_type, (types.MethodType, types.ModuleType, types.BuiltinFunctionType, types.BuiltinMethodType, type)):
+        kind = 'callable'
+    elif value_type is type(None) or issubclass(value_type, tuple):
+        # depends on what's inside
+        kind = 'json'
+    else:
+        # json.dumps() only takes the types above
+        kind = 'opaque'
+
+    local = value_type.__module__ in ('builtins', RUNTIME_MODULE)
+    _kinds[value_type] = (kind, local)
+    return kind, local
+
+
+def __json_serializable(value: Any) -> bool:
+    try:
+        json.dumps(value)
+        return True
+    except Exception:
+        return False
+
+
+def __serialize_function(value: types.FunctionType) -> Dict[str, Any]:
+    return {
+        'type': 'function',
+        'name': value.__name__,
+        'code': base64.b64encode(marshal.dumps(value.__code__)).decode('ascii'),
+        'defaults': value.__defaults__,
+        'closure': value.__closure__
+    }
+
+
+def __serialize_value(value: Any) -> Any:
+    kind, _ = __kind(value)
+    if kind == 'function':
+        return __serialize_function(value) if value.__code__.co_filename == '<ast>' else _DROP
+    elif kind == 'dict':
+        return serialize_locals(value)
+    elif kind == 'list':
+        return [__serialize_item(v) for v in value]
+    elif kind in ('primitive', 'node'):
+        return value
+    elif kind == 'json' and __json_serializable(value):
+        return value
+    return _DROP
+
+
+def __serialize_item(item: Any) -> Any:
+    kind, _ = __kind(item)
+    if kind == 'function':
+        return __serialize_function(item) if item.__code__.co_filename == '<ast>' else None
+    elif kind in ('primitive', 'node'):
+        return item
+    elif kind in ('dict', 'list', 'json') and __json_serializable(item):
+        return item
+    # functions and tool instances can't be json serialized, they only live in memory
+    return None
+
+
+def unserializable(value: Any) -> bool:
+    """
+    True for values that have to be kept in memory between turns: instances of non builtin
+    types that json can't serialize, like DataFrames or downloaded Content.
+    """
+    kind, local = __kind(value)
+    if local or kind in ('function', 'callable', 'primitive'):
+        return False
+    elif kind in ('opaque', 'node'):
+        return True
+    return not __json_serializable(value)
+
+
+def serialize_locals(locals_dict: Dict[str, Any]) -> Dict[str, Any]:
+    result = {}
+    for key, value in locals_dict.items():
+        if isinstance(key, str) and key.startswith('__'):
+            continue
+        serialized = __serialize_value(value)
+        if serialized is not _DROP:
+            result[key] = serialized
+    return result
+
+
+def update_locals(
+    serialized: Dict[str, Any],
+    in_memory: Dict[str, Any],
+    locals_dict: Dict[str, Any],
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Returns the serialized and in memory locals for a thread after a turn, re-serializing only
+    the names that changed if locals_dict is the TrackedLocals the runtime executed in.
+    """
+    if isinstance(locals_dict, TrackedLocals):
+        changed, dropped = locals_dict.changes()
+        serialized = dict(serialized)
+        in_memory = dict(in_memory)
+    else:
+        changed = {key for key in locals_dict if not (isinstance(key, str) and key.startswith('__'))}
+        dropped = set()
+        serialized = {}
+        in_memory = {}
+
+    for key in dropped:
+        serialized.pop(key, None)
+        in_memory.pop(key, None)
+
+    for key in changed:
+        value = dict.__getitem__(locals_dict, key)
+        serialized_value = __serialize_value(value)
+        if serialized_value is _DROP:
+            serialized.pop(key, None)
+        else:
+            serialized[key] = serialized_value
+
+        if unserializable(value):
+            in_memory[key] = value
+        else:
+            in_memory.pop(key, None)
+
+    logging.debug(f'update_locals: {len(changed)} changed, {len(dropped)} dropped of {len(locals_dict)} names')
+    return serialized, in_memory
+
+
+def deserialize_locals(serialized_dict: Dict[str, Any]) -> Dict[str, Any]:
+    result = {}
+    for key, value in serialized_dict.items():
+        if isinstance(value, dict) and value.get('type') == 'function':
+            # Deserialize the function's code object
+            code_bytes = base64.b64decode(value['code'])
+            code = marshal.loads(code_bytes)
+            # Recreate the function
+            func = types.FunctionType(code, result, value['name'], value['defaults'], value['closure'])
+            result[key] = func
+        elif isinstance(value, dict):
+            result[key] = deserialize_locals(value)
+        elif isinstance(value, list):
+            result[key] = [__deserialize_item(v) for v in value]
+        else:
+            result[key] = value
+    return result
+
+
+def __deserialize_item(item: Any) -> Any:
+    if isinstance(item, dict) and item.get('type') == 'function':
+        code_bytes = base64.b64decode(item['code'])
+        code = marshal.loads(code_bytes)
+        return types.FunctionType(code, globals(), item['name'], item['defaults'], item['closure'])
+    return item
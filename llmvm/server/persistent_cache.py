@@ -1,8 +1,18 @@
+import glob
 import os
-from typing import Dict, Generic, Iterable, List, TypeVar
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Iterable, List, Optional, TypeVar
 
 import dill
 
+from llmvm.common.container import Container
+from llmvm.common.logging_helpers import setup_logging
+
+logging = setup_logging()
+
 K = TypeVar('K')
 V = TypeVar('V')
 
@@ -29,14 +39,73 @@ class MemoryCache(Generic[K, V]):
         return self.cache.keys()
 
 
-class PersistentCache:
-    def __init__(self, cache_directory: str):
-        if not os.path.exists(cache_directory):
-            os.makedirs(cache_directory)
+class LRUCache(Generic[K, V]):
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        self.cache: OrderedDict[K, V] = OrderedDict()
 
-        if not os.path.exists(cache_directory):
-            raise Exception(f'Cache directory {cache_directory} does not exist')
+    def get(self, key: K) -> V | None:
+        if key not in self.cache:
+            return None
+        self.cache.move_to_end(key)
+        return self.cache[key]
+
+    def set(self, key: K, value: V) -> None:
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def delete(self, key: K) -> None:
+        self.cache.pop(key, None)
+
+    def has_key(self, key: K) -> bool:
+        return key in self.cache
+
+    def keys(self) -> Iterable[K]:
+        return self.cache.keys()
+
+
+def next_key(key: int, stride: int = 1, offset: int = 0) -> int:
+    # the smallest id >= key that belongs to the worker owning ids where id % stride == offset
+    return key + (offset - key) % stride
 
+
+class ThreadStore(ABC):
+    @abstractmethod
+    def get(self, key: int) -> Any:
+        pass
+
+    @abstractmethod
+    def set(self, key: int, value: Any) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, key: int) -> None:
+        pass
+
+    @abstractmethod
+    def has_key(self, key: int) -> bool:
+        pass
+
+    @abstractmethod
+    def keys(self) -> List[int]:
+        pass
+
+    @abstractmethod
+    def gen_key(self, stride: int = 1, offset: int = 0) -> int:
+        pass
+
+    @abstractmethod
+    def evict(self, key: int) -> None:
+        pass
+
+
+class FileThreadStore(ThreadStore):
+    """
+    One dill file per thread, {id}.cache, in the cache directory.
+    """
+    def __init__(self, cache_directory: str):
         self.cache_directory = cache_directory
         self.cache = {}
 
@@ -66,7 +135,7 @@ class PersistentCache:
             return value
 
     def delete(self, key):
-        del self.cache[self._serialize_key(key)]
+        self.cache.pop(self._serialize_key(key), None)
         os.remove(self.cache_directory + f'/{key}.cache')
 
     def has_key(self, key):
@@ -76,6 +145,182 @@ class PersistentCache:
         result = [int(f.split('.')[0]) for f in os.listdir(self.cache_directory) if f.endswith('.cache') and f[0].isdigit()]
         return list(sorted(result))
 
-    def gen_key(self):
+    def gen_key(self, stride: int = 1, offset: int = 0):
         keys = self.keys()
-        return keys[-1] + 1 if keys else 1
+        return next_key(keys[-1] + 1 if keys else 1, stride, offset)
+
+    def evict(self, key: int):
+        self.cache.pop(self._serialize_key(key), None)
+
+
+class SqliteThreadStore(ThreadStore):
+    """
+    Single file sqlite store for threads. The primary key index serves keys() and has_key()
+    without touching the values, ids are handed out from a persisted counter so they are
+    never reused, and at most max_resident threads are kept deserialized in memory.
+    """
+    def __init__(
+        self,
+        cache_directory: str,
+        database_name: str = 'threads.db',
+        max_resident: int = 128,
+    ):
+        self.cache_directory = cache_directory
+        self.database_file = os.path.join(cache_directory, database_name)
+        self.cache: LRUCache[int, Any] = LRUCache(max_size=max_resident)
+        self.lock = threading.RLock()
+
+        self.connection = sqlite3.connect(self.database_file, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS threads (id INTEGER PRIMARY KEY, value BLOB NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self.connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('next_id', 1)")
+        self.__import_file_store()
+
+    def __import_file_store(self):
+        # one-off migration of the {id}.cache files written by FileThreadStore
+        if self.connection.execute('SELECT 1 FROM threads LIMIT 1').fetchone():
+            return
+
+        files = glob.glob(os.path.join(self.cache_directory, '*.cache'))
+        imported = 0
+        for file in files:
+            name = os.path.basename(file).split('.')[0]
+            if not name.isdigit():
+                continue
+            try:
+                with open(file, 'rb') as f:
+                    self.__write(int(name), f.read())
+                    imported += 1
+            except Exception as ex:
+                logging.debug(f'SqliteThreadStore: unable to import {file}: {ex}')
+        if imported:
+            logging.debug(f'SqliteThreadStore: imported {imported} threads from {self.cache_directory}')
+
+    def __write(self, key: int, blob: bytes):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                self.connection.execute('INSERT OR REPLACE INTO threads (id, value) VALUES (?, ?)', (key, blob))
+                self.connection.execute("UPDATE meta SET value = MAX(value, ?) WHERE key = 'next_id'", (key + 1,))
+                self.connection.execute('COMMIT')
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+
+    def set(self, key: int, value):
+        with self.lock:
+            self.__write(key, dill.dumps(value))
+            self.cache.set(key, value)
+
+    def get(self, key: int):
+        with self.lock:
+            cache_hit = self.cache.get(key)
+            if cache_hit is not None:
+                return cache_hit
+
+            row = self.connection.execute('SELECT value FROM threads WHERE id = ?', (key,)).fetchone()
+            if not row:
+                raise KeyError(f'Thread {key} not found in {self.database_file}')
+
+            value = dill.loads(row[0])
+            self.cache.set(key, value)
+            return value
+
+    def delete(self, key: int):
+        with self.lock:
+            self.cache.delete(key)
+            self.connection.execute('DELETE FROM threads WHERE id = ?', (key,))
+
+    def has_key(self, key: int) -> bool:
+        with self.lock:
+            if self.cache.has_key(key):
+                return True
+            return self.connection.execute('SELECT 1 FROM threads WHERE id = ?', (key,)).fetchone() is not None
+
+    def keys(self) -> List[int]:
+        with self.lock:
+            return [row[0] for row in self.connection.execute('SELECT id FROM threads ORDER BY id')]
+
+    def gen_key(self, stride: int = 1, offset: int = 0) -> int:
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                key = next_key(self.connection.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()[0], stride, offset)
+                self.connection.execute("UPDATE meta SET value = ? WHERE key = 'next_id'", (key + 1,))
+                self.connection.execute('COMMIT')
+                return key
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+
+    def evict(self, key: int):
+        with self.lock:
+            self.cache.delete(key)
+
+
+class PersistentCache:
+    def __init__(
+        self,
+        cache_directory: str,
+        backend: Optional[str] = None,
+        max_resident: Optional[int] = None,
+        key_stride: int = 1,
+        key_offset: int = 0,
+    ):
+        """
+        In multi-worker mode each worker owns the thread ids where id % key_stride == key_offset:
+        it only hands out ids from that class, and never trusts its in-memory copy of a thread
+        owned by another worker.
+        """
+        if not os.path.exists(cache_directory):
+            os.makedirs(cache_directory)
+
+        if not os.path.exists(cache_directory):
+            raise Exception(f'Cache directory {cache_directory} does not exist')
+
+        backend = backend or Container.get_config_variable('cache_backend', 'LLMVM_CACHE_BACKEND', default='file')
+        max_resident = max_resident or int(
+            Container.get_config_variable('cache_max_resident_threads', 'LLMVM_CACHE_MAX_RESIDENT_THREADS', default=128)
+        )
+
+        self.cache_directory = cache_directory
+        self.key_stride = key_stride
+        self.key_offset = key_offset
+        self.store: ThreadStore
+
+        if backend == 'sqlite':
+            self.store = SqliteThreadStore(cache_directory, max_resident=max_resident)
+        elif backend == 'file':
+            self.store = FileThreadStore(cache_directory)
+        else:
+            raise ValueError(f'Unknown cache_backend: {backend}, expected file or sqlite')
+
+    @property
+    def cache(self):
+        return self.store.cache
+
+    def set(self, key: int, value):
+        self.store.set(key, value)
+
+    def owns(self, key: int) -> bool:
+        return key % self.key_stride == self.key_offset
+
+    def get(self, key: int):
+        if not self.owns(key):
+            # another worker writes this thread, re-read it from disk
+            self.store.evict(key)
+        return self.store.get(key)
+
+    def delete(self, key):
+        self.store.delete(key)
+
+    def has_key(self, key):
+        return self.store.has_key(key)
+
+    def keys(self) -> List[int]:
+        return self.store.keys()
+
+    def gen_key(self):
+        return self.store.gen_key(self.key_stride, self.key_offset)
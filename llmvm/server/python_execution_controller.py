@@ -19,12 +19,15 @@ from llmvm.common.helpers import Helpers, write_client_stream
 from llmvm.common.logging_helpers import (no_indent_debug, response_writer,
                                           role_debug, setup_logging)
 from llmvm.common.object_transformers import ObjectTransformers
+from llmvm.common.perf import TokenPerf
+from llmvm.common.runtime_bridge import run_coroutine, run_in_worker
 from llmvm.common.objects import (Answer, Assistant, AstNode, BrowserContent, Content,
                                   Controller, Executor, FileContent,
                                   FunctionCall, FunctionCallMeta, ImageContent,
                                   LLMCall, MarkdownContent, Message,
-                                  PandasMeta, PdfContent, Statement, System,
+                                  PandasMeta, PdfContent, RequestContext, Statement, System,
                                   TokenCompressionMethod, User, awaitable_none)
+from llmvm.server.query_classifier import QueryClassifier
 from llmvm.server.vector_search import VectorSearch
 
 logging = setup_logging()
@@ -38,12 +41,14 @@ class ExecutionController(Controller):
         vector_search: VectorSearch,
         edit_hook: Optional[Callable[[str], str]] = None,
         continuation_passing_style: bool = False,
-        exception_limit: int = 3
+        exception_limit: int = 3,
+        query_classifier: Optional[QueryClassifier] = None,
     ):
         super().__init__()
         self.executor = executor
         self.agents = agents
         self.vector_search = vector_search
+        self.query_classifier = query_classifier
         self.edit_hook = edit_hook
         self.continuation_passing_style = continuation_passing_style
         self.exception_limit = exception_limit
@@ -127,7 +132,7 @@ class ExecutionController(Controller):
             similarity_messages.append(User(Content(similarity_message)))
 
         total_similarity_tokens = sum(
-            [await self.executor.count_tokens(m.message.get_str(), model=llm_call.model) for m in similarity_messages]
+            await self.executor.count_tokens_batch([m.message.get_str() for m in similarity_messages], model=llm_call.model)
         )
         if total_similarity_tokens > llm_call.max_prompt_len:
             logging.error(f'__similarity() total_similarity_tokens: {total_similarity_tokens} is greater than max_prompt_len: {llm_call.max_prompt_len}, will perform map/reduce.')  # noqa E501
@@ -147,18 +152,48 @@ class ExecutionController(Controller):
         )
         return assistant_result
 
+    async def __llm_call_with_backoff(
+        self,
+        llm_call: LLMCall,
+        template: Dict[str, Any],
+        max_retries: int = 5,
+    ) -> Assistant:
+        delay = 1.0
+        for attempt in range(max_retries + 1):
+            try:
+                return await self.__llm_call_with_prompt(llm_call=llm_call.copy(), template=template)
+            except Exception as ex:
+                # 429 rate limited, 529 anthropic overloaded
+                rate_limited = (
+                    getattr(ex, 'status_code', None) in (429, 529)
+                    or 'RateLimit' in type(ex).__name__
+                )
+                if not rate_limited or attempt == max_retries:
+                    raise ex
+                sleep = delay + random.uniform(0, delay)
+                logging.debug(f'__llm_call_with_backoff() rate limited on {llm_call.prompt_name}, retrying in {sleep:.2f}s')
+                await asyncio.sleep(sleep)
+                delay = min(delay * 2, 60.0)
+        raise ValueError('unreachable')
+
     async def __map_reduce(
         self,
         query: str,
         original_query: str,
         llm_call: LLMCall,
     ) -> Assistant:
-        prompt_len = self.executor.count_tokens(llm_call.context_messages + [llm_call.user_message], model=llm_call.model)
+        prompt_len = await self.executor.count_tokens(llm_call.context_messages + [llm_call.user_message], model=llm_call.model)
         write_client_stream(f'Performing context window compression type: map/reduce with token length {prompt_len}.\n')
 
+        concurrency = max(1, int(Container.get_config_variable('map_reduce_concurrency', 'LLMVM_MAP_REDUCE_CONCURRENCY', default=4)))
+        fan_out = max(2, int(Container.get_config_variable('map_reduce_tree_fan_out', 'LLMVM_MAP_REDUCE_TREE_FAN_OUT', default=4)))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        # concurrent chunks would interleave their tokens on the client stream
+        stream_handler = llm_call.stream_handler if concurrency == 1 else awaitable_none
+
         # collapse the context messages into single message
         context_message = User(Content('\n\n'.join([m.message.get_str() for m in llm_call.context_messages])))
-        chunk_results = []
 
         # iterate over the data.
         map_reduce_prompt_tokens = await self.executor.count_tokens(
@@ -173,29 +208,70 @@ class ExecutionController(Controller):
             overlap=0
         )
 
-        for chunk in chunks:
-            chunk_assistant = await self.__llm_call_with_prompt(
-                llm_call=LLMCall(
-                    user_message=User(Content()),
-                    context_messages=[],
-                    executor=llm_call.executor,
-                    model=llm_call.model,
-                    temperature=llm_call.temperature,
-                    max_prompt_len=llm_call.max_prompt_len,
-                    completion_tokens_len=llm_call.completion_tokens_len,
-                    prompt_name='map_reduce_map.prompt',
-                    stream_handler=llm_call.stream_handler,
-                ),
-                template={
+        def prompt_call(prompt_name: str, handler: Callable) -> LLMCall:
+            return LLMCall(
+                user_message=User(Content()),
+                context_messages=[],
+                executor=llm_call.executor,
+                model=llm_call.model,
+                temperature=llm_call.temperature,
+                max_prompt_len=llm_call.max_prompt_len,
+                completion_tokens_len=llm_call.completion_tokens_len,
+                prompt_name=prompt_name,
+                stream_handler=handler,
+            )
+
+        async def run(name: str, prompt_name: str, template: Dict[str, Any]) -> str:
+            async with semaphore:
+                perf = TokenPerf(name, llm_call.executor.name(), llm_call.model or self.executor.get_default_model())
+                perf.start()
+                try:
+                    assistant = await self.__llm_call_with_backoff(prompt_call(prompt_name, stream_handler), template)
+                finally:
+                    perf.stop()
+                    perf.log()
+                return assistant.message.get_str()
+
+        write_client_stream(f'Mapping {len(chunks)} chunks with concurrency {concurrency}.\n')
+
+        # gather keeps the results in chunk order
+        chunk_results: List[str] = list(await asyncio.gather(*[
+            run(f'map_reduce_map_{i}', 'map_reduce_map.prompt', {
+                'original_query': original_query,
+                'query': query,
+                'data': chunk,
+            })
+            for i, chunk in enumerate(chunks)
+        ]))
+
+        def join(results: List[str]) -> str:
+            return '\n\n====\n\n' + '\n\n====\n\n'.join(results)
+
+        reduce_prompt_tokens = await self.executor.count_tokens(
+            [User(Content(Helpers.load_resources_prompt('map_reduce_reduce.prompt')['user_message']))],
+            model=llm_call.model,
+        )
+
+        # tree reduce: while the map results don't fit in a single reduce, reduce groups of fan_out
+        level = 0
+        while (
+            len(chunk_results) > 1
+            and reduce_prompt_tokens + await self.executor.count_tokens(join(chunk_results), model=llm_call.model) > llm_call.max_prompt_len  # noqa E501
+        ):
+            groups = [chunk_results[i:i + fan_out] for i in range(0, len(chunk_results), fan_out)]
+            write_client_stream(f'Map results exceed the context window, reducing {len(chunk_results)} results into {len(groups)}.\n')  # noqa E501
+            chunk_results = list(await asyncio.gather(*[
+                run(f'map_reduce_reduce_{level}_{i}', 'map_reduce_reduce.prompt', {
                     'original_query': original_query,
                     'query': query,
-                    'data': chunk,
-                },
-            )
-            chunk_results.append(chunk_assistant.message.get_str())
+                    'map_results': join(group),
+                })
+                for i, group in enumerate(groups)
+            ]))
+            level += 1
 
         # perform the reduce
-        map_results = '\n\n====\n\n' + '\n\n====\n\n'.join(chunk_results)
+        map_results = join(chunk_results)
 
         assistant_result = await self.__llm_call_with_prompt(
             llm_call=LLMCall(
@@ -276,14 +352,16 @@ class ExecutionController(Controller):
             model=llm_call.model
         ) + llm_call.completion_tokens_len
 
+        message_tokens = await self.executor.count_tokens_batch(
+            [m.message.get_str() for m in lifo_messages],
+            model=llm_call.model
+        )
+
         # reverse over the messages, last to first
         for i in range(len(lifo_messages) - 1, -1, -1):
-            if (
-                current_tokens + await self.executor.count_tokens(lifo_messages[i].message.get_str(), model=llm_call.model)
-                < llm_call.max_prompt_len
-            ):
+            if current_tokens + message_tokens[i] < llm_call.max_prompt_len:
                 prompt_context_messages.append(lifo_messages[i])
-                current_tokens += await self.executor.count_tokens(lifo_messages[i].message.get_str(), model=llm_call.model)
+                current_tokens += message_tokens[i]
             else:
                 break
 
@@ -436,6 +514,26 @@ class ExecutionController(Controller):
     def get_executor(self) -> Executor:
         return self.executor
 
+    def request_context(
+        self,
+        model: Optional[str] = None,
+        temperature: float = 0.0,
+        compression: TokenCompressionMethod = TokenCompressionMethod.AUTO,
+        cookies: Optional[List[Dict[str, Any]]] = None,
+        stream_handler: Callable[[AstNode], Awaitable[None]] = awaitable_none,
+    ) -> RequestContext:
+        model = model if model else self.executor.get_default_model()
+        return RequestContext(
+            executor=self.executor.name(),
+            model=model,
+            temperature=temperature,
+            compression=compression,
+            cookies=cookies or [],
+            output_token_len=self.executor.max_output_tokens(model=model),
+            max_prompt_len=self.executor.max_input_tokens(model=model),
+            stream_handler=stream_handler,
+        )
+
     async def aclassify_tool_or_direct(
         self,
         message: User,
@@ -443,6 +541,13 @@ class ExecutionController(Controller):
         model: Optional[str] = None,
     ) -> Dict[str, float]:
         model = model if model else self.executor.get_default_model()
+        query = message.message.get_str()
+
+        # confident local decisions skip the LLM round trip
+        if self.query_classifier:
+            local = await self.query_classifier.aclassify(query)
+            if local:
+                return local
 
         def parse_result(result: str) -> Dict[str, float]:
             if ',' in result:
@@ -474,7 +579,7 @@ class ExecutionController(Controller):
             prompt_name='query_understanding.prompt',
             template={
                 'functions': '\n'.join(function_list),
-                'user_input': message.message.get_str(),
+                'user_input': query,
             },
             user_token=self.get_executor().user_token(),
             assistant_token=self.get_executor().assistant_token(),
@@ -492,7 +597,13 @@ class ExecutionController(Controller):
         )
         if assistant.error or not parse_result(assistant.message.get_str()):
             return {'tool': 1.0}
-        return parse_result(assistant.message.get_str())
+
+        result = parse_result(assistant.message.get_str())
+        # only learn from answers that actually named a category, not the parse fallback
+        if self.query_classifier and re.match(r'^(Assistant:\s*)?"?(tool|direct)', assistant.message.get_str().strip()):
+            label, confidence = next(iter(result.items()))
+            await self.query_classifier.alearn(query, label, confidence)
+        return result
 
     async def aexecute_llm_call(
         self,
@@ -603,7 +714,8 @@ class ExecutionController(Controller):
     ) -> Assistant:
         llm_call.model = llm_call.model if llm_call.model else self.executor.get_default_model()
 
-        return asyncio.run(self.aexecute_llm_call(
+        # called from generated code on a runtime worker thread, the call itself runs on the request's loop
+        return run_coroutine(self.aexecute_llm_call(
             llm_call=llm_call,
             query=query,
             original_query=original_query,
@@ -701,9 +813,9 @@ class ExecutionController(Controller):
     ) -> List[Statement]:
 
         from llmvm.server.python_runtime import PythonRuntime
-        python_runtime = PythonRuntime(self, agents=self.agents, vector_search=self.vector_search)
-
-        model = model if model else self.executor.get_default_model()
+        context = self.request_context(model, temperature, compression, cookies, stream_handler)
+        model = context.model
+        python_runtime = PythonRuntime(self, agents=self.agents, vector_search=self.vector_search, context=context)
 
         def find_answers(d: Dict[Any, Any]) -> List[Statement]:
             current_results = []
@@ -755,8 +867,8 @@ class ExecutionController(Controller):
                         executor=self.executor,
                         model=model,
                         temperature=temperature,
-                        max_prompt_len=self.executor.max_input_tokens(),
-                        completion_tokens_len=self.executor.max_output_tokens(),
+                        max_prompt_len=context.max_prompt_len,
+                        completion_tokens_len=context.output_token_len,
                         prompt_name='',
                         stream_handler=stream_handler
                     ),
@@ -773,8 +885,8 @@ class ExecutionController(Controller):
                         executor=self.executor,
                         model=model,
                         temperature=temperature,
-                        max_prompt_len=self.executor.max_input_tokens(),
-                        completion_tokens_len=self.executor.max_output_tokens(),
+                        max_prompt_len=context.max_prompt_len,
+                        completion_tokens_len=context.output_token_len,
                         prompt_name='',
                         stream_handler=stream_handler
                     ),
@@ -815,37 +927,27 @@ class ExecutionController(Controller):
                     )
 
             if not self.continuation_passing_style:
-                old_model = python_runtime.controller.get_executor().get_default_model()
-
-                if model:
-                    python_runtime.controller.get_executor().set_default_model(model)
-
                 locals_dict = {'cookies': cookies} if cookies else {}
-                _ = python_runtime.run(
+                _ = await run_in_worker(
+                    python_runtime.run,
                     python_code=assistant_response_str,
                     original_query=messages[-1].message.get_str(),
                     messages=messages,
-                    locals_dict=locals_dict
+                    locals_dict=locals_dict,
+                    stream_handler=stream_handler,
                 )
                 results.extend(python_runtime.answers)
-
-                if model:
-                    python_runtime.controller.get_executor().set_default_model(old_model)
-
                 return results
             else:
-                old_model = python_runtime.controller.get_executor().get_default_model()
-
-                if model:
-                    python_runtime.controller.get_executor().set_default_model(model)
-
                 locals_dict = {'cookies': cookies} if cookies else {}
 
-                _ = python_runtime.run_continuation_passing(
+                _ = await run_in_worker(
+                    python_runtime.run_continuation_passing,
                     python_code=assistant_response_str,
                     original_query=messages[-1].message.get_str(),
                     messages=messages,
-                    locals_dict=locals_dict
+                    locals_dict=locals_dict,
+                    stream_handler=stream_handler,
                 )
                 results.extend(python_runtime.answers)
                 return results
@@ -858,8 +960,8 @@ class ExecutionController(Controller):
                     executor=self.executor,
                     model=model,
                     temperature=temperature,
-                    max_prompt_len=self.executor.max_input_tokens(),
-                    completion_tokens_len=self.executor.max_output_tokens(),
+                    max_prompt_len=context.max_prompt_len,
+                    completion_tokens_len=context.output_token_len,
                     prompt_name='',
                     stream_handler=stream_handler,
                 ),
@@ -889,15 +991,16 @@ class ExecutionController(Controller):
     ) -> Tuple[List[Statement], Dict[str, Any]]:
 
         from llmvm.server.python_runtime import PythonRuntime
+        context = self.request_context(model, temperature, compression, cookies, stream_handler)
+        model = context.model
         python_runtime = PythonRuntime(
             self,
             agents=agents,
             vector_search=self.vector_search,
             locals_dict=locals_dict,
+            context=context,
         )
 
-        model = model if model else self.executor.get_default_model()
-
         response: Assistant = Assistant(Content())
 
         # a single code block is supported as a special case which we execute immediately
@@ -957,8 +1060,6 @@ class ExecutionController(Controller):
         # bootstrap the continuation execution
         completed = False
         results: List[Statement] = []
-        old_model = python_runtime.controller.get_executor().get_default_model()
-        if model: python_runtime.controller.get_executor().set_default_model(model)
 
         # inject the python_continuation_execution.prompt prompt
         functions = [Helpers.get_function_description_flat(f) for f in agents]
@@ -998,8 +1099,8 @@ class ExecutionController(Controller):
                 executor=self.executor,
                 model=model,
                 temperature=temperature,
-                max_prompt_len=self.executor.max_input_tokens(),
-                completion_tokens_len=self.executor.max_output_tokens(),
+                max_prompt_len=context.max_prompt_len,
+                completion_tokens_len=context.output_token_len,
                 prompt_name='',
                 stop_tokens=['</code>', '</complete>'],
                 stream_handler=stream_handler
@@ -1090,11 +1191,13 @@ class ExecutionController(Controller):
                 try:
                     # todo: made this change for t2
                     python_runtime.answers = []
-                    locals_dict = python_runtime.run(
+                    locals_dict = await run_in_worker(
+                        python_runtime.run,
                         python_code=code_block,
                         original_query=messages[-1].message.get_str(),
                         messages=messages,
-                        locals_dict=locals_dict
+                        locals_dict=locals_dict,
+                        stream_handler=stream_handler,
                     )
                     # Python was executed without exceptions, reset the exception counter
                     # and add any answer() results to the results list
@@ -1180,6 +1283,5 @@ class ExecutionController(Controller):
                 completed = True
                 # results.extend(python_runtime.answers)
 
-        if model: python_runtime.controller.get_executor().set_default_model(old_model)
         dedupped = Helpers.remove_duplicates(results, lambda a: a.result())
         return list(reversed(dedupped)), locals_dict
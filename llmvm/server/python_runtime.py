@@ -19,8 +19,9 @@ from llmvm.common.logging_helpers import setup_logging
 from llmvm.common.object_transformers import ObjectTransformers
 from llmvm.common.objects import (Answer, Assistant, Content, DownloadParams, FileContent,
                                   FunctionCallMeta, LLMCall,
-                                  Message, PandasMeta,
+                                  Message, PandasMeta, RequestContext,
                                   User, coerce_to)
+from llmvm.server.locals_store import TrackedLocals
 from llmvm.server.python_execution_controller import ExecutionController
 from llmvm.server.tools.edgar import EdgarHelpers
 from llmvm.server.tools.market import MarketHelpers
@@ -38,11 +39,14 @@ class PythonRuntime:
         agents: List[Callable] = [],
         answer_error_correcting: bool = False,
         locals_dict = {},
-        globals_dict = {}
+        globals_dict = {},
+        context: Optional[RequestContext] = None,
     ):
         self.original_query = ''
         self.original_code = ''
         self.controller: ExecutionController = controller
+        # model, token budgets, cookies etc for the request this runtime is serving
+        self.context: RequestContext = context or controller.request_context()
         self.vector_search = vector_search
         self.agents = agents
         self.locals_dict = locals_dict
@@ -55,6 +59,10 @@ class PythonRuntime:
     def statement_to_message(self, statement: Any) -> List[Message]:
         return self.controller.statement_to_message(statement)
 
+    def cookies(self) -> List[Dict[str, Any]]:
+        # generated code can set its own cookies, otherwise use the request's
+        return self.locals_dict['cookies'] if 'cookies' in self.locals_dict else self.context.cookies
+
     def setup(self):
         class InstantiationWrapper:
             def __init__(self, wrapped_class, python_runtime: PythonRuntime):
@@ -75,9 +83,10 @@ class PythonRuntime:
                         params_call[name] = self.python_runtime.controller
                     elif param.annotation and param.annotation is VectorSearch:
                         params_call[name] = self.python_runtime.vector_search
+                    elif param.annotation and param.annotation in (RequestContext, Optional[RequestContext]):
+                        params_call[name] = self.python_runtime.context
                     elif name == 'cookies':
-                        cookies = self.python_runtime.locals_dict['cookies'] if 'cookies' in self.python_runtime.locals_dict else []
-                        params_call[name] = cookies
+                        params_call[name] = self.python_runtime.cookies()
 
                 merged_kwargs = {**params_call, **kwargs}
                 instance = self.wrapped_class(*args, **merged_kwargs)
@@ -271,10 +280,10 @@ class PythonRuntime:
                     ),
                     context_messages=self.statement_to_message(expr),  # type: ignore
                     executor=self.controller.get_executor(),
-                    model=self.controller.get_executor().get_default_model(),
+                    model=self.context.model,
                     temperature=0.0,
-                    max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                    completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                    max_prompt_len=self.context.max_prompt_len,
+                    completion_tokens_len=self.context.output_token_len,
                     prompt_name='pandas_bind.prompt',
                 ),
                 query=self.original_query,
@@ -347,6 +356,7 @@ class PythonRuntime:
             original_query=self.original_query,
             controller=self.controller,
             python_runtime=self,
+            context=self.context,
         )
         bindable.bind(expr, func)
         return bindable
@@ -356,9 +366,7 @@ class PythonRuntime:
 
         from llmvm.server.base_library.content_downloader import \
             WebAndContentDriver
-        cookies = self.locals_dict['cookies'] if 'cookies' in self.locals_dict else []
-
-        downloader = WebAndContentDriver(cookies=cookies)
+        downloader = WebAndContentDriver(cookies=self.cookies())
         download_params: DownloadParams = {
             'url': expr,
             'goal': self.original_query,
@@ -376,6 +384,7 @@ class PythonRuntime:
         searcher = Searcher(
             expr=expr,
             controller=self.controller,
+            context=self.context,
             original_code=self.original_code,
             original_query=self.original_query,
             vector_search=self.vector_search,
@@ -403,10 +412,10 @@ class PythonRuntime:
                 ),
                 context_messages=[],
                 executor=self.controller.get_executor(),
-                model=self.controller.get_executor().get_default_model(),
+                model=self.context.model,
                 temperature=0.0,
-                max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                max_prompt_len=self.context.max_prompt_len,
+                completion_tokens_len=self.context.output_token_len,
                 prompt_name='coerce.prompt',
             ),
             query='',
@@ -427,7 +436,7 @@ class PythonRuntime:
         # called with llm_call([var], ...), so we need to flatten
         expr_list = Helpers.flatten(expr_list)
 
-        write_client_stream(Content(f'Calling {self.controller.get_executor().get_default_model()} with instruction: "{llm_instruction}"\n'))
+        write_client_stream(Content(f'Calling {self.context.model} with instruction: "{llm_instruction}"\n'))
 
         assistant = self.controller.execute_llm_call(
             llm_call=LLMCall(
@@ -442,10 +451,10 @@ class PythonRuntime:
                 ),
                 context_messages=self.statement_to_message(expr_list),
                 executor=self.controller.get_executor(),
-                model=self.controller.get_executor().get_default_model(),
+                model=self.context.model,
                 temperature=0.0,
-                max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                max_prompt_len=self.context.max_prompt_len,
+                completion_tokens_len=self.context.output_token_len,
                 prompt_name='llm_call.prompt',
             ),
             query=llm_instruction,
@@ -473,10 +482,10 @@ class PythonRuntime:
                 ),
                 context_messages=[],
                 executor=self.controller.get_executor(),
-                model=self.controller.get_executor().get_default_model(),
+                model=self.context.model,
                 temperature=0.0,
-                max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                max_prompt_len=self.context.max_prompt_len,
+                completion_tokens_len=self.context.output_token_len,
                 prompt_name='llm_list_bind.prompt',
             ),
             query=llm_instruction,
@@ -545,10 +554,10 @@ class PythonRuntime:
                 ),
                 context_messages=[],
                 executor=self.controller.get_executor(),
-                model=self.controller.get_executor().get_default_model(),
+                model=self.context.model,
                 temperature=0.0,
-                max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                max_prompt_len=self.context.max_prompt_len,
+                completion_tokens_len=self.context.output_token_len,
                 prompt_name='answer_error_correction.prompt',
             ),
             query=self.original_query,
@@ -572,9 +581,9 @@ class PythonRuntime:
                 ),
                 context_messages=[],  # type: ignore
                 executor=self.controller.get_executor(),
-                model=self.controller.get_executor().get_default_model(),
+                model=self.context.model,
                 temperature=0.0,
-                max_prompt_len=self.controller.get_executor().max_input_tokens(),
+                max_prompt_len=self.context.max_prompt_len,
                 completion_tokens_len=512,
                 prompt_name='answer_primitive.prompt',
             ),
@@ -611,10 +620,10 @@ class PythonRuntime:
                 ),
                 context_messages=context_messages,
                 executor=self.controller.get_executor(),
-                model=self.controller.get_executor().get_default_model(),
+                model=self.context.model,
                 temperature=0.0,
-                max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                max_prompt_len=self.context.max_prompt_len,
+                completion_tokens_len=self.context.output_token_len,
                 prompt_name='answer.prompt',
             ),
             query=self.original_query,
@@ -718,10 +727,10 @@ class PythonRuntime:
                 ),
                 context_messages=self.statement_to_message(expr),  # type: ignore
                 executor=self.controller.get_executor(),
-                model=self.controller.get_executor().get_default_model(),
+                model=self.context.model,
                 temperature=0.0,
-                max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                max_prompt_len=self.context.max_prompt_len,
+                completion_tokens_len=self.context.output_token_len,
                 prompt_name='answer_nocontext.prompt',
             ),
             query=self.original_query,
@@ -765,10 +774,10 @@ class PythonRuntime:
                     ),
                     context_messages=self.messages_list + self.statement_to_message(expr) + [answer_assistant],
                     executor=self.controller.get_executor(),
-                    model=self.controller.get_executor().get_default_model(),
+                    model=self.context.model,
                     temperature=0.0,
-                    max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                    completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                    max_prompt_len=self.context.max_prompt_len,
+                    completion_tokens_len=self.context.output_token_len,
                     prompt_name='answer_regen_code_or_rewrite.prompt',
                 ),
                 query=self.original_query,
@@ -792,6 +801,7 @@ class PythonRuntime:
                             agents=self.agents,
                             vector_search=self.vector_search,
                             answer_error_correcting=True,
+                            context=self.context,
                         )
                         runtime.run(block, self.original_query, locals_dict=locals_dict)
                         # we will have a new answer on the runtime.answers list
@@ -911,10 +921,10 @@ class PythonRuntime:
                 ),
                 context_messages=[],
                 executor=self.controller.get_executor(),
-                model=self.controller.get_executor().get_default_model(),
+                model=self.context.model,
                 temperature=0.0,
-                max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                max_prompt_len=self.context.max_prompt_len,
+                completion_tokens_len=self.context.output_token_len,
                 prompt_name='python_error_correction.prompt',
             ),
             query=self.original_query,
@@ -972,15 +982,14 @@ class PythonRuntime:
             return f'An exception occurred while parsing or executing the following Python code in the <ast> module:\n\n{python_code_with_line_numbers}\n\nThe exception was: {extract_relevant_traceback(tb_string)}\n'
 
         # massive hack to make locals globals so that generated functions can access that scope
-        class AutoGlobalDict(dict):
+        class AutoGlobalDict(TrackedLocals):
             def __init__(self, globals_dict = {}, locals_dict = {}):
-                super().__init__(globals_dict)
-                self.update(locals_dict)
+                super().__init__(globals_dict, locals_dict)
                 self.__dict__ = self
 
             def __getitem__(self, key):
                 if key not in self and key in globals():
-                    self[key] = globals()[key]
+                    self.inherit(key, globals()[key])
                 return super().__getitem__(key)
 
             def __setitem__(self, key: Any, value: Any) -> None:
@@ -1057,10 +1066,10 @@ class PythonRuntime:
                 user_message=User(Content(code_prompt)),
                 context_messages=[],
                 executor=self.controller.get_executor(),
-                model=self.controller.get_executor().get_default_model(),
+                model=self.context.model,
                 temperature=0.0,
-                max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                max_prompt_len=self.context.max_prompt_len,
+                completion_tokens_len=self.context.output_token_len,
                 prompt_name='',
             ),
             query=self.original_query,
@@ -1112,10 +1121,10 @@ class PythonRuntime:
                 ),
                 context_messages=[],
                 executor=self.controller.get_executor(),
-                model=self.controller.get_executor().get_default_model(),
+                model=self.context.model,
                 temperature=0.0,
-                max_prompt_len=self.controller.get_executor().max_input_tokens(),
-                completion_tokens_len=self.controller.get_executor().max_output_tokens(),
+                max_prompt_len=self.context.max_prompt_len,
+                completion_tokens_len=self.context.output_token_len,
                 prompt_name='python_tool_execution.prompt',
             ),
             query=self.original_query,
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from llmvm.common.logging_helpers import setup_logging
+
+logging = setup_logging()
+
+# the labelled examples from query_understanding.prompt, so there's something to compare against
+# before the LLM classifier has made any decisions
+SEED_EXAMPLES: List[Tuple[str, str]] = [
+    ('Get the page at the url https://www.slashdot.org and summarize it', 'tool'),
+    ('Search twitter for the latest sentiment on NVIDIA', 'tool'),
+    ('Get the name of the current CEO of AMD', 'tool'),
+    ('Who is the current head of state in Australia?', 'tool'),
+    ('What is the latest news on the stock market today?', 'tool'),
+    ('Download the pdf at https://arxiv.org/pdf/2106.09685 and list the authors', 'tool'),
+    ('What month has the largest rainfall in Hawaii?', 'direct'),
+    ('Generate a story based on two characters: Bill and Jane. The story should be magical and whimsical.', 'direct'),
+    ('Explain the difference between a list and a tuple in Python', 'direct'),
+    ('Rewrite this paragraph so it sounds more formal', 'direct'),
+    ('Write a haiku about autumn leaves', 'direct'),
+    ('Translate "good morning" into French', 'direct'),
+]
+
+
+class QueryClassifier():
+    """
+    Local tool/direct classifier that runs before the LLM query_understanding call. Queries are
+    embedded with the vector store's sentence transformer and labelled by a similarity weighted
+    vote of their nearest labelled examples. Only confident votes are returned, anything else
+    falls back to the LLM, whose decision is stored as a new example (examples.jsonl), so the
+    local path covers more queries the longer the server runs.
+    """
+    LABELS = ['tool', 'direct']
+
+    def __init__(
+        self,
+        embed: Callable[[List[str]], np.ndarray],
+        directory: Optional[str] = None,
+        threshold: float = 0.9,
+        min_similarity: float = 0.5,
+        neighbours: int = 7,
+        min_examples: int = 24,
+        max_examples: int = 5000,
+        learn_threshold: float = 0.8,
+        seeds: List[Tuple[str, str]] = SEED_EXAMPLES,
+    ):
+        self.embed = embed
+        self.directory = directory
+        self.threshold = threshold
+        self.min_similarity = min_similarity
+        self.neighbours = neighbours
+        self.min_examples = min_examples
+        self.max_examples = max_examples
+        self.learn_threshold = learn_threshold
+        self.lock = threading.Lock()
+
+        self.seeds = list(seeds)
+        self.examples: List[Tuple[str, str]] = []
+        self.seen: Set[str] = set()
+        self.matrix: Optional[np.ndarray] = None
+        self.labels: Optional[np.ndarray] = None
+        self.loaded = False
+
+        self.examples_file = os.path.join(directory, 'examples.jsonl') if directory else None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        # the embedding model truncates long input anyway
+        return re.sub(r'\s+', ' ', query).strip()[:2000]
+
+    def __read_examples(self) -> List[Tuple[str, str]]:
+        if not self.examples_file or not os.path.exists(self.examples_file):
+            return []
+
+        examples: List[Tuple[str, str]] = []
+        with open(self.examples_file, 'r') as f:
+            for line in f:
+                try:
+                    example = json.loads(line)
+                    if example['label'] in self.LABELS:
+                        examples.append((example['query'], example['label']))
+                except (ValueError, KeyError):
+                    # a torn append from another worker
+                    continue
+
+        if len(examples) > self.max_examples:
+            examples = examples[-self.max_examples:]
+            with open(self.examples_file, 'w') as f:
+                for query, label in examples:
+                    f.write(json.dumps({'query': query, 'label': label}) + '\n')
+        return examples
+
+    def load(self) -> None:
+        with self.lock:
+            if self.loaded:
+                return
+            self.examples = self.__read_examples()
+            # later decisions override earlier ones for the same query
+            deduped: Dict[str, str] = {}
+            for query, label in self.seeds + self.examples:
+                deduped[self.normalize(query)] = label
+            self.seen = set(deduped.keys())
+
+            queries = list(deduped.keys())
+            self.matrix = np.asarray(self.embed(queries), dtype=np.float32)
+            self.labels = np.array([self.LABELS.index(label) for label in deduped.values()], dtype=int)
+            self.loaded = True
+            logging.debug(f'QueryClassifier.load() {len(queries)} examples')
+
+    def size(self) -> int:
+        return 0 if self.labels is None else len(self.labels)
+
+    def predict(self, query: str) -> Tuple[str, float]:
+        """
+        Returns (label, confidence) from the nearest examples. Confidence is 0.0 when the
+        classifier hasn't seen enough examples or nothing similar to the query.
+        """
+        self.load()
+        query_vector = np.asarray(self.embed([self.normalize(query)]), dtype=np.float32)[0]
+
+        with self.lock:
+            matrix, labels = self.matrix, self.labels
+        if matrix is None or labels is None or len(labels) < self.min_examples:
+            return 'tool', 0.0
+
+        # embeddings are normalized, so the dot product is the cosine similarity
+        similarities = matrix @ query_vector
+        k = min(self.neighbours, len(similarities))
+        nearest = np.argpartition(-similarities, k - 1)[:k]
+        if similarities[nearest].max() < self.min_similarity:
+            return 'tool', 0.0
+
+        weights = np.clip(similarities[nearest], 0.0, None)
+        votes = np.bincount(labels[nearest], weights=weights, minlength=len(self.LABELS))
+        if votes.sum() <= 0.0:
+            return 'tool', 0.0
+
+        best = int(votes.argmax())
+        return self.LABELS[best], float(votes[best] / votes.sum())
+
+    def learn(self, query: str, label: str, confidence: float = 1.0) -> None:
+        """
+        Adds a decision made by the LLM classifier as an example.
+        """
+        query = self.normalize(query)
+        if label not in self.LABELS or confidence < self.learn_threshold or not query:
+            return
+
+        self.load()
+        vector = np.asarray(self.embed([query]), dtype=np.float32)
+        with self.lock:
+            if query in self.seen:
+                return
+            self.seen.add(query)
+            self.matrix = vector if self.matrix is None or len(self.matrix) == 0 else np.vstack([self.matrix, vector])
+            self.labels = np.append(self.labels if self.labels is not None else np.array([], dtype=int), self.LABELS.index(label))  # noqa E501
+
+            # drop the oldest learned examples, the seeds stay
+            if len(self.labels) > self.max_examples + len(self.seeds):
+                keep = np.r_[0:len(self.seeds), len(self.labels) - self.max_examples:len(self.labels)]
+                self.matrix = self.matrix[keep]
+                self.labels = self.labels[keep]
+
+            if self.examples_file:
+                with open(self.examples_file, 'a') as f:
+                    f.write(json.dumps({'query': query, 'label': label}) + '\n')
+
+    async def aclassify(self, query: str) -> Optional[Dict[str, float]]:
+        """
+        Returns {label: confidence} when the local decision clears the threshold, or None
+        when the caller should ask the LLM.
+        """
+        start = time.perf_counter()
+        try:
+            # the embedding model runs on cpu, keep it off the event loop
+            label, confidence = await asyncio.to_thread(self.predict, query)
+        except Exception as ex:
+            logging.debug(f'QueryClassifier.aclassify() failed with: {ex}')
+            return None
+
+        logging.debug(f'QueryClassifier.aclassify() {label} {confidence:.2f} in {(time.perf_counter() - start) * 1000:.1f}ms')  # noqa E501
+        if confidence >= self.threshold:
+            return {label: confidence}
+        return None
+
+    async def alearn(self, query: str, label: str, confidence: float = 1.0) -> None:
+        try:
+            await asyncio.to_thread(self.learn, query, label, confidence)
+        except Exception as ex:
+            logging.debug(f'QueryClassifier.alearn() failed with: {ex}')
@@ -0,0 +1,215 @@
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import click
+import httpx
+import rich
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+
+from llmvm.common.container import Container
+from llmvm.common.logging_helpers import setup_logging
+
+logging = setup_logging()
+
+# python -m llmvm.server.router --workers 8
+#
+# Runs N llmvm.server.server worker processes behind a small reverse proxy. Sessions keep
+# state in process (unserializable locals, the thread cache), so every request for thread id
+# is sent to worker id % N, and each worker only hands out new ids from its own class. Worker 0
+# owns the vector index: uploads and ingestion go there, the other workers search the saved
+# index read only. A worker that dies is restarted in the same slot; its threads carry on from
+# their serialized locals_dict.
+
+# requests that have to reach the index writer
+WRITER_PATHS = ['/ingest']
+# hop-by-hop headers that shouldn't be forwarded
+HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'upgrade', 'host', 'content-length'}
+
+
+class Worker():
+    def __init__(self, index: int, count: int, host: str, port: int, writer_url: str):
+        self.index = index
+        self.count = count
+        self.host = host
+        self.port = port
+        self.writer_url = writer_url
+        self.url = f'http://{host}:{port}'
+        self.process: Optional[subprocess.Popen] = None
+        self.restarts = 0
+
+    def start(self) -> None:
+        env = dict(os.environ)
+        env['LLMVM_WORKER_INDEX'] = str(self.index)
+        env['LLMVM_WORKER_COUNT'] = str(self.count)
+        env['LLMVM_INGEST_URL'] = self.writer_url
+        self.process = subprocess.Popen(
+            [
+                sys.executable, '-m', 'uvicorn', 'llmvm.server.server:app',
+                '--host', self.host, '--port', str(self.port), '--loop', 'asyncio',
+            ],
+            env=env,
+        )
+        logging.debug(f'Router: started worker {self.index} pid {self.process.pid} on {self.url}')
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self) -> None:
+        if self.alive():
+            self.process.terminate()  # type: ignore
+            try:
+                self.process.wait(timeout=10)  # type: ignore
+            except subprocess.TimeoutExpired:
+                self.process.kill()  # type: ignore
+
+
+class Router():
+    def __init__(
+        self,
+        workers: int,
+        host: str = '127.0.0.1',
+        base_port: int = 8012,
+        start_timeout: float = 120.0,
+    ):
+        self.start_timeout = start_timeout
+        writer_url = f'http://{host}:{base_port}'
+        self.workers = [Worker(i, workers, host, base_port + i, writer_url) for i in range(workers)]
+        self.round_robin = itertools.cycle(range(workers))
+        self.client: Optional[httpx.AsyncClient] = None
+        self.stopping = False
+
+    def worker_for(self, path: str, query_id: Optional[str], body: bytes, content_type: str) -> Worker:
+        if any(path == p or path.startswith(p + '/') for p in WRITER_PATHS):
+            return self.workers[0]
+
+        thread_id = 0
+        if query_id and query_id.lstrip('-').isdigit():
+            thread_id = int(query_id)
+        elif body and 'application/json' in content_type:
+            try:
+                data = json.loads(body)
+                if isinstance(data, dict) and isinstance(data.get('id'), int):
+                    thread_id = data['id']
+            except ValueError:
+                pass
+
+        # new threads can go anywhere, the worker picks an id it owns
+        if thread_id <= 0:
+            return self.workers[next(self.round_robin)]
+        return self.workers[thread_id % len(self.workers)]
+
+    async def supervise(self) -> None:
+        while not self.stopping:
+            for worker in self.workers:
+                if not worker.alive() and not self.stopping:
+                    code = worker.process.returncode if worker.process else None
+                    rich.print(f'[red]Worker {worker.index} exited ({code}), restarting.[/red]')
+                    worker.restarts += 1
+                    worker.start()
+            await asyncio.sleep(1.0)
+
+    async def proxy(self, request: Request, path: str):
+        body = await request.body()
+        worker = self.worker_for(
+            '/' + path,
+            request.query_params.get('id'),
+            body,
+            request.headers.get('content-type', ''),
+        )
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+        upstream = self.client.build_request(  # type: ignore
+            request.method,
+            f'{worker.url}/{path}',
+            params=request.query_params,
+            headers=headers,
+            content=body,
+        )
+
+        # a worker that's starting (or restarting) refuses connections for a while, wait for it
+        deadline = time.time() + self.start_timeout
+        while True:
+            try:
+                response = await self.client.send(upstream, stream=True)  # type: ignore
+                break
+            except (httpx.ConnectError, httpx.RemoteProtocolError) as ex:
+                if time.time() > deadline:
+                    return JSONResponse(status_code=503, content={'error': f'worker {worker.index} unavailable: {ex}'})
+                await asyncio.sleep(0.5)
+
+        return StreamingResponse(
+            response.aiter_raw(),
+            status_code=response.status_code,
+            headers={k: v for k, v in response.headers.items() if k.lower() not in HOP_HEADERS},
+            background=BackgroundTask(response.aclose),
+        )
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                'worker': worker.index,
+                'url': worker.url,
+                'pid': worker.process.pid if worker.process else None,
+                'alive': worker.alive(),
+                'restarts': worker.restarts,
+            }
+            for worker in self.workers
+        ]
+
+
+def create_app(router: Router) -> FastAPI:
+    app = FastAPI()
+
+    @app.on_event('startup')
+    async def startup():
+        # no read timeout, completions stream for as long as the tools run
+        router.client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None))
+        for worker in router.workers:
+            worker.start()
+        asyncio.create_task(router.supervise())
+
+    @app.on_event('shutdown')
+    async def shutdown():
+        router.stopping = True
+        for worker in router.workers:
+            worker.stop()
+        if router.client:
+            await router.client.aclose()
+
+    @app.get('/router/status')
+    async def router_status():
+        return router.status()
+
+    @app.api_route('/{path:path}', methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH'])
+    async def proxy(request: Request, path: str):
+        return await router.proxy(request, path)
+
+    return app
+
+
+@click.command()
+@click.option('--workers', '-w', type=int, required=False,
+              help='worker processes, defaults to server_workers in config.yaml')
+@click.option('--host', type=str, required=False, help='defaults to server_host')
+@click.option('--port', type=int, required=False, help='defaults to server_port')
+def main(workers: Optional[int], host: Optional[str], port: Optional[int]):
+    workers = workers or int(Container.get_config_variable('server_workers', 'LLMVM_SERVER_WORKERS', default=os.cpu_count() or 1))
+    host = host or Container.get_config_variable('server_host', 'LLMVM_SERVER_HOST', default='0.0.0.0')
+    port = port or int(Container.get_config_variable('server_port', 'LLMVM_SERVER_PORT', default=8011))
+
+    # workers listen on loopback, on the ports after the router's
+    router = Router(workers=workers, base_port=port + 1)
+    rich.print(f'[cyan]Routing {host}:{port} to {workers} workers on ports {port + 1}-{port + workers}[/cyan]')
+    uvicorn.run(create_app(router), host=host, port=port, loop='asyncio', log_level='info')
+
+
+if __name__ == '__main__':
+    main()
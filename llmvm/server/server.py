@@ -1,12 +1,10 @@
 import asyncio
-import base64
-import json
-import marshal
 import os
 import shutil
 import sys
+import threading
+import time
 from importlib import resources
-import types
 from typing import Any, Callable, Dict, List, Optional, cast
 
 import async_timeout
@@ -14,199 +12,188 @@ import jsonpickle
 import nest_asyncio
 import rich
 import uvicorn
-from fastapi import (BackgroundTasks, FastAPI, HTTPException, Request,
+from fastapi import (BackgroundTasks, FastAPI, Header, HTTPException, Request,
                      UploadFile)
 from fastapi.param_functions import File, Form
 from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
-from openai import AsyncOpenAI, OpenAI
 
+from llmvm.common import stream_wire
 from llmvm.common.anthropic_executor import AnthropicExecutor
+from llmvm.common.blob_store import LocalBlobStore, set_default_blob_store
+from llmvm.common.client_pool import ClientPool
 from llmvm.common.container import Container
 from llmvm.common.gemini_executor import GeminiExecutor
 from llmvm.common.helpers import Helpers
 from llmvm.common.logging_helpers import setup_logging
 from llmvm.common.objects import (Answer, Assistant, AstNode, Content,
-                                  DownloadItem, DownloadParams, FileContent, Message, MessageModel,
-                                  SessionThread, Statement, StopNode,
+                                  DownloadItem, DownloadParams, Executor, FileContent, Message, MessageModel,
+                                  RequestContext, SessionThread, SessionThreadDelta, Statement, StopNode,
                                   TokenCompressionMethod, User,
                                   compression_enum)
 from llmvm.common.openai_executor import OpenAIExecutor
+from llmvm.common.prompt_registry import PromptRegistry
+from llmvm.common.replay_executor import ReplayExecutor
+from llmvm.common.runtime_bridge import run_in_worker
 from llmvm.server.persistent_cache import PersistentCache, MemoryCache
 from llmvm.server.python_execution_controller import ExecutionController
 from llmvm.server.python_runtime import PythonRuntime
 from llmvm.server.tools.chrome import ChromeHelpers
+from llmvm.server.ingestion_queue import IngestionQueue
+from llmvm.server.locals_store import TrackedLocals, deserialize_locals, update_locals
 from llmvm.server.vector_search import VectorSearch
+from llmvm.server.query_classifier import QueryClassifier
 from llmvm.server.vector_store import VectorStore
 
 nest_asyncio.apply()
 
 logging = setup_logging()
 
-# check to see if the config file exists, if not, create it
-try:
-    Container().get_config_variable('executor', 'LLMVM_EXECUTOR', default='')
-except ValueError:
-    rich.print('[cyan]Configuration file not found. Adding default config in ~/.config/llmvm/config.yaml[/cyan]')
-    os.makedirs(os.path.expanduser('~/.config/llmvm'), exist_ok=True)
-    os.makedirs(os.path.expanduser('~/.local/share/llmvm'), exist_ok=True)
-    os.makedirs(os.path.expanduser('~/.local/share/llmvm/cache'), exist_ok=True)
-    os.makedirs(os.path.expanduser('~/.local/share/llmvm/download'), exist_ok=True)
-    os.makedirs(os.path.expanduser('~/.local/share/llmvm/cdn'), exist_ok=True)
-    os.makedirs(os.path.expanduser('~/.local/share/llmvm/logs'), exist_ok=True)
-    os.makedirs(os.path.expanduser('~/.local/share/llmvm/faiss'), exist_ok=True)
+app = FastAPI()
 
-    config_file = resources.files('llmvm') / 'config.yaml'
-    shutil.copy(str(config_file), os.path.expanduser('~/.config/llmvm/config.yaml'))
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+# set by llmvm.server.router when running as one of several worker processes. worker 0 owns
+# the vector index, every worker owns the threads where id % worker_count == worker_index
+worker_index = int(os.environ.get('LLMVM_WORKER_INDEX', 0))
+worker_count = int(os.environ.get('LLMVM_WORKER_COUNT', 1))
+index_writer = worker_index == 0
+
+# built by initialize() at startup rather than on import: the pdf process pool's spawned
+# workers import this module as __mp_main__, and mustn't open the caches, load the vector
+# index or start the ingestion writer thread
+agents: List[Callable]
+cache_session: PersistentCache
+cache_memory: MemoryCache[int, Dict[str, Any]]
+cdn_directory: str
+blob_store: LocalBlobStore
+vector_store: VectorStore
+ingestion_queue: Optional[IngestionQueue] = None
+vector_search: VectorSearch
+query_classifier: Optional[QueryClassifier] = None
+
+
+def __ensure_config() -> None:
+    # check to see if the config file exists, if not, create it
+    try:
+        Container().get_config_variable('executor', 'LLMVM_EXECUTOR', default='')
+    except ValueError:
+        rich.print('[cyan]Configuration file not found. Adding default config in ~/.config/llmvm/config.yaml[/cyan]')
+        os.makedirs(os.path.expanduser('~/.config/llmvm'), exist_ok=True)
+        os.makedirs(os.path.expanduser('~/.local/share/llmvm'), exist_ok=True)
+        os.makedirs(os.path.expanduser('~/.local/share/llmvm/cache'), exist_ok=True)
+        os.makedirs(os.path.expanduser('~/.local/share/llmvm/download'), exist_ok=True)
+        os.makedirs(os.path.expanduser('~/.local/share/llmvm/cdn'), exist_ok=True)
+        os.makedirs(os.path.expanduser('~/.local/share/llmvm/logs'), exist_ok=True)
+        os.makedirs(os.path.expanduser('~/.local/share/llmvm/faiss'), exist_ok=True)
+
+        config_file = resources.files('llmvm') / 'config.yaml'
+        shutil.copy(str(config_file), os.path.expanduser('~/.config/llmvm/config.yaml'))
+
+
+def __load_agents() -> List[Callable]:
+    return Helpers.flatten(list(
+        filter(
+            lambda x: x is not None, [Helpers.get_callables(logging, agent) for agent in Container().get('helper_functions')]
+        )
+    ))
 
-app = FastAPI()
 
-agents = Helpers.flatten(list(
-    filter(
-        lambda x: x is not None, [Helpers.get_callables(logging, agent) for agent in Container().get('helper_functions')]
-    )
-))
+def initialize() -> None:
+    global agents, cache_session, cache_memory, cdn_directory, blob_store
+    global vector_store, ingestion_queue, vector_search, query_classifier
 
-os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    __ensure_config()
 
-os.makedirs(Container().get('cache_directory'), exist_ok=True)
-os.makedirs(Container().get('cdn_directory'), exist_ok=True)
-os.makedirs(Container().get('log_directory'), exist_ok=True)
-os.makedirs(Container().get('vector_store_index_directory'), exist_ok=True)
-
-cache_session = PersistentCache(cache_directory=Container().get('cache_directory'))
-cache_memory: MemoryCache[int, Dict[str, Any]] = MemoryCache()
-cdn_directory = Container().get('cdn_directory')
-
-
-if not os.environ.get('OPENAI_API_KEY') and not os.environ.get('ANTHROPIC_API_KEY'):  # pragma: no cover
-    rich.print('[red]Neither OPENAI_API_KEY or ANTHROPIC_API_KEY are set. One of these API keys needs to be set in your terminal environment[/red]')  # NOQA: E501
-    sys.exit(1)
-
-
-vector_store = VectorStore(
-    store_directory=Container().get('vector_store_index_directory'),
-    index_name='index',
-    embedding_model=Container().get('vector_store_embedding_model'),
-    chunk_size=int(Container().get('vector_store_chunk_size')),
-    chunk_overlap=10
-)
-vector_search = VectorSearch(vector_store=vector_store)
-
-def __get_unserializable_locals(locals_dict: Dict[str, Any]) -> Dict[str, Any]:
-    unserializable_locals = {}
-    for key, value in locals_dict.items():
-        if (
-            not isinstance(value, types.FunctionType) and
-            not isinstance(value, types.MethodType) and
-            not isinstance(value, types.ModuleType) and
-            not isinstance(value, types.BuiltinFunctionType) and
-            not isinstance(value, types.BuiltinMethodType) and
-            isinstance(value, object)
-            and not isinstance(value, type)
-            and type(value).__module__ != 'builtins'
-            and type(value).__module__ != PythonRuntime.__module__
-        ):
-            try:
-                json.dumps(value)
-            except:
-                unserializable_locals[key] = value
-    return unserializable_locals
-
-def __serialize_locals_dict(locals_dict: Dict[str, Any]) -> Dict[str, Any]:
-    temp_dict = {}
-    for key, value in locals_dict.items():
-        if isinstance(key, str) and key.startswith('__'):
-            continue
-        elif isinstance(value, types.FunctionType) and value.__code__.co_filename == '<ast>':
-            # Serialize the function's code object
-            code_bytes = marshal.dumps(value.__code__)
-            temp_dict[key] = {
-                'type': 'function',
-                'name': value.__name__,
-                'code': base64.b64encode(code_bytes).decode('ascii'),
-                'defaults': value.__defaults__,
-                'closure': value.__closure__
-            }
-        elif isinstance(value, dict):
-            temp_dict[key] = __serialize_locals_dict(value)
-        elif isinstance(value, list):
-            temp_dict[key] = [__serialize_item(v) for v in value]
-        elif isinstance(value, (str, int, float, bool)):
-            temp_dict[key] = value
-        elif isinstance(value, (Content, AstNode, Message, Statement)):
-            temp_dict[key] = value
-        else:
-            try:
-                json.dumps(value)
-                temp_dict[key] = value
-            except:
-                # keep instances of tools alive until the server winds down
-                # if not isinstance(value, types.MethodType) and not isinstance(value, types.FunctionType):
-                    # self.locals_instance_state.append(InstanceState(thread_id=thread_id, locals_dict=value))
-                # actual functions can't be json serialized so we pass here
-                pass
-    return temp_dict
-
-def __serialize_item(item):
-    if isinstance(item, types.FunctionType) and item.__code__.co_filename == '<ast>':
-        code_bytes = marshal.dumps(item.__code__)
-        return {
-            'type': 'function',
-            'name': item.__name__,
-            'code': base64.b64encode(code_bytes).decode('ascii'),
-            'defaults': item.__defaults__,
-            'closure': item.__closure__
-        }
-    elif isinstance(item, (str, int, float, bool)):
-        return item
-    elif isinstance(item, (Content, AstNode, Message, Statement)):
-        return item
-    else:
-        try:
-            json.dumps(item)
-            return item
-        except:
-            # keep instances of tools alive until the server winds down
-            # if not isinstance(item, types.MethodType) and not isinstance(item, types.FunctionType):
-                # self.locals_instance_state.append(InstanceState(thread_id=thread_id, locals_dict=item))
-            # actual functions can't be json serialized so we pass here
-            pass
+    if not os.environ.get('OPENAI_API_KEY') and not os.environ.get('ANTHROPIC_API_KEY'):  # pragma: no cover
+        rich.print('[red]Neither OPENAI_API_KEY or ANTHROPIC_API_KEY are set. One of these API keys needs to be set in your terminal environment[/red]')  # NOQA: E501
+        sys.exit(1)
 
-def __deserialize_locals_dict(serialized_dict: Dict[str, Any]) -> Dict[str, Any]:
-    result = {}
-    for key, value in serialized_dict.items():
-        if isinstance(value, dict) and value.get('type') == 'function':
-            # Deserialize the function's code object
-            code_bytes = base64.b64decode(value['code'])
-            code = marshal.loads(code_bytes)
-            # Recreate the function
-            func = types.FunctionType(code, result, value['name'], value['defaults'], value['closure'])
-            result[key] = func
-        elif isinstance(value, dict):
-            result[key] = __deserialize_locals_dict(value)
-        elif isinstance(value, list):
-            result[key] = [__deserialize_item(v) for v in value]
-        else:
-            result[key] = value
-    return result
+    agents = __load_agents()
 
-def __deserialize_item(item):
-    if isinstance(item, dict) and item.get('type') == 'function':
-        code_bytes = base64.b64decode(item['code'])
-        code = marshal.loads(code_bytes)
-        return types.FunctionType(code, globals(), item['name'], item['defaults'], item['closure'])
-    return item
+    # parse every .prompt template once, up front
+    PromptRegistry().preload()
 
+    os.makedirs(Container().get('cache_directory'), exist_ok=True)
+    os.makedirs(Container().get('cdn_directory'), exist_ok=True)
+    os.makedirs(Container().get('log_directory'), exist_ok=True)
+    os.makedirs(Container().get('vector_store_index_directory'), exist_ok=True)
+
+    cache_session = PersistentCache(
+        cache_directory=Container().get('cache_directory'),
+        key_stride=worker_count,
+        key_offset=worker_index,
+    )
+    cache_memory = MemoryCache()
+    cdn_directory = Container().get('cdn_directory')
+
+    # image, pdf and file bytes in threads are stored once by hash in the cdn_directory
+    blob_store = LocalBlobStore(cdn_directory)
+    set_default_blob_store(blob_store)
+
+    vector_store = VectorStore(
+        store_directory=Container().get('vector_store_index_directory'),
+        index_name='index',
+        embedding_model=Container().get('vector_store_embedding_model'),
+        chunk_size=int(Container().get('vector_store_chunk_size')),
+        chunk_overlap=10,
+        nprobe=int(Container().get_config_variable('vector_store_nprobe', 'LLMVM_VECTOR_STORE_NPROBE', default=16)),
+        ef_search=int(Container().get_config_variable('vector_store_ef_search', 'LLMVM_VECTOR_STORE_EF_SEARCH', default=64)),
+        read_only=not index_writer,
+    )
+    ingestion_queue = IngestionQueue(
+        vector_store=vector_store,
+        workers=int(Container().get_config_variable('ingestion_workers', 'LLMVM_INGESTION_WORKERS', default=4)),
+        batch_size=int(Container().get_config_variable('ingestion_batch_size', 'LLMVM_INGESTION_BATCH_SIZE', default=256)),
+        checkpoint_documents=int(Container().get_config_variable('ingestion_checkpoint_documents', 'LLMVM_INGESTION_CHECKPOINT_DOCUMENTS', default=2000)),  # noqa E501
+        checkpoint_seconds=float(Container().get_config_variable('ingestion_checkpoint_seconds', 'LLMVM_INGESTION_CHECKPOINT_SECONDS', default=30)),  # noqa E501
+    ) if index_writer else None
+    vector_search = VectorSearch(
+        vector_store=vector_store,
+        ingestion_queue=ingestion_queue,
+        ingest_url=None if index_writer else os.environ.get('LLMVM_INGEST_URL'),
+    )
+
+    # tool/direct decisions from embeddings, falling back to (and learning from) the LLM classifier
+    query_classifier = QueryClassifier(
+        embed=lambda texts: vector_store.embedding_cache().embed(texts, vector_store.embeddings().embed_documents, namespace='query'),  # noqa E501
+        directory=os.path.join(Container().get('cache_directory'), 'query_classifier'),
+        threshold=float(Container().get_config_variable('query_classifier_threshold', 'LLMVM_QUERY_CLASSIFIER_THRESHOLD', default=0.9)),  # noqa E501
+        min_examples=int(Container().get_config_variable('query_classifier_min_examples', 'LLMVM_QUERY_CLASSIFIER_MIN_EXAMPLES', default=24)),  # noqa E501
+    ) if Container().get_config_variable('query_classifier', 'LLMVM_QUERY_CLASSIFIER', default=True) else None
+
+
+controllers: Dict[str, ExecutionController] = {}
 
 
 def get_controller(controller: Optional[str] = None) -> ExecutionController:
+    # one warm controller per executor, shared by every request: per-request model, temperature
+    # and token budgets travel in a RequestContext rather than on the executor
     if not controller:
         controller = Container().get_config_variable('executor', 'LLMVM_EXECUTOR', default='')
 
     if not controller:
         raise EnvironmentError('No executor specified in environment or config file')
 
+    if controller not in controllers:
+        controllers[controller] = __build_controller(controller)
+    return controllers[controller]
+
+
+def __replay(executor: Executor) -> Executor:
+    # record real llm exchanges, or replay them offline for repeatable profiling
+    mode = Container().get_config_variable('replay_mode', 'LLMVM_REPLAY_MODE', default='')
+    if not mode:
+        return executor
+
+    return ReplayExecutor(
+        executor,
+        recording_file=Container().get_config_variable('replay_file', 'LLMVM_REPLAY_FILE', default='~/.local/share/llmvm/replay.jsonl'),
+        mode=mode,
+        time_scale=float(Container().get_config_variable('replay_time_scale', 'LLMVM_REPLAY_TIME_SCALE', default=1.0)),
+    )
+
+
+def __build_controller(controller: str) -> ExecutionController:
     if controller == 'anthropic':
         anthropic_executor = AnthropicExecutor(
             api_key=os.environ.get('ANTHROPIC_API_KEY', ''),
@@ -216,11 +203,12 @@ def get_controller(controller: Optional[str] = None) -> ExecutionController:
             default_max_output_len=int(Container().get_config_variable('anthropic_max_output_tokens')),
         )
         anthropic_controller = ExecutionController(
-            executor=anthropic_executor,
+            executor=__replay(anthropic_executor),
             agents=agents,  # type: ignore
             vector_search=vector_search,
             edit_hook=None,
             continuation_passing_style=False,
+            query_classifier=query_classifier,
         )
         return anthropic_controller
     elif controller == 'gemini':
@@ -231,11 +219,12 @@ def get_controller(controller: Optional[str] = None) -> ExecutionController:
             default_max_output_len=int(Container().get('gemini_max_output_tokens')),
         )
         gemini_controller = ExecutionController(
-            executor=gemini_executor,
+            executor=__replay(gemini_executor),
             agents=agents,  # type: ignore
             vector_search=vector_search,
             edit_hook=None,
             continuation_passing_style=False,
+            query_classifier=query_classifier,
         )
         return gemini_controller
     else:
@@ -248,11 +237,12 @@ def get_controller(controller: Optional[str] = None) -> ExecutionController:
         )
 
         openai_controller = ExecutionController(
-            executor=openai_executor,
+            executor=__replay(openai_executor),
             agents=agents,  # type: ignore
             vector_search=vector_search,
             edit_hook=None,
             continuation_passing_style=False,
+            query_classifier=query_classifier,
         )
         return openai_controller
 
@@ -265,23 +255,61 @@ def __get_thread(id: int) -> SessionThread:
     return cast(SessionThread, cache_session.get(id))
 
 
-async def stream_response(response):
-    content = ''
-    async with async_timeout.timeout(220):
+def __set_thread(thread: SessionThread) -> None:
+    # every stored change bumps the version, so delta clients can detect they're out of date
+    if cache_session.has_key(thread.id):
+        thread.version = max(thread.version, cast(SessionThread, cache_session.get(thread.id)).version) + 1
+    else:
+        thread.version += 1
+    cache_session.set(thread.id, thread)
+
+
+# thread id -> when a delta turn against it started executing, so a second delta
+# against the same version gets a 409 rather than both being applied. a reservation whose
+# stream never started is ignored once it's older than the stream timeout
+delta_reservations: Dict[int, float] = {}
+delta_reservations_lock = threading.Lock()
+STREAM_TIMEOUT = 220
+
+
+def __reserve_delta(thread_id: int) -> bool:
+    with delta_reservations_lock:
+        reserved = delta_reservations.get(thread_id)
+        if reserved and time.monotonic() - reserved < STREAM_TIMEOUT:
+            return False
+        delta_reservations[thread_id] = time.monotonic()
+        return True
+
+
+def __release_delta(thread_id: int) -> None:
+    with delta_reservations_lock:
+        delta_reservations.pop(thread_id, None)
+
+
+async def stream_response(response, wire: int = 1):
+    async with async_timeout.timeout(STREAM_TIMEOUT):
         try:
-            async for chunk in response:
-                content += str(chunk)
-                yield f"data: {jsonpickle.encode(chunk)}\n\n"
-            yield "data: [DONE]"
+            if wire >= 2:
+                async for chunk in response:
+                    yield stream_wire.encode(chunk)
+                yield stream_wire.encode_done()
+            else:
+                async for chunk in response:
+                    yield f"data: {jsonpickle.encode(chunk)}\n\n"
+                yield "data: [DONE]"
         except asyncio.TimeoutError:
             raise HTTPException(status_code=504, detail="Stream timed out")
+        finally:
+            # close a turn's stream now if the client went away, rather than when it's collected
+            if hasattr(response, 'aclose'):
+                await response.aclose()
 
 
 @app.post('/v1/chat/completions')
 async def chat_completions(request: Request):
-    api_key = os.environ.get('OPENAI_API_KEY', default=''),
-    aclient = AsyncOpenAI(api_key=cast(str, api_key))
-    client = OpenAI(api_key=cast(str, api_key))
+    api_key = os.environ.get('OPENAI_API_KEY', default='')
+    aclient = ClientPool().openai(api_key)
+    client = ClientPool().openai_sync(api_key)
 
     try:
         # Construct the prompt from the messages
@@ -326,29 +354,68 @@ def search(query: str):
     return results
 
 @app.post('/ingest')
-async def ingest(file: UploadFile = File(...), background_tasks: BackgroundTasks = BackgroundTasks()):
+async def ingest(file: UploadFile = File(...)):
     try:
         name = os.path.basename(str(file.filename))
 
         with open(f"{cdn_directory}/{name}", "wb") as buffer:
             buffer.write(file.file.read())
-            background_tasks.add_task(
-                vector_search.ingest_file,
-                f"{cdn_directory}/{name}",
-                '',
-                str(file.filename),
-                {}
-            )
+
+        vector_search.enqueue_file(
+            f"{cdn_directory}/{name}",
+            '',
+            str(file.filename),
+            {}
+        )
         return {"filename": file.filename, "detail": "Ingestion started."}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Exception: {e}")
 
+@app.post('/ingest/text')
+async def ingest_text(request: Dict[str, Any]):
+    # used by read only workers to hand ingestion to the index writer
+    vector_search.enqueue_text(request['text'], request.get('title', ''), request.get('url', ''), request.get('metadata', {}))
+    return {'detail': 'Ingestion started.'}
+
+@app.post('/ingest/file')
+async def ingest_file(request: Dict[str, Any]):
+    vector_search.enqueue_file(request['filename'], request.get('project', ''), request.get('url', ''), request.get('metadata', {}))
+    return {'detail': 'Ingestion started.'}
+
+@app.get('/ingest/status')
+async def ingest_status() -> Dict[str, Any]:
+    if not ingestion_queue:
+        return {'worker': worker_index, 'ingest_url': vector_search.ingest_url}
+    return ingestion_queue.status()
+
+@app.on_event('startup')
+async def startup():
+    initialize()
+
+    # open a connection to the default executor's endpoint before the first request needs it
+    executor = Container().get_config_variable('executor', 'LLMVM_EXECUTOR', default='')
+    endpoints = {
+        'anthropic': Container().get_config_variable('anthropic_api_base', 'ANTHROPIC_API_BASE', default='https://api.anthropic.com'),
+        'openai': Container().get_config_variable('openai_api_base', 'OPENAI_API_BASE', default='https://api.openai.com/v1'),
+    }
+    if executor in endpoints:
+        asyncio.create_task(ClientPool().warm([endpoints[executor]]))
+
+@app.on_event('shutdown')
+async def shutdown():
+    # save anything ingested since the last checkpoint
+    if ingestion_queue:
+        ingestion_queue.close()
+    await ClientPool().aclose()
+
 @app.post('/download')
 async def download(
     download_item: DownloadItem,
-    background_tasks: BackgroundTasks = BackgroundTasks()
+    background_tasks: BackgroundTasks = BackgroundTasks(),
+    accept: str = Header(default=''),
 ):
+    wire = stream_wire.negotiate(accept)
     thread = __get_thread(download_item.id)
 
     if not cache_session.has_key(thread.id) or thread.id <= 0:
@@ -363,22 +430,24 @@ async def download(
 
     async def stream():
         async def execute_and_signal():
-            stream_handler = callback
             from llmvm.server.base_library.content_downloader import \
                 WebAndContentDriver
 
             # todo thread cookies through here
             downloader = WebAndContentDriver()
-            content: Content = downloader.download(download={
-                'url': download_item.url,
-                'goal': '',
-                'search_term': ''
-            })
+            content: Content = await run_in_worker(
+                downloader.download,
+                download={
+                    'url': download_item.url,
+                    'goal': '',
+                    'search_term': ''
+                },
+                stream_handler=callback,
+            )
             queue.put_nowait(StopNode())
 
             if content:
-                background_tasks.add_task(
-                    vector_search.ingest_text,
+                vector_search.enqueue_text(
                     controller.statement_to_str(content),
                     controller.statement_to_str(content)[:25],
                     download_item.url,
@@ -398,10 +467,10 @@ async def download(
 
         content = task.result()
         thread.messages.append(MessageModel.from_message(User(Content(content))))
-        cache_session.set(thread.id, thread)
+        __set_thread(thread)
         yield thread.model_dump()
 
-    return StreamingResponse(stream_response(stream()), media_type='text/event-stream')  # media_type="application/json")
+    return StreamingResponse(stream_response(stream(), wire), media_type=stream_wire.media_type(wire))
 
 @app.get('/v1/chat/get_thread')
 async def get_thread(id: int) -> SessionThread:
@@ -417,7 +486,8 @@ async def set_thread(request: SessionThread) -> SessionThread:
         temp = __get_thread(0)
         thread.id = temp.id
 
-    cache_session.set(thread.id, thread)
+    thread.messages = [m.to_blob(blob_store) for m in thread.messages]
+    __set_thread(thread)
     return cast(SessionThread, cache_session.get(thread.id))
 
 @app.get('/v1/chat/get_threads')
@@ -439,7 +509,10 @@ async def health():
 async def browser(url: str = 'https://9600.dev'):
     logging.debug(f'/browser?url={url}')
     chrome = ChromeHelpers()
-    result = await chrome.get_url(url)
+    try:
+        result = await chrome.get_url(url)
+    finally:
+        await chrome.close()
     return JSONResponse(content=result)
 
 @app.post('/v1/chat/cookies', response_model=None)
@@ -451,11 +524,11 @@ async def set_cookies(requests: Request):
     logging.debug(f'/v1/chat/cookies?id={id}')
     thread = __get_thread(id)
     thread.cookies = cookies
-    cache_session.set(thread.id, thread)
+    __set_thread(thread)
     return thread
 
 @app.post('/v1/tools/completions', response_model=None)
-async def tools_completions(request: SessionThread):
+async def tools_completions(request: SessionThread, accept: str = Header(default='')):
     thread = request
 
     if not cache_session.has_key(thread.id) or thread.id == 0:
@@ -465,38 +538,115 @@ async def tools_completions(request: SessionThread):
     elif cache_session.has_key(thread.id) and not thread.locals_dict:
         thread.locals_dict = cache_session.get(thread.id).locals_dict  # type: ignore
 
+    thread.messages = [m.to_blob(blob_store) for m in thread.messages]
+    return __execute_thread(thread, delta_from=None, wire=stream_wire.negotiate(accept))
+
+
+@app.post('/v1/tools/completions_delta', response_model=None)
+async def tools_completions_delta(request: SessionThreadDelta, accept: str = Header(default='')):
+    # the client only sends the messages it has added since 'version'. if the server
+    # copy has moved on (or is gone), respond with a 409 so the client does a full resync
+    # using /v1/tools/completions
+    if request.id <= 0 and request.version == 0:
+        stored = __get_thread(0)
+    elif request.id > 0 and cache_session.has_key(request.id):
+        stored = cast(SessionThread, cache_session.get(request.id))
+    else:
+        raise HTTPException(status_code=409, detail=f'Thread {request.id} not found, full resync required')
+
+    if stored.version != request.version:
+        raise HTTPException(
+            status_code=409,
+            detail=f'Thread {stored.id} is at version {stored.version}, client is at {request.version}, full resync required'
+        )
+
+    if not __reserve_delta(stored.id):
+        raise HTTPException(
+            status_code=409,
+            detail=f'Thread {stored.id} already has a turn executing at version {stored.version}, full resync required'
+        )
+
+    # the turn runs on a copy, which is only stored (with the version bump) once it completes,
+    # so a failed or abandoned turn leaves the stored thread as the client last saw it
+    thread = stored.model_copy()
+    thread.executor = request.executor
+    thread.model = request.model
+    thread.current_mode = request.current_mode
+    thread.compression = request.compression
+    thread.temperature = request.temperature
+    thread.stop_tokens = request.stop_tokens
+    thread.output_token_len = request.output_token_len
+    thread.cookies = request.cookies
+    thread.messages = stored.messages + [m.to_blob(blob_store) for m in request.messages]
+
+    try:
+        return __execute_thread(thread, delta_from=len(thread.messages), wire=stream_wire.negotiate(accept))
+    except Exception:
+        __release_delta(thread.id)
+        raise
+
+
+def __execute_thread(thread: SessionThread, delta_from: Optional[int], wire: int = 1) -> StreamingResponse:
+    def final_frame() -> Dict[str, Any]:
+        if delta_from is None:
+            return thread.model_dump()
+
+        return SessionThreadDelta(
+            id=thread.id,
+            version=thread.version,
+            executor=thread.executor,
+            model=thread.model,
+            current_mode=thread.current_mode,
+            compression=thread.compression,
+            temperature=thread.temperature,
+            stop_tokens=thread.stop_tokens,
+            output_token_len=thread.output_token_len,
+            cookies=thread.cookies,
+            messages=thread.messages[delta_from:],
+        ).model_dump()
+
     messages = [MessageModel.to_message(m) for m in thread.messages]  # type: ignore
     mode = thread.current_mode
-    compression = compression_enum(thread.compression)
     queue = asyncio.Queue()
-    cookies = thread.cookies if thread.cookies else []
 
     # set the defaults, or use what the SessionThread thread asks
     if thread.executor and thread.model:
         controller = get_controller(thread.executor)
-        model = thread.model if thread.model else controller.get_executor().get_default_model()
     # either the executor or the model is not set, so use the defaults
     # and update the thread
     else:
         logging.debug('Either the executor or the model is not set. Updating thread.')
         controller = get_controller()
-        model = controller.get_executor().get_default_model()
         thread.executor = controller.get_executor().name()
-        thread.model = model
+        thread.model = controller.get_executor().get_default_model()
+
+    context = RequestContext(
+        executor=thread.executor,
+        model=thread.model,
+        temperature=thread.temperature,
+        compression=compression_enum(thread.compression),
+        cookies=thread.cookies if thread.cookies else [],
+        stop_tokens=thread.stop_tokens,
+        output_token_len=thread.output_token_len,
+    )
 
-    logging.debug(f'/v1/tools/completions?id={thread.id}&mode={mode}&model={model}&executor={thread.executor}&compression={thread.compression}&cookies={thread.cookies}&temperature={thread.temperature}')  # NOQA: E501
+    logging.debug(f'/v1/tools/completions?id={thread.id}&mode={mode}&{context}&cookies={thread.cookies}')  # NOQA: E501
 
     if len(messages) == 0:
         raise HTTPException(status_code=400, detail='No messages provided')
 
-    # todo perform some merge logic of the messages here
-    # I don't think we want to have the client always grab the full thread
-    # before posting
-
     async def callback(token: AstNode):
         queue.put_nowait(token)
 
     async def stream():
+        try:
+            async for data in execute():
+                yield data
+        finally:
+            if delta_from is not None:
+                __release_delta(thread.id)
+
+    async def execute():
         def handle_exception(task):
             if not task.cancelled() and task.exception() is not None:
                 Helpers.log_exception(logging, task.exception())
@@ -506,36 +656,39 @@ async def tools_completions(request: SessionThread):
             if thread.current_mode == 'direct':
                 result = await controller.aexecute(
                     messages=messages,
-                    temperature=thread.temperature,
-                    model=model,
+                    temperature=context.temperature,
+                    model=context.model,
                     mode=thread.current_mode,
-                    compression=compression,
-                    cookies=cookies,
+                    compression=context.compression,
+                    cookies=context.cookies,
                     stream_handler=callback,
                 )
                 queue.put_nowait(StopNode())
                 return result
             else:
                 # deserialize the locals_dict, then merge it with the in-memory locals_dict we have in MemoryCache
-                locals_dict = __deserialize_locals_dict(thread.locals_dict)
-                locals_dict.update(cache_memory.get(thread.id) or {})
+                in_memory = cache_memory.get(thread.id) or {}
+                locals_dict = deserialize_locals(thread.locals_dict)
+                locals_dict.update(in_memory)
+                # tracks what the turn changes, so only that is serialized again
+                locals_dict = TrackedLocals(locals_dict=locals_dict)
 
                 # todo: this is a hack
                 result, locals_dict = await controller.aexecute_continuation(
                     messages=messages,
-                    temperature=thread.temperature,
+                    temperature=context.temperature,
                     stream_handler=callback,
-                    model=model,
-                    compression=compression,
-                    cookies=cookies,
+                    model=context.model,
+                    compression=context.compression,
+                    cookies=context.cookies,
                     agents=cast(List[Callable], agents),
                     locals_dict=locals_dict
                 )
                 queue.put_nowait(StopNode())
 
                 # update the in-memory locals_dict with unserializable locals
-                cache_memory.set(thread.id, __get_unserializable_locals(locals_dict))
-                thread.locals_dict = __serialize_locals_dict(locals_dict)
+                thread.locals_dict, in_memory = update_locals(thread.locals_dict, in_memory, locals_dict)
+                cache_memory.set(thread.id, in_memory)
                 return result
 
         task = asyncio.create_task(execute_and_signal())
@@ -556,7 +709,10 @@ async def tools_completions(request: SessionThread):
         # error handling
         if task.exception() is not None:
             thread.messages.append(MessageModel.from_message(Assistant(Content(f'Error: {str(task.exception())}'))))
-            yield thread.model_dump()
+            # the client gets the error message as part of the delta, so store it with the thread
+            if delta_from is not None:
+                __set_thread(thread)
+            yield final_frame()
             return
 
         statements: List[Statement] = task.result()
@@ -575,14 +731,14 @@ async def tools_completions(request: SessionThread):
 
         if len(results) > 0:
             for result in results:
-                thread.messages.append(MessageModel.from_message(result))
-            cache_session.set(thread.id, thread)
-            yield thread.model_dump()
+                thread.messages.append(MessageModel.from_message(result, blob_store))
+            __set_thread(thread)
+            yield final_frame()
         else:
             # todo need to do something here to deal with error cases
-            yield thread.model_dump()
+            yield final_frame()
 
-    return StreamingResponse(stream_response(stream()), media_type='text/event-stream')  # media_type="application/json")
+    return StreamingResponse(stream_response(stream(), wire), media_type=stream_wire.media_type(wire))
 
 
 @app.exception_handler(Exception)
@@ -592,6 +748,8 @@ async def general_exception_handler(request: Request, exc: Exception):
 
 
 if __name__ == '__main__':
+    __ensure_config()
+    agents = __load_agents()
     default_controller = Container().get_config_variable('executor', 'LLMVM_EXECUTOR', default='')
     default_model_str = f'{default_controller}_model'
     default_model = Container().get_config_variable(default_model_str, 'LLMVM_MODEL', default='')
@@ -604,8 +762,9 @@ if __name__ == '__main__':
     for agent in agents:
         rich.print(f'[green]Loaded agent: {agent.__name__}[/green]')  # type: ignore
 
-    # you can run this using uvicorn to get better asynchronousy, but don't count on it yet.
-    # uvicorn server:app --loop asyncio --workers 4 --log-level debug --host 0.0.0.0 --port 8011
+    # don't use uvicorn --workers, sessions keep state in process. for more than one worker
+    # process use the router, which pins each thread to a worker:
+    # python -m llmvm.server.router --workers 8
     config = uvicorn.Config(
         app='llmvm.server.server:app',
         host=Container().get_config_variable('server_host', 'LLMVM_SERVER_HOST'),
@@ -11,6 +11,7 @@ from llmvm.common.helpers import Helpers, write_client_stream
 from llmvm.common.logging_helpers import setup_logging
 from llmvm.common.objects import (BrowserContent, Content, ImageContent, LLMCall, MarkdownContent, Message, StreamNode,
                                   TokenCompressionMethod, User, bcl)
+from llmvm.common.runtime_bridge import run_coroutine
 from llmvm.server.python_execution_controller import ExecutionController
 from llmvm.server.python_runtime import PythonRuntime
 from llmvm.server.tools.chrome import ChromeHelpers, ClickableElementHandle
@@ -226,15 +227,15 @@ class Browser():
         Expression: {expression}
         """
 
-        result = asyncio.run(self.controller.aexecute_llm_call(
+        result = run_coroutine(self.controller.aexecute_llm_call(
             llm_call=LLMCall(
                 user_message=User(Content(PROMPT)),
                 context_messages=[User(self.current_screenshot), User(self.current_markdown)],
                 executor=self.controller.executor,
-                model=self.controller.executor.default_model,
+                model=self.runtime.context.model,
                 temperature=1.0,
-                max_prompt_len=self.controller.executor.max_input_tokens(),
-                completion_tokens_len=self.controller.executor.max_output_tokens(),
+                max_prompt_len=self.runtime.context.max_prompt_len,
+                completion_tokens_len=self.runtime.context.output_token_len,
                 prompt_name='get_selector',
             ),
             query=expression,
@@ -3,17 +3,20 @@ import base64
 import concurrent
 import concurrent.futures
 import datetime as dt
+import hashlib
+import json
 import os
 import threading
 import tempfile
-from typing import Dict, List, Tuple, cast
+import time
+from typing import Any, Dict, List, Optional, Tuple, cast
 from urllib.parse import urlparse
 
 import aiofiles
 from bs4 import BeautifulSoup
 import httpx
 import nest_asyncio
-from playwright.async_api import ElementHandle, Error, Page, async_playwright
+from playwright.async_api import BrowserContext, ElementHandle, Error, Page, async_playwright
 
 from llmvm.common.container import Container
 from llmvm.common.helpers import write_client_stream
@@ -75,11 +78,161 @@ def read_netscape_cookies(cookies_txt_filename: str):
     return cookies
 
 
-class ChromeHelpers():
-    def __init__(self, cookies: List[Dict] = []):
+class BrowserPool(metaclass=Singleton):
+    """
+    Process wide Chromium. The browser is launched once on a dedicated event loop thread and
+    kept warm; pages are leased from a browser context per distinct cookie set, at most
+    chromium_max_pages pages are open at once, and contexts (then the browser itself) that
+    have been idle for chromium_idle_seconds are closed.
+    """
+    USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'  # noqa E501
+
+    def __init__(self):
+        self.args = [
+            '--no-sandbox',
+            '--disable-setuid-sandbox',
+            '--disable-infobars',
+            '--disable-dev-shm-usage',
+            '--disable-blink-features=AutomationControlled',
+            '--ignore-certificate-errors',
+            '--no-first-run',
+            '--no-service-autorun',
+            '--password-store=basic',
+            '--use-mock-keychain',
+        ]
+        self.max_pages = int(Container.get_config_variable('chromium_max_pages', 'LLMVM_CHROMIUM_MAX_PAGES', default=8))
+        self.idle_seconds = float(Container.get_config_variable('chromium_idle_seconds', 'LLMVM_CHROMIUM_IDLE_SECONDS', default=300))
+        self.page_timeout = float(Container.get_config_variable('chromium_page_timeout', 'LLMVM_CHROMIUM_PAGE_TIMEOUT', default=120))
+
+        self.playwright = None
+        self.browser = None
+        # cookie set key -> context, open pages in it, last lease time
+        self.contexts: Dict[str, Dict[str, Any]] = {}
+        self.last_used = time.time()
+        self.cookie_file_cache: Tuple[float, List[Dict]] = (0.0, [])
+
         self.loop = asyncio.SelectorEventLoop()
-        self.thread = threading.Thread(target=self._run_event_loop, daemon=True)
+        self.thread = threading.Thread(target=self._run_event_loop, name='llmvm-browser-pool', daemon=True)
         self.thread.start()
+
+        # created on the pool loop
+        self.pages: asyncio.Semaphore = asyncio.run_coroutine_threadsafe(self.__semaphore(), self.loop).result()
+        self.browser_lock: asyncio.Lock = asyncio.run_coroutine_threadsafe(self.__lock(), self.loop).result()
+        asyncio.run_coroutine_threadsafe(self.__reap(), self.loop)
+
+    def _run_event_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def __semaphore(self) -> asyncio.Semaphore:
+        return asyncio.Semaphore(self.max_pages)
+
+    async def __lock(self) -> asyncio.Lock:
+        return asyncio.Lock()
+
+    def __cookie_file(self) -> List[Dict]:
+        # the netscape cookie file is re-read only when it changes
+        cookie_file = Container().get('chromium_cookies', '')
+        if not os.path.exists(cookie_file):
+            return []
+        mtime = os.path.getmtime(cookie_file)
+        if mtime != self.cookie_file_cache[0]:
+            self.cookie_file_cache = (mtime, read_netscape_cookies(cookie_file))
+        return self.cookie_file_cache[1]
+
+    async def __browser(self):
+        # called with browser_lock held
+        if self.browser is None or not self.browser.is_connected():
+            logging.debug('BrowserPool: launching chromium')
+            self.contexts = {}
+            self.playwright = self.playwright or await async_playwright().start()
+            self.browser = await self.playwright.chromium.launch(
+                headless=Container().get('chromium_headless', default=True),
+                args=self.args
+            )
+        return self.browser
+
+    async def __context(self, cookies: List[Dict]) -> Dict[str, Any]:
+        key = hashlib.sha256(json.dumps(cookies, sort_keys=True, default=str).encode()).hexdigest()
+
+        # one lock hold from launch to context, so the reaper can't close an idle browser in between
+        async with self.browser_lock:
+            browser = await self.__browser()
+            if key not in self.contexts:
+                context: BrowserContext = await browser.new_context(viewport={'width': 1920, 'height': 1080}, accept_downloads=True)
+                file_cookies = self.__cookie_file()
+                if file_cookies:
+                    await context.add_cookies(file_cookies)  # type: ignore
+                if cookies:
+                    await context.add_cookies(cookies)  # type: ignore
+                self.contexts[key] = {'context': context, 'pages': 0, 'last_used': time.time()}
+            entry = self.contexts[key]
+            entry['last_used'] = time.time()
+            return entry
+
+    async def new_page(self, cookies: List[Dict] = []) -> Page:
+        """
+        Must be awaited on the pool loop. The page slot is returned when the page is closed.
+        """
+        try:
+            await asyncio.wait_for(self.pages.acquire(), timeout=self.page_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'BrowserPool: all {self.max_pages} pages were busy for {self.page_timeout} seconds')
+        self.last_used = time.time()
+        try:
+            entry = await self.__context(cookies)
+            page = await entry['context'].new_page()
+        except Exception:
+            self.pages.release()
+            raise
+
+        entry['pages'] += 1
+        self.last_used = time.time()
+
+        def on_close(_):
+            entry['pages'] -= 1
+            entry['last_used'] = time.time()
+            self.pages.release()
+
+        page.once('close', on_close)
+        await page.set_extra_http_headers({'User-Agent': BrowserPool.USER_AGENT})
+        return page
+
+    async def __reap(self):
+        while True:
+            await asyncio.sleep(min(30.0, self.idle_seconds))
+            now = time.time()
+            async with self.browser_lock:
+                for key, entry in list(self.contexts.items()):
+                    if entry['pages'] <= 0 and now - entry['last_used'] > self.idle_seconds:
+                        logging.debug('BrowserPool: closing idle context')
+                        del self.contexts[key]
+                        try:
+                            await entry['context'].close()
+                        except Exception as ex:
+                            logging.debug(f'BrowserPool: closing context failed with: {ex}')
+
+                if self.browser is not None and not self.contexts and now - self.last_used > self.idle_seconds:
+                    logging.debug('BrowserPool: closing idle chromium')
+                    try:
+                        await self.browser.close()
+                    except Exception as ex:
+                        logging.debug(f'BrowserPool: closing chromium failed with: {ex}')
+                    self.browser = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'browser': self.browser is not None,
+            'contexts': len(self.contexts),
+            'open_pages': sum(entry['pages'] for entry in self.contexts.values()),
+            'max_pages': self.max_pages,
+        }
+
+
+class ChromeHelpers():
+    def __init__(self, cookies: List[Dict] = []):
+        # all playwright objects live on the pool's loop
+        self.loop = BrowserPool().loop
         self.chrome = ChromeHelpersInternal(cookies=cookies)
 
     @staticmethod
@@ -93,10 +246,6 @@ class ChromeHelpers():
             logging.debug(f'ChromeHelpers.check_installed() failed with: {ex}')
             return False
 
-    def _run_event_loop(self):
-        asyncio.set_event_loop(self.loop)
-        self.loop.run_forever()
-
     def run_in_loop(self, coro):
         future = concurrent.futures.Future()
 
@@ -182,25 +331,8 @@ class ChromeHelpers():
 
 class ChromeHelpersInternal():
     def __init__(self, cookies: List[Dict] = []):
-        self.args = [
-            '--no-sandbox',
-            '--disable-setuid-sandbox',
-            '--disable-infobars',
-            '--disable-dev-shm-usage',
-            '--disable-blink-features=AutomationControlled',
-            '--ignore-certificate-errors',
-            '--no-first-run',
-            '--no-service-autorun',
-            '--password-store=basic',
-            '--use-mock-keychain',
-        ]
-
         self.cookies = cookies
-        self._context = None
-        self._page = None
-        self.playwright = None
-        self.browser = None
-        self.is_closed = True
+        self._page: Optional[Page] = None
         self.wait_fors = {
             'twitter.com': lambda page: self.wait(1500),
             'x.com': lambda page: self.wait(1500),
@@ -245,26 +377,14 @@ class ChromeHelpersInternal():
     def set_cookies(self, cookies: List[Dict]):
         self.cookies = cookies
 
-    async def __new_page(self, cookies: List[Dict] = []) -> Page:
-        if self.is_closed:
-            self.playwright = await async_playwright().start()
-            self.browser = await self.playwright.chromium.launch(
-                headless=Container().get('chromium_headless', default=True),
-                args=self.args
-            )
-
-        self._context = await self.browser.new_context(viewport={'width': 1920, 'height': 1080}, accept_downloads=True)  # type: ignore
-        cookie_file = Container().get('chromium_cookies', '')
-        if os.path.exists(cookie_file):
-            result = read_netscape_cookies(cookie_file)
-            await self._context.add_cookies(result)
-
-        if self.cookies:
-            await self._context.add_cookies(self.cookies)  # type: ignore
-        page = await self._context.new_page()
-        await page.set_extra_http_headers({"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"})
-        self.is_closed = False
-        return page
+    async def __new_page(self) -> Page:
+        # hand back the page we're replacing so it doesn't hold a pool slot
+        if self._page is not None and not self._page.is_closed():
+            try:
+                await self._page.close()
+            except Error as ex:
+                logging.debug(f'ChromeHelpersInternal.__new_page() closing previous page failed with: {ex}')
+        return await BrowserPool().new_page(self.cookies)
 
     async def page(self) -> Page:
         if self._page is None:
@@ -277,11 +397,13 @@ class ChromeHelpersInternal():
         return (await self.page()).url
 
     async def close(self) -> None:
-        if self._page is not None:
-            await (await self.page()).close()
-        if self.browser is not None:
-            await self.browser.close()
-        self.is_closed = True
+        # the browser and context stay warm in the pool, only the page is ours
+        page, self._page = self._page, None
+        if page is not None and not page.is_closed():
+            try:
+                await page.close()
+            except Error as ex:
+                logging.debug(f'ChromeHelpersInternal.close() failed with: {ex}')
 
     async def goto(self, url: str):
         try:
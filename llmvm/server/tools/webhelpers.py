@@ -83,12 +83,14 @@ class WebHelpers():
         logging.debug('WebHelpers.get_linkedin_profile: {}'.format(linkedin_url))
 
         chrome_helpers = ChromeHelpers()
-        asyncio.run(chrome_helpers.goto(linkedin_url))
-        asyncio.run(chrome_helpers.wait_until_text('Experience'))
-        pdf_file = asyncio.run(chrome_helpers.pdf())
+        try:
+            asyncio.run(chrome_helpers.goto(linkedin_url))
+            asyncio.run(chrome_helpers.wait_until_text('Experience'))
+            pdf_file = asyncio.run(chrome_helpers.pdf())
+        finally:
+            asyncio.run(chrome_helpers.close())
         data = PdfHelpers.parse_pdf(pdf_file)
         os.remove(pdf_file)
-        asyncio.run(chrome_helpers.close())
         return data
 
     @staticmethod
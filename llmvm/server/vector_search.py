@@ -1,12 +1,15 @@
 import datetime as dt
+import threading
 from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
+import httpx
 from langchain.text_splitter import TextSplitter
 
 from llmvm.common.logging_helpers import setup_logging
 from llmvm.common.objects import Message
 from llmvm.common.pdf import PdfHelpers
 from llmvm.server.base_library.source import Source
+from llmvm.server.ingestion_queue import IngestionQueue
 from llmvm.server.tools.webhelpers import WebHelpers
 from llmvm.server.vector_store import VectorStore
 
@@ -51,8 +54,55 @@ class VectorSearch():
     def __init__(
         self,
         vector_store: VectorStore,
+        ingestion_queue: Optional[IngestionQueue] = None,
+        ingest_url: Optional[str] = None,
     ):
         self.vector_store = vector_store
+        self.ingestion_queue = ingestion_queue
+        # multi-worker mode: the base url of the worker that owns the index, which
+        # ingests on behalf of the read only workers
+        self.ingest_url = ingest_url
+
+    def __forward(self, endpoint: str, payload: Dict[str, Any]) -> None:
+        def post():
+            try:
+                httpx.post(f'{self.ingest_url}{endpoint}', json=payload, timeout=30.0).raise_for_status()
+            except Exception as ex:
+                logging.error(f'VectorSearch: forwarding {endpoint} to {self.ingest_url} failed with: {ex}')
+
+        threading.Thread(target=post, daemon=True).start()
+
+    def __ingest(self, text: str, metadata: Optional[dict] = None) -> None:
+        if self.ingestion_queue:
+            self.ingestion_queue.put_documents(self.vector_store.split_text(text, metadata))
+        else:
+            self.vector_store.ingest_text(text, metadata)
+
+    def enqueue_file(
+        self,
+        filename: str,
+        project: str,
+        url: str,
+        metadata: dict
+    ) -> None:
+        if self.ingest_url:
+            return self.__forward('/ingest/file', {'filename': filename, 'project': project, 'url': url, 'metadata': metadata})
+        if not self.ingestion_queue:
+            return self.ingest_file(filename, project, url, metadata)
+        self.ingestion_queue.submit(filename, lambda: self.ingest_file(filename, project, url, metadata))
+
+    def enqueue_text(
+        self,
+        text: str,
+        title: str,
+        url: str,
+        metadata: dict
+    ) -> None:
+        if self.ingest_url:
+            return self.__forward('/ingest/text', {'text': text, 'title': title, 'url': url, 'metadata': metadata})
+        if not self.ingestion_queue:
+            return self.ingest_text(text, title, url, metadata)
+        self.ingestion_queue.submit(url or title, lambda: self.ingest_text(text, title, url, metadata))
 
     def search(
         self,
@@ -156,7 +206,7 @@ class VectorSearch():
                 parent='',
                 extra_metdata=metadata
             )
-            self.vector_store.ingest_text(str(m.message), metadata)
+            self.__ingest(str(m.message), metadata)
 
     def ingest_text(
         self,
@@ -174,7 +224,7 @@ class VectorSearch():
             parent='',
             extra_metdata=metadata
         )
-        self.vector_store.ingest_text(text, entity.to_dict())
+        self.__ingest(text, entity.to_dict())
 
     def parse_python_file(
         self,
@@ -203,7 +253,7 @@ class VectorSearch():
             parent='',
             extra_metdata=metadata,
         )
-        self.vector_store.ingest_text(sourcer.source_code, entity.to_dict())
+        self.__ingest(sourcer.source_code, entity.to_dict())
         logging.debug('ingested python file: {}'.format(filename))
 
     def ingest_file(
@@ -228,7 +278,7 @@ class VectorSearch():
                 parent='',
                 extra_metdata=metadata
             )
-            self.vector_store.ingest_text(text, entity.to_dict())
+            self.__ingest(text, entity.to_dict())
             logging.debug('ingested pdf file: {}'.format(filename))
         elif filename.endswith('.csv'):
             columns = []
@@ -248,7 +298,7 @@ class VectorSearch():
                 parent='',
                 extra_metdata=metadata
             )
-            self.vector_store.ingest_text(content, entity.to_dict())
+            self.__ingest(content, entity.to_dict())
             logging.debug('ingested csv file: {}'.format(filename))
         elif filename.endswith('.txt') or filename.endswith('.md'):
             with open(filename, 'r') as f:
@@ -262,7 +312,7 @@ class VectorSearch():
                     parent='',
                     extra_metdata=metadata
                 )
-                self.vector_store.ingest_text(text, entity.to_dict())
+                self.__ingest(text, entity.to_dict())
                 logging.debug('ingested text file: {}'.format(filename))
         elif filename.endswith('.html') or filename.endswith('.htm'):
             with open(filename, 'r') as f:
@@ -277,7 +327,7 @@ class VectorSearch():
                     parent='',
                     extra_metdata=metadata,
                 )
-                self.vector_store.ingest_text(text, entity.to_dict())
+                self.__ingest(text, entity.to_dict())
                 logging.debug('ingested html file: {}'.format(filename))
         elif filename.endswith('.py'):
             self.parse_python_file(filename, url, metadata)
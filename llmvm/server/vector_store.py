@@ -1,18 +1,88 @@
 import math
 import os
-import tempfile
-from typing import Awaitable, Callable, List, Optional, Tuple
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 from langchain.docstore.document import Document
 from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 from langchain.text_splitter import TextSplitter, TokenTextSplitter
-from langchain_community.document_loaders import TextLoader
 
+from llmvm.common.container import Container
 from llmvm.common.logging_helpers import setup_logging
+from llmvm.server.embedding_cache import EmbeddingCache
 
 logging = setup_logging()
 
+INDEX_TYPES = ['flat', 'ivf', 'hnsw', 'ivfpq']
+
+
+def build_faiss_index(
+    index_type: str,
+    vectors: np.ndarray,
+    nlist: int = 4096,
+    hnsw_m: int = 32,
+    pq_m: int = 16,
+):
+    """
+    Builds, trains and fills a faiss index of index_type (flat, ivf, hnsw, ivfpq) over vectors.
+    Vector ids are assigned in order, so they line up with an existing index_to_docstore_id.
+    """
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    dimension = vectors.shape[1]
+    # faiss wants ~39 training points per ivf centroid
+    nlist = max(1, min(nlist, len(vectors) // 39))
+
+    if index_type == 'flat':
+        factory = 'Flat'
+    elif index_type == 'ivf':
+        factory = f'IVF{nlist},Flat'
+    elif index_type == 'hnsw':
+        factory = f'HNSW{hnsw_m}'
+    elif index_type == 'ivfpq':
+        if len(vectors) < 256:
+            raise ValueError(f'ivfpq needs at least 256 vectors to train, the index has {len(vectors)}')
+        if dimension % pq_m != 0:
+            raise ValueError(f'pq_m {pq_m} must divide the embedding dimension {dimension}')
+        # np: skip polysemous training, which search doesn't use and which dominates build time
+        factory = f'IVF{nlist},PQ{pq_m}np'
+    else:
+        raise ValueError(f'Unknown index type: {index_type}, expected one of {INDEX_TYPES}')
+
+    index = faiss.index_factory(dimension, factory)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def set_search_params(index, nprobe: int = 16, ef_search: int = 64) -> None:
+    """
+    Recall versus latency knobs: nprobe is the number of ivf lists scanned, ef_search the
+    size of the hnsw candidate list. Ignored for index types they don't apply to.
+    """
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+
+def index_vectors(index) -> np.ndarray:
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
 class VectorStore():
     def __init__(
         self,
@@ -21,18 +91,30 @@ class VectorStore():
         embedding_model: str,
         chunk_size: int = 500,
         chunk_overlap: int = 50,
+        nprobe: int = 16,
+        ef_search: int = 64,
+        read_only: bool = False,
     ):
         self._embeddings = None
+        self._embedding_cache: Optional[EmbeddingCache] = None
         self.embedding_model = embedding_model
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.store_directory: str = store_directory
         self.index_name: str = index_name
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        # ingestion workers write to the index while requests search it
+        self.lock = threading.RLock()
+        # in multi-worker mode only one process writes the index, the others search
+        # the copy on disk and pick up new checkpoints as they're saved
+        self.read_only = read_only
+        self.loaded_version: Tuple[float, float] = (0.0, 0.0)
 
         if not os.path.exists(self.store_directory):
             os.makedirs(self.store_directory)
 
-        if not os.path.exists(os.path.join(self.store_directory, self.index_name + '.faiss')):
+        if not read_only and not os.path.exists(os.path.join(self.store_directory, self.index_name + '.faiss')):
             from langchain_community.vectorstores.faiss import FAISS
             self.store: FAISS = FAISS.from_texts([''], self.embeddings())
             self.store.override_relevance_score_fn = self.__score_normalizer
@@ -47,6 +129,19 @@ class VectorStore():
             )
         return self._embeddings
 
+    def embedding_cache(self) -> EmbeddingCache:
+        if not self._embedding_cache:
+            self._embedding_cache = EmbeddingCache(
+                cache_directory=os.path.join(self.store_directory, 'embedding_cache'),
+                embedding_model=self.embedding_model,
+                max_rows=int(Container.get_config_variable(
+                    'vector_store_embedding_cache_max_rows',
+                    'LLMVM_VECTOR_STORE_EMBEDDING_CACHE_MAX_ROWS',
+                    default=200000
+                )),
+            )
+        return self._embedding_cache
+
     def __metadata_str(self, document: Document):
         if document.metadata:
             return ', '.join([f'{str(k)}: {str(v)}' for k, v in document.metadata.items()])
@@ -56,54 +151,137 @@ class VectorStore():
     def __document_str(self, document: Document):
         return f'{self.__metadata_str(document)} {document.page_content}'
 
+    def __saved_version(self) -> Tuple[float, float]:
+        # (index, docstore) modification times of the saved checkpoint
+        path = os.path.join(self.store_directory, self.index_name)
+        if not os.path.exists(path + '.faiss') or not os.path.exists(path + '.pkl'):
+            return (0.0, 0.0)
+        return (os.path.getmtime(path + '.faiss'), os.path.getmtime(path + '.pkl'))
+
     def __load_store(self):
         from langchain_community.vectorstores.faiss import FAISS
-        if not hasattr(self, 'store') or not self.store:
+        loaded = hasattr(self, 'store') and self.store
+        version = self.__saved_version() if self.read_only or not loaded else self.loaded_version
+
+        # save_local writes the index then the docstore, only reload once both are newer
+        if loaded and version != self.loaded_version and version[1] >= version[0] > self.loaded_version[0]:
+            try:
+                store = FAISS.load_local(
+                    folder_path=self.store_directory,
+                    embeddings=self.embeddings(),
+                    index_name=self.index_name,
+                    allow_dangerous_deserialization=True,
+                )
+                store.override_relevance_score_fn = self.__score_normalizer
+                set_search_params(store.index, nprobe=self.nprobe, ef_search=self.ef_search)
+                self.store, self.loaded_version = store, version
+            except Exception as ex:
+                logging.debug(f'VectorStore.__load_store() keeping the loaded index, reload failed with: {ex}')
+
+        if not loaded:
+            # the docstore is a pickle this server wrote into its own index directory
             self.store = FAISS.load_local(
                 folder_path=self.store_directory,
                 embeddings=self.embeddings(),
-                index_name=self.index_name
+                index_name=self.index_name,
+                allow_dangerous_deserialization=True,
             )
             self.store.override_relevance_score_fn = self.__score_normalizer
+            set_search_params(self.store.index, nprobe=self.nprobe, ef_search=self.ef_search)
+            self.loaded_version = version
         return self.store
 
+    def __check_writable(self):
+        if self.read_only:
+            raise PermissionError(f'VectorStore {self.store_directory} is read only in this worker')
+
     def __score_normalizer(self, val: float) -> float:
         return 1 - 1 / (1 + np.exp(val))
 
+    def split_text(self, text: str, metadata: Optional[dict] = None) -> List[Document]:
+        text_splitter = TokenTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+        return text_splitter.create_documents([text], [metadata] if metadata else None)
+
+    def add_documents(
+        self,
+        documents: List[Document],
+        save: bool = True,
+    ):
+        if not documents:
+            return
+        self.__check_writable()
+
+        # embed the whole batch in one call, outside the lock
+        texts = [d.page_content for d in documents]
+        vectors = self.embeddings().embed_documents(texts)
+
+        with self.lock:
+            self.__load_store().add_embeddings(list(zip(texts, vectors)), metadatas=[d.metadata for d in documents])
+            if save:
+                self.save()
+
+    def save(self):
+        self.__check_writable()
+        with self.lock:
+            self.__load_store().save_local(folder_path=self.store_directory, index_name=self.index_name)
+            self.loaded_version = self.__saved_version()
+
+    def rebuild_index(
+        self,
+        index_type: str,
+        nlist: int = 4096,
+        hnsw_m: int = 32,
+        pq_m: int = 16,
+    ) -> Dict[str, Any]:
+        """
+        Offline rebuild of the document index as index_type. Vectors are read back out of the
+        current index (lossy if it is ivfpq) rather than re-embedded, and the docstore mapping
+        is kept as is.
+        """
+        self.__check_writable()
+        with self.lock:
+            store = self.__load_store()
+            previous = type(store.index).__name__
+            vectors = index_vectors(store.index)
+
+            logging.debug(f'VectorStore.rebuild_index() building {index_type} over {len(vectors)} vectors')
+            store.index = build_faiss_index(index_type, vectors, nlist=nlist, hnsw_m=hnsw_m, pq_m=pq_m)
+            set_search_params(store.index, nprobe=self.nprobe, ef_search=self.ef_search)
+            self.save()
+
+            return {
+                'previous': previous,
+                'index': type(store.index).__name__,
+                'vectors': int(store.index.ntotal),
+            }
+
     def ingest_documents(
         self,
         documents: List[Document],
     ):
-        self.__load_store().add_documents(documents)
-        self.__load_store().save_local(folder_path=self.store_directory, index_name=self.index_name)
+        self.add_documents(documents)
 
     def ingest_text(self, text: str, metadata: Optional[dict] = None):
-        documents = []
-
-        with tempfile.NamedTemporaryFile(suffix='.txt', mode='w', delete=True) as t:
-            t.write(text)
-            t.seek(0)
-            text_loader = TextLoader(t.name)
-            data = text_loader.load()
-            documents = text_loader.load_and_split()
-
-        if metadata:
-            for d in documents:
-                d.metadata = metadata
+        self.add_documents(self.split_text(text, metadata))
 
-        text_splitter = TokenTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
-        split_texts = text_splitter.split_documents(documents)
-        self.__load_store().add_documents(split_texts)
-        self.__load_store().save_local(folder_path=self.store_directory, index_name=self.index_name)
+    def __empty(self) -> bool:
+        # a read only worker started before the writer saved its first index
+        return self.read_only and not getattr(self, 'store', None) and self.__saved_version() == (0.0, 0.0)
 
     def search_document(self, query: str, max_results: int = 4) -> List[Document]:
-        documents = self.__load_store().similarity_search_with_relevance_scores(query, k=max_results)
+        if self.__empty():
+            return []
+        with self.lock:
+            documents = self.__load_store().similarity_search_with_relevance_scores(query, k=max_results)
         for doc, score in documents:
             doc.metadata['score'] = score
         return [doc for doc, _ in documents if doc.page_content]
 
     def search(self, query: str, max_results: int = 4) -> List[str]:
-        result = self.__load_store().similarity_search(query, k=max_results)
+        if self.__empty():
+            return []
+        with self.lock:
+            result = self.__load_store().similarity_search(query, k=max_results)
         return [f'{self.__metadata_str(a)} {a.page_content}' for a in result if a.page_content]
 
     def chunk(
@@ -127,8 +305,6 @@ class VectorStore():
         max_tokens: int = 0,
         splitter: Optional[TextSplitter] = None,
     ) -> List[Tuple[str, float]]:
-        from langchain_community.vectorstores.faiss import FAISS
-
         if max_tokens == 0:
             raise ValueError('max_tokens must be greater than 0')
 
@@ -145,16 +321,39 @@ class VectorStore():
 
         split_texts = text_splitter.split_text(content)
 
-        token_chunk_cost = await token_calculator(split_texts[0])
+        # the loop below counts each chunk (and its half) more than once
+        token_counts: Dict[str, int] = {}
 
-        logging.debug(f'VectorStore.chunk_and_rank document length: {len(content)} split_texts: {len(split_texts)}, token_chunk_cost: {token_chunk_cost}, max_tokens: {max_tokens}')  # noqa
-        chunk_faiss = FAISS.from_texts(split_texts, self.embeddings())
-        chunk_faiss.override_relevance_score_fn = self.__score_normalizer
+        async def count(s: str) -> int:
+            if s not in token_counts:
+                token_counts[s] = await token_calculator(s)
+            return token_counts[s]
 
-        chunk_k = math.floor(max_tokens / token_chunk_cost)
-        result = chunk_faiss.similarity_search_with_relevance_scores(query, k=chunk_k * 5)
+        token_chunk_cost = await count(split_texts[0])
+
+        logging.debug(f'VectorStore.chunk_and_rank document length: {len(content)} split_texts: {len(split_texts)}, token_chunk_cost: {token_chunk_cost}, max_tokens: {max_tokens}')  # noqa
 
-        total_tokens = await token_calculator(query)
+        # embeddings of chunks seen before come from the on disk cache, so ranking repeated
+        # content is a single matrix-vector product
+        chunk_vectors = self.embedding_cache().embed(split_texts, self.embeddings().embed_documents)
+        query_vector = self.embedding_cache().embed(
+            [query],
+            lambda texts: [self.embeddings().embed_query(texts[0])],
+            namespace='query'
+        )[0]
+
+        chunk_k = min(math.floor(max_tokens / token_chunk_cost) * 5, len(split_texts))
+        similarities = chunk_vectors @ query_vector
+        top_k = np.argpartition(-similarities, chunk_k - 1)[:chunk_k] if chunk_k > 0 else np.array([], dtype=int)
+        top_k = top_k[np.argsort(-similarities[top_k])]
+
+        # embeddings are normalized, so the squared L2 distance FAISS reported is 2 - 2 * cosine
+        result = [
+            (Document(page_content=split_texts[i]), self.__score_normalizer(float(2 - 2 * similarities[i])))
+            for i in top_k
+        ]
+
+        total_tokens = await count(query)
         return_results = []
 
         def half_str(s):
@@ -162,15 +361,15 @@ class VectorStore():
             return s[:mid]
 
         for doc, rank in result:
-            if total_tokens + await token_calculator(doc.page_content) < max_tokens:
+            if total_tokens + await count(doc.page_content) < max_tokens:
                 return_results.append((self.__document_str(doc), rank))
-                total_tokens += await token_calculator(self.__document_str(doc))
+                total_tokens += await count(self.__document_str(doc))
             elif (
                 half_str(doc.page_content)
-                and total_tokens + await token_calculator(half_str(doc.page_content)) < max_tokens
+                and total_tokens + await count(half_str(doc.page_content)) < max_tokens
             ):
                 return_results.append((half_str(self.__document_str(doc))[0], rank))
-                total_tokens += await token_calculator(half_str(self.__document_str(doc)))
+                total_tokens += await count(half_str(self.__document_str(doc)))
             else:
                 break
 
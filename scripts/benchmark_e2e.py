@@ -0,0 +1,435 @@
+import asyncio
+import datetime as dt
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from importlib import resources
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import click
+import httpx
+import numpy as np
+import psutil
+import yaml
+
+from llmvm.common import stream_wire
+from llmvm.common.objects import Content, MessageModel, SessionThread, User
+
+# end to end benchmark of the llmvm server against scripts/stand_in_provider.py, so the numbers
+# are llmvm's own overhead rather than provider latency. starts the stand-in and a server with a
+# throwaway config and cache directories, drives /v1/tools/completions, /download, /ingest and
+# /search at the given concurrency, and reports p50/p99 latency, server cpu per request, bytes
+# on the wire and server memory growth. results are saved as json to compare across commits.
+# python scripts/benchmark_e2e.py --executor anthropic --requests 32 --concurrency 8
+# python scripts/benchmark_e2e.py --workloads tools --turns 4 --ttft 0 --tokens-per-second 0
+# python scripts/benchmark_e2e.py --compare e2e-1a2b3c4.json
+
+WORKLOADS = ['tools', 'download', 'ingest', 'search']
+SCRIPTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIRECTORY = os.path.dirname(SCRIPTS_DIRECTORY)
+
+SEARCH_QUERIES = [
+    'attention is all you need', 'scaling laws for neural language models', 'napoleon invades russia',
+    'transformer encoder decoder', 'compute optimal model size', 'pierre bezukhov', 'multi-head attention',
+]
+
+
+class ServerMonitor():
+    """
+    CPU seconds and resident memory of the server process and its children (pdf and ocr
+    workers), with peak memory sampled in the background.
+    """
+    def __init__(self, pid: int):
+        self.process = psutil.Process(pid)
+        self.peak_rss = 0
+        self.sampling = False
+
+    def cpu_seconds(self) -> float:
+        times = self.process.cpu_times()
+        total = times.user + times.system + times.children_user + times.children_system
+        for child in self.process.children(recursive=True):
+            try:
+                child_times = child.cpu_times()
+                total += child_times.user + child_times.system
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    def rss(self) -> int:
+        total = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    async def sample(self, interval: float = 0.05) -> None:
+        self.sampling = True
+        while self.sampling:
+            self.peak_rss = max(self.peak_rss, self.rss())
+            await asyncio.sleep(interval)
+
+
+class Sample():
+    def __init__(self):
+        self.latency = 0.0
+        self.first_byte = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.error: Optional[str] = None
+        self.result: Any = None
+
+
+async def timed_request(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    decode: bool = False,
+    **kwargs,
+) -> Sample:
+    sample = Sample()
+    decoder = stream_wire.StreamDecoder() if decode else None
+    start = time.perf_counter()
+    try:
+        async with client.stream(method, url, **kwargs) as response:
+            sample.bytes_sent = int(response.request.headers.get('content-length', 0))
+            body = bytearray()
+            async for chunk in response.aiter_raw():
+                if not sample.bytes_received:
+                    sample.first_byte = time.perf_counter() - start
+                sample.bytes_received += len(chunk)
+                if decoder:
+                    # the last object frame is the thread
+                    frames = [frame for frame in decoder.feed(chunk) if isinstance(frame, dict)]
+                    sample.result = frames[-1] if frames else sample.result
+                else:
+                    body += chunk
+            if response.status_code >= 400:
+                sample.error = f'{response.status_code}: {bytes(body[:200])!r}'
+    except httpx.HTTPError as ex:
+        sample.error = f'{type(ex).__name__}: {ex}'
+    sample.latency = time.perf_counter() - start
+    return sample
+
+
+async def tools_session(client: httpx.AsyncClient, server: str, session: int, turns: int) -> List[Sample]:
+    thread = SessionThread(current_mode='tool')
+    samples = []
+    for turn in range(turns):
+        query = f'session {session} turn {turn}: what is the sum of the squares of the first 10000 integers?'
+        thread.messages.append(MessageModel.from_message(User(Content(query))))
+        sample = await timed_request(
+            client,
+            'POST',
+            f'{server}/v1/tools/completions',
+            decode=True,
+            json=thread.model_dump(),
+            headers={'Accept': stream_wire.accept_header()},
+        )
+        samples.append(sample)
+        if sample.error or not sample.result:
+            sample.error = sample.error or 'no thread in response'
+            break
+        thread = SessionThread(**sample.result)
+    return samples
+
+
+async def run_workload(
+    requests: int,
+    concurrency: int,
+    request: Callable[[int], Awaitable[List[Sample]]],
+    monitor: ServerMonitor,
+    provider: str,
+    client: httpx.AsyncClient,
+) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(i: int) -> List[Sample]:
+        async with semaphore:
+            return await request(i)
+
+    provider_before = (await client.get(f'{provider}/stats')).json()
+    rss_before = monitor.rss()
+    cpu_before = monitor.cpu_seconds()
+    monitor.peak_rss = rss_before
+    sampler = asyncio.create_task(monitor.sample())
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[bounded(i) for i in range(requests)])
+    elapsed = time.perf_counter() - start
+
+    monitor.sampling = False
+    await sampler
+    cpu = monitor.cpu_seconds() - cpu_before
+    rss_after = monitor.rss()
+    provider_after = (await client.get(f'{provider}/stats')).json()
+
+    samples = [sample for samples in results for sample in samples]
+    ok = [sample for sample in samples if not sample.error]
+    latencies = np.array([sample.latency for sample in ok]) if ok else np.zeros(1)
+    first_bytes = np.array([sample.first_byte for sample in ok]) if ok else np.zeros(1)
+    errors = [sample.error for sample in samples if sample.error]
+
+    return {
+        'requests': len(samples),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'elapsed_seconds': elapsed,
+        'requests_per_second': len(ok) / elapsed if elapsed > 0 else 0.0,
+        'latency_p50': float(np.quantile(latencies, 0.5)),
+        'latency_p99': float(np.quantile(latencies, 0.99)),
+        'latency_mean': float(latencies.mean()),
+        'first_byte_p50': float(np.quantile(first_bytes, 0.5)),
+        'first_byte_p99': float(np.quantile(first_bytes, 0.99)),
+        'server_cpu_seconds': cpu,
+        'server_cpu_per_request': cpu / max(len(samples), 1),
+        'bytes_sent': sum(sample.bytes_sent for sample in samples),
+        'bytes_received': sum(sample.bytes_received for sample in samples),
+        'provider_bytes_in': provider_after['bytes_in'] - provider_before['bytes_in'],
+        'provider_bytes_out': provider_after['bytes_out'] - provider_before['bytes_out'],
+        'provider_requests': sum(provider_after['requests'].values()) - sum(provider_before['requests'].values()),
+        'rss_before': rss_before,
+        'rss_after': rss_after,
+        'rss_peak': monitor.peak_rss,
+        'rss_growth': rss_after - rss_before,
+    }
+
+
+def write_config(directory: str, executor: str, provider: str, port: int) -> str:
+    with open(str(resources.files('llmvm') / 'config.yaml'), 'r') as f:
+        config = yaml.safe_load(f)
+
+    for key in ['cache_directory', 'cdn_directory', 'log_directory', 'vector_store_index_directory']:
+        config[key] = os.path.join(directory, key.replace('_directory', ''))
+        os.makedirs(config[key], exist_ok=True)
+
+    config['executor'] = executor
+    config['server_host'] = '127.0.0.1'
+    config['server_port'] = port
+    config['anthropic_api_base'] = provider
+    config['openai_api_base'] = f'{provider}/v1'
+    # every turn has to reach the provider
+    config['response_cache'] = False
+
+    path = os.path.join(directory, 'config.yaml')
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return path
+
+
+async def wait_for(url: str, process: subprocess.Popen, timeout: float) -> None:
+    deadline = time.time() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.time() < deadline:
+            if process.poll() is not None:
+                raise click.ClickException(f'{url} exited with {process.returncode} before becoming healthy')
+            try:
+                if (await client.get(url, timeout=1.0)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.25)
+    raise click.ClickException(f'{url} was not healthy after {timeout}s')
+
+
+def git_commit() -> Tuple[str, bool]:
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPOSITORY_DIRECTORY, text=True).strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPOSITORY_DIRECTORY, text=True).strip())  # noqa E501
+        return commit, dirty
+    except (subprocess.CalledProcessError, OSError):
+        return '', False
+
+
+def compare(previous: Dict[str, Any], current: Dict[str, Any]) -> None:
+    print(f'compared with {previous.get("commit", "")[:10]} from {previous.get("timestamp", "")}')
+    metrics = ['latency_p50', 'latency_p99', 'first_byte_p50', 'server_cpu_per_request', 'bytes_received', 'rss_growth']
+    for workload, result in current['workloads'].items():
+        before = previous.get('workloads', {}).get(workload)
+        if not before:
+            continue
+        print(f'  {workload}')
+        for metric in metrics:
+            old, new = before.get(metric, 0), result.get(metric, 0)
+            change = f'{(new - old) / old:+.1%}' if old else '-'
+            print(f'    {metric:<24} {old:>14.4f} {new:>14.4f} {change:>8}')
+
+
+async def benchmark(
+    workloads: List[str],
+    server: str,
+    provider: str,
+    monitor: ServerMonitor,
+    requests: int,
+    concurrency: int,
+    turns: int,
+    documents: List[str],
+    ingest_bytes: int,
+) -> Dict[str, Any]:
+    with open(os.path.join(REPOSITORY_DIRECTORY, 'docs', 'war_and_peace.txt'), 'r') as f:
+        corpus = f.read()
+
+    results = {}
+    async with httpx.AsyncClient(timeout=httpx.Timeout(600.0)) as client:
+        async def tools(i: int) -> List[Sample]:
+            return await tools_session(client, server, i, turns)
+
+        async def download(i: int) -> List[Sample]:
+            return [await timed_request(
+                client,
+                'POST',
+                f'{server}/download',
+                decode=True,
+                json={'id': 0, 'url': f'{provider}/docs/{documents[i % len(documents)]}'},
+                headers={'Accept': stream_wire.accept_header()},
+            )]
+
+        async def ingest(i: int) -> List[Sample]:
+            start = (i * ingest_bytes) % max(len(corpus) - ingest_bytes, 1)
+            return [await timed_request(
+                client,
+                'POST',
+                f'{server}/ingest',
+                files={'file': (f'benchmark-{i}.txt', corpus[start:start + ingest_bytes].encode('utf-8'), 'text/plain')},
+            )]
+
+        async def search(i: int) -> List[Sample]:
+            return [await timed_request(client, 'GET', f'{server}/search/{SEARCH_QUERIES[i % len(SEARCH_QUERIES)]}')]
+
+        handlers = {'tools': tools, 'download': download, 'ingest': ingest, 'search': search}
+        for workload in workloads:
+            print(f'running {workload}: {requests} requests at concurrency {concurrency}')
+            results[workload] = await run_workload(requests, concurrency, handlers[workload], monitor, provider, client)
+            if workload == 'tools':
+                results[workload]['turns_per_session'] = turns
+    return results
+
+
+@click.command()
+@click.option('--executor', '-e', default='anthropic', type=click.Choice(['anthropic', 'openai']))
+@click.option('--workloads', '-w', default=','.join(WORKLOADS), help=f'comma separated, from {",".join(WORKLOADS)}')
+@click.option('--requests', '-r', default=16, help='requests per workload (sessions for tools)')
+@click.option('--concurrency', '-c', default=4)
+@click.option('--turns', '-n', default=2, help='tool turns per session')
+@click.option('--ttft', default=0.3, help='stand-in seconds before the first token')
+@click.option('--tokens-per-second', '-t', default=80.0, help='stand-in streaming rate, 0 for as fast as possible')
+@click.option('--script', '-s', default='', help='stand-in response script, see scripts/stand_in_provider.py')
+@click.option('--documents', default='attention.pdf,turnbull-speech.pdf', help='docs/ files to /download')
+@click.option('--ingest-bytes', default=65536, help='bytes of war_and_peace.txt per /ingest')
+@click.option('--server-port', default=8911)
+@click.option('--provider-port', default=8912)
+@click.option('--startup-timeout', default=180.0, help='seconds to wait for the server to load')
+@click.option('--output', '-o', default='', help='results json, defaults to e2e-<commit>.json')
+@click.option('--compare', 'compare_file', default='', help='earlier results json to compare against')
+@click.option('--keep', is_flag=True, default=False, help="keep the server's config, cache and logs")
+def main(
+    executor: str,
+    workloads: str,
+    requests: int,
+    concurrency: int,
+    turns: int,
+    ttft: float,
+    tokens_per_second: float,
+    script: str,
+    documents: str,
+    ingest_bytes: int,
+    server_port: int,
+    provider_port: int,
+    startup_timeout: float,
+    output: str,
+    compare_file: str,
+    keep: bool,
+):
+    workload_list = [w.strip() for w in workloads.split(',') if w.strip()]
+    for workload in workload_list:
+        if workload not in WORKLOADS:
+            raise click.UsageError(f'unknown workload {workload}')
+
+    server = f'http://127.0.0.1:{server_port}'
+    provider = f'http://127.0.0.1:{provider_port}'
+    directory = tempfile.mkdtemp(prefix='llmvm-e2e-')
+    config_file = write_config(directory, executor, provider, server_port)
+
+    provider_command = [
+        sys.executable, os.path.join(SCRIPTS_DIRECTORY, 'stand_in_provider.py'),
+        '--port', str(provider_port), '--ttft', str(ttft), '--tokens-per-second', str(tokens_per_second),
+        '--docs', os.path.join(REPOSITORY_DIRECTORY, 'docs'),
+    ] + (['--script', script] if script else [])
+
+    env = {
+        **os.environ,
+        'LLMVM_CONFIG': config_file,
+        # the stand-in doesn't check keys, and real ones shouldn't be sent anywhere
+        'ANTHROPIC_API_KEY': 'stand-in',
+        'OPENAI_API_KEY': 'stand-in',
+        'LLMVM_EXECUTOR': executor,
+    }
+    log = open(os.path.join(directory, 'server.log'), 'w')
+    stand_in = subprocess.Popen(provider_command, cwd=REPOSITORY_DIRECTORY)
+    llmvm_server = subprocess.Popen([sys.executable, '-m', 'llmvm.server'], env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    try:
+        asyncio.run(wait_for(f'{provider}/health', stand_in, 30.0))
+        asyncio.run(wait_for(f'{server}/health', llmvm_server, startup_timeout))
+
+        monitor = ServerMonitor(llmvm_server.pid)
+        rss_start = monitor.rss()
+        results = asyncio.run(benchmark(
+            workload_list, server, provider, monitor, requests, concurrency, turns,
+            [d.strip() for d in documents.split(',') if d.strip()], ingest_bytes,
+        ))
+        commit, dirty = git_commit()
+        report = {
+            'commit': commit,
+            'dirty': dirty,
+            'timestamp': dt.datetime.now().isoformat(timespec='seconds'),
+            'settings': {
+                'executor': executor, 'requests': requests, 'concurrency': concurrency, 'turns': turns, 'ttft': ttft,
+                'tokens_per_second': tokens_per_second, 'script': script, 'documents': documents,
+                'ingest_bytes': ingest_bytes, 'cpu_count': os.cpu_count(), 'python': sys.version.split()[0],
+            },
+            'server_rss_start': rss_start,
+            'server_rss_end': monitor.rss(),
+            'workloads': results,
+        }
+    finally:
+        llmvm_server.terminate()
+        stand_in.terminate()
+        for process in [llmvm_server, stand_in]:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        log.close()
+
+    print()
+    print(f'{"workload":<10} {"reqs":>5} {"errs":>5} {"p50 s":>8} {"p99 s":>8} {"ttfb p50":>9} {"cpu/req s":>10} {"bytes rx":>10} {"rss growth MB":>14}')  # noqa E501
+    for workload, result in results.items():
+        print(
+            f'{workload:<10} {result["requests"]:>5} {result["errors"]:>5} {result["latency_p50"]:>8.3f} {result["latency_p99"]:>8.3f} '
+            f'{result["first_byte_p50"]:>9.3f} {result["server_cpu_per_request"]:>10.4f} {result["bytes_received"]:>10} '
+            f'{result["rss_growth"] / 1024 / 1024:>14.1f}'
+        )
+        if result['first_error']:
+            print(f'  first error: {result["first_error"]}')
+
+    output = output or f'e2e-{report["commit"][:7] or "unknown"}.json'
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nsaved {output}' + (f', server config, cache and log in {directory}' if keep else ''))
+
+    if not keep:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if compare_file:
+        with open(compare_file, 'r') as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
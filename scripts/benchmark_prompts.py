@@ -0,0 +1,97 @@
+import timeit
+from importlib import resources
+from typing import Any, Dict
+
+import click
+
+from llmvm.common.prompt_registry import PromptRegistry
+
+# compares the previous read-and-replace prompt population against PromptRegistry rendering
+# python scripts/benchmark_prompts.py --prompt python_continuation_execution.prompt --payload-kb 256
+
+
+def in_between(s, start, end):
+    after_start = s[s.find(start) + len(start):]
+    return after_start[:after_start.find(end)]
+
+
+def legacy_load_and_populate_prompt(
+    prompt_name: str,
+    template: Dict[str, str],
+    append_token: str = '',
+    module: str = 'llmvm.server.prompts.python'
+) -> Dict[str, Any]:
+    # the implementation Helpers.load_and_populate_prompt used before PromptRegistry
+    with open(resources.files(module) / prompt_name, 'r') as f:  # type: ignore
+        prompt_text = f.read()
+
+    prompt: Dict[str, Any] = {
+        'system_message': in_between(prompt_text, '[system_message]', '[user_message]').strip(),
+        'user_message': prompt_text[prompt_text.find('[user_message]') + len('[user_message]'):].strip(),
+    }
+
+    for key, value in template.items():
+        prompt['system_message'] = prompt['system_message'].replace('{{' + key + '}}', value)
+        prompt['user_message'] = prompt['user_message'].replace('{{' + key + '}}', value)
+
+    import datetime  # noqa F401
+    for message_key in ['system_message', 'user_message']:
+        message = prompt[message_key]
+        while '{{' in message and '}}' in message:
+            start = message.find('{{')
+            end = message.find('}}', start)
+            if end == -1:
+                break
+
+            key = message[start + 2:end]
+            replacement = ''
+            if key.startswith('exec('):
+                try:
+                    replacement = str(eval(key[5:-1]))
+                except Exception:
+                    pass
+            else:
+                replacement = key
+            message = message[:start] + replacement + message[end + 2:]
+        prompt[message_key] = message
+
+    prompt['user_message'] += append_token
+    return prompt
+
+
+def registry_load_and_populate_prompt(
+    prompt_name: str,
+    template: Dict[str, str],
+    append_token: str = '',
+    module: str = 'llmvm.server.prompts.python'
+) -> Dict[str, Any]:
+    system_message, user_message = PromptRegistry().get(prompt_name, module).render(template, append_token)
+    return {'system_message': system_message, 'user_message': user_message}
+
+
+@click.command()
+@click.option('--prompt', '-p', default='python_continuation_execution.prompt', help='prompt file to render')
+@click.option('--payload-kb', default=256, help='size of the {{functions}} and {{data}} style payloads in KB')
+@click.option('--number', '-n', default=200, help='renders per timing')
+def main(prompt: str, payload_kb: int, number: int):
+    payload = ('def helper(a: int, b: str) -> str  # does a thing\n' * (payload_kb * 1024 // 50))
+    template = {key: payload for key in PromptRegistry().get(prompt).templates if not key.startswith('exec(')}
+    template.update({
+        'user_token': 'User',
+        'assistant_token': 'Assistant',
+        'user_colon_token': 'User:',
+        'assistant_colon_token': 'Assistant:',
+    })
+
+    legacy = legacy_load_and_populate_prompt(prompt, dict(template))
+    registry = registry_load_and_populate_prompt(prompt, dict(template))
+    same = legacy == registry
+    print(f'prompt: {prompt} placeholders: {len(PromptRegistry().get(prompt).templates)} payload: {payload_kb}KB identical output: {same}')  # noqa E501
+
+    for name, fn in [('legacy', legacy_load_and_populate_prompt), ('registry', registry_load_and_populate_prompt)]:
+        seconds = min(timeit.repeat(lambda: fn(prompt, dict(template)), number=number, repeat=5))
+        print(f'{name:<10} {seconds / number * 1e6:>12.1f} us/render')
+
+
+if __name__ == '__main__':
+    main()
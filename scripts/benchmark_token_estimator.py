@@ -0,0 +1,129 @@
+import os
+import random
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import click
+import numpy as np
+from pdfminer.high_level import extract_text
+
+from llmvm.common.token_estimator import (TokenEstimator, fit, get_token_estimator,
+                                          save_calibration)
+
+# measures TokenEstimator against Anthropic's token counts on random slices of docs/war_and_peace.txt
+# and the pdfs in docs/, and optionally fits and saves a calibration for it (needs ANTHROPIC_API_KEY)
+# python scripts/benchmark_token_estimator.py --samples 200
+# python scripts/benchmark_token_estimator.py --calibrate
+
+
+def load_documents(directory: str) -> Dict[str, str]:
+    documents = {}
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if filename.endswith('.txt'):
+            with open(path, 'r', errors='replace') as f:
+                documents[filename] = f.read()
+        elif filename.endswith('.pdf'):
+            documents[filename] = extract_text(path)
+    return documents
+
+
+def sample_slices(text: str, samples: int, sizes: List[int], rng: random.Random) -> List[str]:
+    slices = []
+    for _ in range(samples):
+        size = min(rng.choice(sizes), len(text))
+        start = rng.randrange(0, max(1, len(text) - size))
+        slices.append(text[start:start + size])
+    return slices
+
+
+def anthropic_counter() -> Optional[Callable[[str], int]]:
+    if not os.environ.get('ANTHROPIC_API_KEY'):
+        return None
+
+    from anthropic import Anthropic
+    client = Anthropic(api_key=os.environ['ANTHROPIC_API_KEY'])
+    # the same count AnthropicExecutor asks for when it needs an exact answer
+    return lambda text: client.count_tokens(text)
+
+
+def timed(func: Callable, *args) -> Tuple[object, float]:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+@click.command()
+@click.option('--directory', '-d', default='docs', help='directory of .txt and .pdf files')
+@click.option('--samples', '-s', default=100, help='slices per document')
+@click.option('--sizes', default='200,2000,20000', help='slice lengths in characters')
+@click.option('--calibrate', is_flag=True, default=False, help='fit coefficients and margin, and save them')
+@click.option('--coverage', default=0.99, help='fraction of counts the calibrated upper bound must cover')
+@click.option('--seed', default=0)
+def main(directory: str, samples: int, sizes: str, calibrate: bool, coverage: float, seed: int):
+    rng = random.Random(seed)
+    size_list = [int(size) for size in sizes.split(',')]
+    documents = load_documents(directory)
+    slices = {name: sample_slices(text, samples, size_list, rng) for name, text in documents.items()}
+    counter = anthropic_counter()
+    estimator = get_token_estimator('anthropic')
+    assert estimator
+
+    if not counter:
+        print('ANTHROPIC_API_KEY is not set, reporting estimator latency only')
+
+    # reference counts
+    actual: Dict[str, np.ndarray] = {}
+    reference_seconds = 0.0
+    if counter:
+        for name, texts in slices.items():
+            counts = []
+            for text in texts:
+                count, seconds = timed(counter, text)
+                counts.append(count)
+                reference_seconds += seconds
+            actual[name] = np.array(counts, dtype=np.float64)
+
+    if calibrate:
+        if not counter:
+            raise click.UsageError('--calibrate needs ANTHROPIC_API_KEY for reference counts')
+
+        # fit on 80% of the slices, report on the rest
+        names = list(slices.keys())
+        features = np.concatenate([TokenEstimator.features(slices[name]) for name in names])
+        counts = np.concatenate([actual[name] for name in names])
+        order = np.random.default_rng(seed).permutation(len(counts))
+        train, test = order[:int(len(order) * 0.8)], order[int(len(order) * 0.8):]
+        coefficients, margin = fit(features[train], counts[train], coverage=coverage)
+        held_out = TokenEstimator(coefficients, margin)
+        upper = np.ceil(np.maximum(features[test] @ held_out.coefficients, 0.0) * (1.0 + margin))
+        print(f'fitted margin {margin:.3f}, held out upper bound coverage {(counts[test] <= upper).mean():.1%}')
+        save_calibration('anthropic', coefficients, margin)
+        estimator = get_token_estimator('anthropic')
+        assert estimator
+
+    estimate_seconds = 0.0
+    print(f'{"document":<24} {"slices":>6} {"chars":>10} {"mean err":>9} {"p95 err":>8} {"covered":>8} {"est us":>8}')
+    for name, texts in slices.items():
+        chars = sum(len(text) for text in texts)
+        estimates, seconds = timed(estimator.estimate_batch, texts)
+        upper = np.ceil(estimates * (1.0 + estimator.margin))  # type: ignore
+        estimate_seconds += seconds
+
+        if counter:
+            relative = np.abs(estimates - actual[name]) / np.maximum(actual[name], 1.0)  # type: ignore
+            print(f'{name:<24} {len(texts):>6} {chars:>10} {relative.mean():>8.1%} {np.quantile(relative, 0.95):>7.1%} '
+                  f'{(actual[name] <= upper).mean():>7.1%} {seconds / len(texts) * 1e6:>8.1f}')
+        else:
+            print(f'{name:<24} {len(texts):>6} {chars:>10} {"-":>9} {"-":>8} {"-":>8} {seconds / len(texts) * 1e6:>8.1f}')
+
+    whole = '\n'.join(documents.values())
+    _, whole_seconds = timed(estimator.estimate, whole)
+    count = sum(len(texts) for texts in slices.values())
+    print(f'estimator: {estimate_seconds / count * 1e6:.1f}us per slice, {len(whole) / whole_seconds / 1e6:.1f}M chars/s on all documents')  # noqa E501
+    if counter:
+        print(f'reference: {reference_seconds / count * 1e6:.1f}us per slice')
+
+
+if __name__ == '__main__':
+    main()
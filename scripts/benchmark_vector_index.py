@@ -0,0 +1,76 @@
+import time
+from typing import List
+
+import click
+import numpy as np
+
+from llmvm.server.vector_store import build_faiss_index, set_search_params
+
+# compares ivf/hnsw/ivfpq against the flat index on a synthetic clustered corpus
+# python scripts/benchmark_vector_index.py --vectors 1000000 --queries 1000
+
+
+def synthetic_corpus(vectors: int, dimension: int, clusters: int, seed: int) -> np.ndarray:
+    # normalized gaussian clusters, roughly the shape of sentence embeddings
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    assignment = rng.integers(0, clusters, size=vectors)
+    data = centers[assignment] + 0.5 * rng.standard_normal((vectors, dimension)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    return data
+
+
+def run(index, queries: np.ndarray, k: int):
+    latencies: List[float] = []
+    ids = np.zeros((len(queries), k), dtype=np.int64)
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, ids[i] = index.search(queries[i:i + 1], k)
+        latencies.append(time.perf_counter() - start)
+    return ids, np.array(latencies) * 1000.0
+
+
+def recall_at_k(ids: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(ids, truth)]))
+
+
+@click.command()
+@click.option('--vectors', '-n', default=200000, help='corpus size')
+@click.option('--dimension', '-d', default=384, help='embedding dimension (all-MiniLM-L6-v2 is 384)')
+@click.option('--queries', '-q', default=1000, help='number of queries')
+@click.option('--k', '-k', default=10, help='recall@k')
+@click.option('--clusters', default=1000, help='synthetic clusters')
+@click.option('--nlist', default=4096, help='ivf centroids')
+@click.option('--hnsw-m', default=32, help='hnsw neighbours per node')
+@click.option('--pq-m', default=16, help='pq sub-quantizers')
+@click.option('--seed', default=42)
+def main(vectors, dimension, queries, k, clusters, nlist, hnsw_m, pq_m, seed):
+    corpus = synthetic_corpus(vectors + queries, dimension, clusters, seed)
+    data, query_vectors = corpus[:vectors], corpus[vectors:]
+
+    print(f'{"index":<8} {"param":<14} {"build_s":>9} {"recall@" + str(k):>10} {"p50_ms":>9} {"p99_ms":>9}')
+
+    start = time.perf_counter()
+    flat = build_faiss_index('flat', data)
+    build = time.perf_counter() - start
+    truth, latencies = run(flat, query_vectors, k)
+    print(f'{"flat":<8} {"-":<14} {build:>9.2f} {1.0:>10.4f} {np.percentile(latencies, 50):>9.3f} {np.percentile(latencies, 99):>9.3f}')  # noqa E501
+
+    sweeps = {
+        'ivf': ('nprobe', [1, 4, 16, 64]),
+        'ivfpq': ('nprobe', [1, 4, 16, 64]),
+        'hnsw': ('efSearch', [16, 64, 256]),
+    }
+    for index_type, (param, values) in sweeps.items():
+        start = time.perf_counter()
+        index = build_faiss_index(index_type, data, nlist=nlist, hnsw_m=hnsw_m, pq_m=pq_m)
+        build = time.perf_counter() - start
+
+        for value in values:
+            set_search_params(index, nprobe=value, ef_search=value)
+            ids, latencies = run(index, query_vectors, k)
+            print(f'{index_type:<8} {param + "=" + str(value):<14} {build:>9.2f} {recall_at_k(ids, truth):>10.4f} {np.percentile(latencies, 50):>9.3f} {np.percentile(latencies, 99):>9.3f}')  # noqa E501
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import asyncio
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import click
+
+from llmvm.common.helpers import write_client_stream
+from llmvm.common.objects import AstNode, Content
+from llmvm.common.runtime_bridge import run_coroutine, run_in_worker
+
+# shows two sessions streaming at the same time while each runs blocking "generated code",
+# using the same worker/bridge path ExecutionController uses for PythonRuntime.run
+# python scripts/concurrent_sessions.py --tokens 10 --block 0.2
+
+
+async def fake_llm_call(session: str, i: int) -> str:
+    # stands in for controller.aexecute_llm_call, which runs on the request's event loop
+    await asyncio.sleep(0.01)
+    return f'{session} result {i}'
+
+
+def blocking_tool(session: str, tokens: int, block: float) -> List[str]:
+    # stands in for PythonRuntime.run: blocking work, llm calls and client stream writes
+    results = []
+    for i in range(tokens):
+        time.sleep(block)
+        results.append(run_coroutine(fake_llm_call(session, i)))
+        write_client_stream(Content(f'{session} token {i}\n'))
+    return results
+
+
+async def run_sessions(sessions: int, tokens: int, block: float) -> Tuple[Dict[str, List[float]], float, float]:
+    # session -> seconds since start that each streamed token arrived
+    received: Dict[str, List[float]] = {}
+    max_lag = 0.0
+    done = False
+
+    async def heartbeat():
+        # how long the event loop goes without being able to run anything else
+        nonlocal max_lag
+        while not done:
+            tick = time.perf_counter()
+            await asyncio.sleep(0.01)
+            max_lag = max(max_lag, time.perf_counter() - tick - 0.01)
+
+    async def session(name: str):
+        received[name] = []
+
+        async def stream_handler(node: AstNode):
+            received[name].append(time.perf_counter() - start)
+
+        await run_in_worker(blocking_tool, name, tokens, block, stream_handler=stream_handler)
+
+    start = time.perf_counter()
+    beat = asyncio.create_task(heartbeat())
+    await asyncio.gather(*[session(f'session-{i}') for i in range(sessions)])
+    done = True
+    await beat
+    return received, time.perf_counter() - start, max_lag
+
+
+@click.command()
+@click.option('--sessions', '-s', default=2, help='concurrent sessions')
+@click.option('--tokens', '-t', default=10, help='tokens streamed per session')
+@click.option('--block', '-b', default=0.2, help='seconds of blocking work before each token')
+def main(sessions: int, tokens: int, block: float):
+    received, elapsed, max_lag = asyncio.run(run_sessions(sessions, tokens, block))
+
+    for name, times in received.items():
+        print(f'{name}: {len(times)} tokens, first at {times[0]:.2f}s, last at {times[-1]:.2f}s')
+
+    serial = sessions * tokens * block
+    # every session has to have streamed something before any session finished
+    overlapping = max(times[0] for times in received.values()) < min(times[-1] for times in received.values())
+    print(f'elapsed: {elapsed:.2f}s (serial would be {serial:.2f}s), max event loop stall: {max_lag * 1000:.1f}ms')
+    print(f'sessions streamed concurrently: {overlapping}')
+
+    if not overlapping or elapsed >= serial:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import json
+import os
+import random
+import time
+from typing import List, Optional, Tuple
+
+import click
+import numpy as np
+from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+
+from llmvm.common.container import Container
+from llmvm.server.query_classifier import QueryClassifier
+
+# replays labelled queries through QueryClassifier the way the server sees them: each query is
+# classified locally, confident answers are scored, everything else "falls back" to the recorded
+# label and is learned. the default dataset is the server's own log of LLM classifier decisions,
+# any jsonl file of {"query": ..., "label": "tool" | "direct"} works.
+# python scripts/evaluate_query_classifier.py --threshold 0.9 --llm-latency 1.2
+
+
+def load_dataset(path: str) -> List[Tuple[str, str]]:
+    examples = []
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                example = json.loads(line)
+                examples.append((example['query'], example['label']))
+    return examples
+
+
+@click.command()
+@click.option('--dataset', '-d', type=str, required=False,
+              help='jsonl of labelled queries, defaults to the server\'s query_classifier/examples.jsonl')
+@click.option('--threshold', '-t', type=float, default=0.9, help='local confidence needed to skip the llm')
+@click.option('--min-examples', '-m', type=int, default=24, help='examples needed before local decisions are used')
+@click.option('--llm-latency', '-l', type=float, default=1.0, help='seconds an llm classification takes, to estimate time saved')
+@click.option('--shuffle/--no-shuffle', default=True, help='replay in random order rather than logged order')
+@click.option('--seed', type=int, default=0)
+def main(
+    dataset: Optional[str],
+    threshold: float,
+    min_examples: int,
+    llm_latency: float,
+    shuffle: bool,
+    seed: int,
+):
+    cache_directory = Container.get_config_variable('cache_directory', 'LLMVM_CACHE_DIRECTORY', default='~/.local/share/llmvm/cache')  # noqa E501
+    dataset = dataset or os.path.join(
+        os.path.expanduser(cache_directory),
+        'query_classifier',
+        'examples.jsonl',
+    )
+    examples = load_dataset(dataset)
+    if shuffle:
+        random.Random(seed).shuffle(examples)
+
+    model = Container.get_config_variable('vector_store_embedding_model', default='all-MiniLM-L6-v2')
+    embeddings = HuggingFaceEmbeddings(
+        model_name=model,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'normalize_embeddings': True}
+    )
+    # nothing is written back, the classifier starts from the seed examples only
+    classifier = QueryClassifier(
+        embed=lambda texts: np.asarray(embeddings.embed_documents(texts), dtype=np.float32),
+        threshold=threshold,
+        min_examples=min_examples,
+    )
+    classifier.load()
+
+    local_correct = 0
+    local_total = 0
+    latencies: List[float] = []
+    confusion = {(gold, predicted): 0 for gold in QueryClassifier.LABELS for predicted in QueryClassifier.LABELS}
+
+    for query, label in examples:
+        start = time.perf_counter()
+        predicted, confidence = classifier.predict(query)
+        latencies.append(time.perf_counter() - start)
+
+        if confidence >= threshold:
+            local_total += 1
+            local_correct += int(predicted == label)
+            confusion[(label, predicted)] += 1
+        else:
+            classifier.learn(query, label)
+
+    total = len(examples)
+    local_ms = np.array(latencies) * 1000.0
+    saved = local_total * llm_latency - sum(latencies)
+    print(f'dataset: {dataset} ({total} queries, embedding model {model})')
+    print(f'answered locally: {local_total}/{total} ({local_total / max(total, 1):.1%}), fell back to llm: {total - local_total}')  # noqa E501
+    print(f'local accuracy: {local_correct / max(local_total, 1):.1%}, overall accuracy (llm taken as correct): {(local_correct + total - local_total) / max(total, 1):.1%}')  # noqa E501
+    print(f'local latency: mean {local_ms.mean():.1f}ms, p95 {np.percentile(local_ms, 95):.1f}ms')
+    print(f'estimated llm time saved: {saved:.1f}s ({saved / max(total, 1) * 1000:.0f}ms per query at {llm_latency:.2f}s per llm call)')  # noqa E501
+    for (gold, predicted), count in confusion.items():
+        print(f'  {gold} -> {predicted}: {count}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import click
+
+from llmvm.common.container import Container
+from llmvm.server.vector_store import INDEX_TYPES, VectorStore
+
+# offline: stop the server first, it holds its own copy of the index in memory
+# python scripts/rebuild_index.py --index-type hnsw
+
+
+@click.command()
+@click.option('--index-type', '-t', type=click.Choice(INDEX_TYPES), required=False,
+              help='index type to rebuild as, defaults to vector_store_index_type in config.yaml')
+@click.option('--nlist', type=int, required=False, help='ivf centroids, defaults to vector_store_ivf_nlist')
+@click.option('--hnsw-m', type=int, required=False, help='hnsw neighbours per node, defaults to vector_store_hnsw_m')
+@click.option('--pq-m', type=int, required=False, help='pq sub-quantizers, defaults to vector_store_pq_m')
+def main(index_type, nlist, hnsw_m, pq_m):
+    vector_store = VectorStore(
+        store_directory=Container().get('vector_store_index_directory'),
+        index_name='index',
+        embedding_model=Container().get('vector_store_embedding_model'),
+        chunk_size=int(Container().get('vector_store_chunk_size')),
+        chunk_overlap=10,
+    )
+
+    result = vector_store.rebuild_index(
+        index_type=index_type or Container.get_config_variable('vector_store_index_type', 'LLMVM_VECTOR_STORE_INDEX_TYPE', default='flat'),  # noqa E501
+        nlist=nlist or int(Container.get_config_variable('vector_store_ivf_nlist', 'LLMVM_VECTOR_STORE_IVF_NLIST', default=4096)),
+        hnsw_m=hnsw_m or int(Container.get_config_variable('vector_store_hnsw_m', 'LLMVM_VECTOR_STORE_HNSW_M', default=32)),
+        pq_m=pq_m or int(Container.get_config_variable('vector_store_pq_m', 'LLMVM_VECTOR_STORE_PQ_M', default=16)),
+    )
+    print(f"rebuilt {result['previous']} as {result['index']} with {result['vectors']} vectors")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import click
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+
+# a local stand-in for the Anthropic Messages and OpenAI chat completions streaming APIs, with
+# configurable time to first token, tokens per second and scripted responses. point
+# anthropic_api_base or openai_api_base at it to measure llmvm without provider latency.
+# it also serves --docs at /docs/{filename} for /download, and request and byte counts at /stats.
+# python scripts/stand_in_provider.py --port 8100 --ttft 0.3 --tokens-per-second 80
+# python scripts/stand_in_provider.py --script responses.json
+
+# responses are picked by the first 'match' regex found in the last message, and the text is cut
+# at the first of the request's stop sequences, the way the real APIs do. the default script runs
+# one code block and then answers.
+DEFAULT_SCRIPT: List[Dict[str, str]] = [
+    {
+        'match': r'<code_result>',
+        'text': 'The code ran and the result is above.\n</complete>',
+    },
+    {
+        'match': r'',
+        'text': (
+            "I'll compute that with some Python.\n\n"
+            '<code>\n'
+            'squares = [i * i for i in range(10000)]\n'
+            'table = {str(i): square for i, square in enumerate(squares[:100])}\n'
+            'answer(sum(squares))\n'
+            '</code>\n'
+        ),
+    },
+]
+
+
+class Script():
+    def __init__(self, responses: List[Dict[str, str]]):
+        self.responses = [(re.compile(r['match']), r['text']) for r in responses]
+
+    def respond(self, last_message: str, stop_sequences: List[str]) -> Tuple[str, Optional[str]]:
+        """
+        Returns (text, stop sequence that cut it or None).
+        """
+        text = next((text for pattern, text in self.responses if pattern.search(last_message)), '')
+        stops = [(text.find(stop), stop) for stop in stop_sequences if stop and stop in text]
+        if stops:
+            index, stop = min(stops)
+            return text[:index], stop
+        return text, None
+
+
+def tokens(text: str) -> List[str]:
+    # words with their trailing whitespace are close enough to tokens for pacing
+    return re.findall(r'\S+\s*|\s+', text)
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    content = message.get('content', '')
+    if isinstance(content, str):
+        return content
+    return '\n'.join(block.get('text', '') for block in content if isinstance(block, dict))
+
+
+def sse(data: Dict[str, Any], event: Optional[str] = None) -> bytes:
+    prefix = f'event: {event}\n' if event else ''
+    return f'{prefix}data: {json.dumps(data)}\n\n'.encode('utf-8')
+
+
+class Stats():
+    def __init__(self):
+        self.requests: Dict[str, int] = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'requests': dict(self.requests), 'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out}
+
+
+def create_app(script: Script, ttft: float, tokens_per_second: float, docs: str) -> FastAPI:
+    app = FastAPI()
+    stats = Stats()
+
+    async def paced(pieces: List[str]) -> AsyncIterator[str]:
+        await asyncio.sleep(ttft)
+        start = time.perf_counter()
+        for i, piece in enumerate(pieces):
+            if tokens_per_second > 0:
+                # sleep against the schedule rather than per token, so pacing doesn't drift
+                delay = start + i / tokens_per_second - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield piece
+
+    async def counted(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        async for chunk in stream:
+            stats.bytes_out += len(chunk)
+            yield chunk
+
+    async def read(request: Request, endpoint: str) -> Dict[str, Any]:
+        body = await request.body()
+        stats.bytes_in += len(body)
+        stats.requests[endpoint] = stats.requests.get(endpoint, 0) + 1
+        return json.loads(body)
+
+    @app.post('/v1/messages')
+    async def anthropic_messages(request: Request):
+        body = await read(request, 'anthropic')
+        messages = body.get('messages', [])
+        text, stop = script.respond(message_text(messages[-1]) if messages else '', body.get('stop_sequences') or [])
+        pieces = tokens(text)
+        input_tokens = sum(len(message_text(m)) for m in messages) // 4
+        message_id = f'msg_{uuid.uuid4().hex[:24]}'
+        stop_reason = 'stop_sequence' if stop else 'end_turn'
+
+        if not body.get('stream'):
+            return JSONResponse({
+                'id': message_id, 'type': 'message', 'role': 'assistant', 'model': body.get('model', ''),
+                'content': [{'type': 'text', 'text': text}], 'stop_reason': stop_reason, 'stop_sequence': stop,
+                'usage': {'input_tokens': input_tokens, 'output_tokens': len(pieces)},
+            })
+
+        async def events() -> AsyncIterator[bytes]:
+            yield sse({'type': 'message_start', 'message': {
+                'id': message_id, 'type': 'message', 'role': 'assistant', 'model': body.get('model', ''),
+                'content': [], 'stop_reason': None, 'stop_sequence': None,
+                'usage': {'input_tokens': input_tokens, 'output_tokens': 1},
+            }}, 'message_start')
+            yield sse({'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}}, 'content_block_start')  # noqa E501
+            async for piece in paced(pieces):
+                yield sse({'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': piece}}, 'content_block_delta')  # noqa E501
+            yield sse({'type': 'content_block_stop', 'index': 0}, 'content_block_stop')
+            yield sse({
+                'type': 'message_delta',
+                'delta': {'stop_reason': stop_reason, 'stop_sequence': stop},
+                'usage': {'output_tokens': len(pieces)},
+            }, 'message_delta')
+            yield sse({'type': 'message_stop'}, 'message_stop')
+
+        return StreamingResponse(counted(events()), media_type='text/event-stream')
+
+    @app.post('/v1/messages/count_tokens')
+    async def anthropic_count_tokens(request: Request):
+        body = await read(request, 'anthropic_count_tokens')
+        return JSONResponse({'input_tokens': sum(len(message_text(m)) for m in body.get('messages', [])) // 4})
+
+    @app.post('/v1/chat/completions')
+    async def openai_chat_completions(request: Request):
+        body = await read(request, 'openai')
+        messages = body.get('messages', [])
+        stop_sequences = body.get('stop') or []
+        if isinstance(stop_sequences, str):
+            stop_sequences = [stop_sequences]
+        text, _ = script.respond(message_text(messages[-1]) if messages else '', stop_sequences)
+        pieces = tokens(text)
+        completion_id = f'chatcmpl-{uuid.uuid4().hex[:24]}'
+        created = int(time.time())
+        model = body.get('model', '')
+
+        if not body.get('stream'):
+            return JSONResponse({
+                'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': sum(len(message_text(m)) for m in messages) // 4, 'completion_tokens': len(pieces),
+                          'total_tokens': 0},
+            })
+
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> bytes:
+            return sse({
+                'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            })
+
+        async def events() -> AsyncIterator[bytes]:
+            first = True
+            async for piece in paced(pieces):
+                yield chunk({'role': 'assistant', 'content': piece} if first else {'content': piece})
+                first = False
+            yield chunk({}, 'stop')
+            yield b'data: [DONE]\n\n'
+
+        return StreamingResponse(counted(events()), media_type='text/event-stream')
+
+    @app.get('/docs/{filename}')
+    async def document(filename: str):
+        path = os.path.join(docs, os.path.basename(filename))
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail=f'{filename} not found')
+        stats.requests['docs'] = stats.requests.get('docs', 0) + 1
+        stats.bytes_out += os.path.getsize(path)
+        return FileResponse(path)
+
+    @app.get('/stats')
+    async def get_stats():
+        return stats.to_dict()
+
+    @app.get('/health')
+    async def health():
+        return {'status': 'ok'}
+
+    return app
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', '-p', default=8100)
+@click.option('--ttft', default=0.3, help='seconds before the first token')
+@click.option('--tokens-per-second', '-t', default=80.0, help='streaming rate, 0 for as fast as possible')
+@click.option('--script', '-s', default='', help='json list of {"match": regex, "text": response}')
+@click.option('--docs', '-d', default='docs', help='directory served at /docs/{filename}')
+def main(host: str, port: int, ttft: float, tokens_per_second: float, script: str, docs: str):
+    responses = DEFAULT_SCRIPT
+    if script:
+        with open(script, 'r') as f:
+            responses = json.load(f)
+
+    app = create_app(Script(responses), ttft, tokens_per_second, os.path.abspath(docs))
+    uvicorn.run(app, host=host, port=port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
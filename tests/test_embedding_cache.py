@@ -0,0 +1,111 @@
+import os
+import sys
+import tempfile
+from typing import List
+
+import numpy as np
+
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+from llmvm.server.embedding_cache import EmbeddingCache
+
+
+class FakeEmbeddings():
+    def __init__(self, dimension: int = 8):
+        self.dimension = dimension
+        self.calls: List[List[str]] = []
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        self.calls.append(list(texts))
+        return [[float(len(text) + i) for i in range(self.dimension)] for text in texts]
+
+
+def expected(texts: List[str], dimension: int = 8) -> np.ndarray:
+    return np.array([[float(len(text) + i) for i in range(dimension)] for text in texts], dtype=np.float32)
+
+
+def test_embed_only_misses():
+    with tempfile.TemporaryDirectory() as directory:
+        fake = FakeEmbeddings()
+        cache = EmbeddingCache(directory, 'model', max_rows=100)
+
+        assert np.array_equal(cache.embed(['a', 'bb'], fake.embed), expected(['a', 'bb']))
+        assert np.array_equal(cache.embed(['bb', 'ccc', 'a'], fake.embed), expected(['bb', 'ccc', 'a']))
+        assert fake.calls == [['a', 'bb'], ['ccc']]
+
+        reloaded = EmbeddingCache(directory, 'model', max_rows=100)
+        assert np.array_equal(reloaded.embed(['ccc', 'a'], fake.embed), expected(['ccc', 'a']))
+        assert len(fake.calls) == 2
+
+
+def test_embed_nothing():
+    with tempfile.TemporaryDirectory() as directory:
+        fake = FakeEmbeddings()
+        cache = EmbeddingCache(directory, 'model', max_rows=100)
+        assert cache.embed([], fake.embed).shape == (0, 0)
+
+        cache.embed(['a'], fake.embed)
+        empty = cache.embed([], fake.embed)
+        assert empty.shape == (0, 8) and empty.dtype == np.float32
+        assert fake.calls == [['a']]
+
+
+def test_embed_across_max_rows_keeps_hits():
+    with tempfile.TemporaryDirectory() as directory:
+        fake = FakeEmbeddings()
+        cache = EmbeddingCache(directory, 'model', max_rows=4)
+
+        cache.embed(['a', 'bb', 'ccc'], fake.embed)
+        # 'a' and 'bb' are hits, but the two misses push the cache over max_rows and reset it
+        texts = ['a', 'bb', 'dddd', 'eeeee']
+        assert np.array_equal(cache.embed(texts, fake.embed), expected(texts))
+        assert fake.calls[1:] == [['dddd', 'eeeee'], ['a', 'bb']]
+        assert np.array_equal(cache.embed(texts, fake.embed), expected(texts))
+        assert len(fake.calls) == 3
+
+
+def test_embed_dimension_change_reembeds_hits():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = EmbeddingCache(directory, 'model', max_rows=100)
+        cache.embed(['a', 'bb'], FakeEmbeddings(dimension=8).embed)
+
+        fake = FakeEmbeddings(dimension=4)
+        texts = ['a', 'ccc']
+        assert np.array_equal(cache.embed(texts, fake.embed), expected(texts, dimension=4))
+        assert fake.calls == [['ccc'], ['a']]
+
+
+def test_workers_sharing_a_directory():
+    # each instance has its own lock file description, like separate worker processes
+    with tempfile.TemporaryDirectory() as directory:
+        fake = FakeEmbeddings()
+        first = EmbeddingCache(directory, 'model', max_rows=100)
+        second = EmbeddingCache(directory, 'model', max_rows=100)
+
+        first.embed(['a', 'bb'], fake.embed)
+        second.embed(['ccc', 'dddd'], fake.embed)
+        first.embed(['eeeee'], fake.embed)
+        # rows appended by the other worker are hits
+        texts = ['a', 'bb', 'ccc', 'dddd', 'eeeee']
+        assert np.array_equal(second.embed(texts, fake.embed), expected(texts))
+        assert np.array_equal(first.embed(texts, fake.embed), expected(texts))
+        assert len(fake.calls) == 3
+
+        reloaded = EmbeddingCache(directory, 'model', max_rows=100)
+        assert np.array_equal(reloaded.embed(texts, fake.embed), expected(texts))
+        assert len(fake.calls) == 3
+
+
+def test_reset_by_another_worker():
+    with tempfile.TemporaryDirectory() as directory:
+        fake = FakeEmbeddings()
+        first = EmbeddingCache(directory, 'model', max_rows=3)
+        second = EmbeddingCache(directory, 'model', max_rows=3)
+
+        first.embed(['a', 'bb', 'ccc'], fake.embed)
+        assert np.array_equal(second.embed(['a'], fake.embed), expected(['a']))
+        # second resets the shared cache, first has to drop the rows it had mapped
+        second.embed(['dddd', 'eeeee'], fake.embed)
+        texts = ['ccc', 'dddd', 'eeeee']
+        assert np.array_equal(first.embed(texts, fake.embed), expected(texts))
+        assert fake.calls[-1] == ['ccc']
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from typing import Dict, List
+
+import pytest
+
+REPOSITORY_DIRECTORY = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(REPOSITORY_DIRECTORY)
+# the default config, if there isn't one in ~/.config/llmvm
+if not os.path.exists(os.path.expanduser('~/.config/llmvm/config.yaml')):
+    os.environ.setdefault('LLMVM_CONFIG', os.path.join(REPOSITORY_DIRECTORY, 'llmvm', 'config.yaml'))
+
+from llmvm.common.helpers import write_client_stream
+from llmvm.common.objects import AstNode, Content
+from llmvm.common.runtime_bridge import run_coroutine, run_in_worker
+
+
+async def llm_call(session: str, i: int) -> str:
+    # stands in for an llm call, which has to run on the request's event loop
+    await asyncio.sleep(0.01)
+    return f'{session} {i} on {threading.current_thread().name}'
+
+
+def generated_code(session: str, tokens: int, block: float) -> List[str]:
+    # stands in for PythonRuntime.run: blocking work, llm calls and client stream writes
+    results = []
+    for i in range(tokens):
+        time.sleep(block)
+        results.append(run_coroutine(llm_call(session, i)))
+        write_client_stream(Content(f'{session} token {i}'))
+    return results
+
+
+def test_two_sessions_run_concurrently():
+    tokens, block = 5, 0.1
+    streamed: Dict[str, List[str]] = {}
+
+    async def session(name: str) -> List[str]:
+        streamed[name] = []
+
+        async def stream_handler(node: AstNode):
+            streamed[name].append(node.get_str())  # type: ignore
+
+        return await run_in_worker(generated_code, name, tokens, block, stream_handler=stream_handler)
+
+    async def main():
+        loop_thread = threading.current_thread().name
+        start = time.perf_counter()
+        results = await asyncio.gather(session('a'), session('b'))
+        return loop_thread, results, time.perf_counter() - start
+
+    loop_thread, results, elapsed = asyncio.run(main())
+
+    # run one after the other this would take 2 * tokens * block
+    assert elapsed < 1.5 * tokens * block
+    # llm calls were bridged back to the request loop
+    assert all(result.endswith(f'on {loop_thread}') for session_results in results for result in session_results)
+    # each session's writes went to its own stream
+    assert streamed['a'] == [f'a token {i}' for i in range(tokens)]
+    assert streamed['b'] == [f'b token {i}' for i in range(tokens)]
+
+
+def test_download_on_worker_thread(monkeypatch):
+    pytest.importorskip('playwright')
+    from llmvm.server.base_library import content_downloader
+
+    closed = []
+
+    class Chrome():
+        def __init__(self, cookies=[]):
+            pass
+
+        async def pdf_url(self, url: str) -> str:
+            await asyncio.sleep(0.01)
+            return '/tmp/downloaded.pdf'
+
+        async def close(self):
+            closed.append(url)
+
+    monkeypatch.setattr(content_downloader, 'ChromeHelpers', Chrome)
+    url = 'https://example.com/paper.pdf'
+
+    async def session():
+        downloader = content_downloader.WebAndContentDriver()
+        return await run_in_worker(downloader.download, {'url': url, 'goal': '', 'search_term': ''})
+
+    async def main():
+        return await asyncio.gather(session(), session())
+
+    results = asyncio.run(main())
+    assert [result.url for result in results] == ['/tmp/downloaded.pdf', '/tmp/downloaded.pdf']
+    assert len(closed) == 2